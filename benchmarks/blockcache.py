@@ -0,0 +1,120 @@
+'''
+Block cache benchmark: Passthrough reads with and without
+pysinter.examples.blockcache, sequential and random, over a backing store
+with an injected per-call latency standing in for a network round trip.
+
+    python -m benchmarks.blockcache
+    python -m benchmarks.blockcache --latency 2 --request-size 4096 --depth 4
+'''
+
+from argparse import ArgumentParser
+from asyncio import run, gather
+from json import dumps
+from os import O_RDONLY, pread, urandom
+from random import Random
+from tempfile import TemporaryDirectory
+from time import perf_counter, sleep
+
+from pysinter import Header, ROOT_INODE
+from pysinter.examples.blockcache import BlockCache, DEFAULT_BLOCKSIZE, DEFAULT_BUDGET, DEFAULT_PREFETCH
+from pysinter.examples.passthrough import Passthrough
+
+PATTERNS = ('sequential', 'random')
+
+def mk_slow_pread(latency):
+    def slow_pread(fd, size, offset):
+        sleep(latency)
+        return pread(fd, size, offset)
+    return slow_pread
+
+def mk_offsets(pattern, filesize, request_size, count, seed=0):
+    if pattern == 'sequential':
+        return [(i * request_size) % filesize for i in range(count)]
+    rng = Random(seed)
+    slots = filesize // request_size
+    return [rng.randrange(slots) * request_size for _ in range(count)]
+
+async def run_reads(passthrough, name, offsets, request_size, depth):
+    '''
+    Issue the reads with up to depth outstanding, in order, like the
+    kernel's readahead does. Returns the elapsed time.
+    '''
+    _, res = await passthrough.lookup(Header(1, 1, ROOT_INODE, 0, 0, 0), {'name': name})
+    ino = res['entry'][0]['nodeId']
+    _, res = await passthrough.open(Header(14, 1, ino, 0, 0, 0), {'flags': O_RDONLY})
+    fh = res['fh']
+    header = Header(15, 1, ino, 0, 0, 0)
+    start = perf_counter()
+    for pos in range(0, len(offsets), depth):
+        await gather(*(
+            passthrough.read(header, {'fh': fh, 'offset': offset, 'size': request_size})
+            for offset in offsets[pos:pos + depth]
+            ))
+    elapsed = perf_counter() - start
+    await passthrough.release(header, {'fh': fh})
+    return elapsed
+
+def run_one(path, cached, pattern, args):
+    pread_ = mk_slow_pread(args.latency / 1000)
+    cache = None
+    if cached:
+        cache = BlockCache(
+            blocksize=args.blocksize
+            , budget=args.budget
+            , prefetch=args.prefetch
+            , pread=pread_
+            )
+    dirname, name = path.rsplit('/', 1)
+    passthrough = Passthrough(dirname, cache=cache, pread=pread_)
+    try:
+        offsets = mk_offsets(pattern, args.filesize, args.request_size, args.requests)
+        elapsed = run(run_reads(passthrough, name.encode(), offsets, args.request_size, args.depth))
+    finally:
+        passthrough.close()
+        if cache is not None:
+            cache.close()
+    res = {
+        'ops_per_sec': len(offsets) / elapsed
+        , 'mib_per_sec': len(offsets) * args.request_size / elapsed / (1 << 20)
+        }
+    if cache is not None:
+        res['cache'] = cache.stats()
+    return res
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--filesize', type=int, default=64 << 20)
+    parser.add_argument('--request-size', type=int, default=4096, help='Bytes per READ')
+    parser.add_argument('--requests', type=int, default=4000)
+    parser.add_argument('--depth', type=int, default=1, help='Outstanding READs')
+    parser.add_argument('--latency', type=float, default=1.0, help='Milliseconds per backing pread')
+    parser.add_argument('--blocksize', type=int, default=DEFAULT_BLOCKSIZE)
+    parser.add_argument('--budget', type=int, default=DEFAULT_BUDGET)
+    parser.add_argument('--prefetch', type=int, default=DEFAULT_PREFETCH)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        path = f'{tmpdir}/data'
+        with open(path, 'wb') as handle:
+            for _ in range(0, args.filesize, 1 << 20):
+                handle.write(urandom(1 << 20))
+        for pattern in PATTERNS:
+            for cached in (False, True):
+                name = f'{pattern}-{"cache" if cached else "direct"}'
+                res = results[name] = run_one(path, cached, pattern, args)
+                if not args.json:
+                    cache = res.get('cache')
+                    print(
+                        f'{name:<20}{res["ops_per_sec"]:>10.0f} ops/s {res["mib_per_sec"]:>8.1f} MiB/s'
+                        + ('' if cache is None else
+                            f'  hits {cache["hits"]} prefetch hits {cache["prefetch_hits"]}'
+                            f' misses {cache["misses"]}'
+                            )
+                        )
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
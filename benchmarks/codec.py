@@ -0,0 +1,241 @@
+'''
+Codec benchmark: parse and format throughput of every opcode in both
+directions, for each codec engine, compared against a stored baseline.
+
+    python -m benchmarks.codec
+    python -m benchmarks.codec --engine dynamic --check
+    python -m benchmarks.codec --update-baseline
+
+Messages come from pysinter.samples. Each engine parses the wire bytes into
+its own representation and formats that back; cases an engine cannot round
+trip to the same bytes are reported as unsupported and not timed.
+Rates are compared to the baseline relative to a fixed calibration workload
+measured next to each case, which takes out most of the machine speed, and
+the check fails when the geometric mean over all cases of an engine drops
+by more than the threshold. Single slow cases are only reported.
+Further engines, e.g. compiled ones, are added with --add-engine
+name=module:attribute, naming a factory like the ones in ENGINES.
+'''
+
+from argparse import ArgumentParser
+from importlib import import_module
+from json import dumps, load
+from math import exp, fsum, log
+from logging import getLogger
+from os.path import dirname, join as pjoin
+from time import perf_counter
+
+from pysinter.dynamic import Formatter, StructPlans
+from pysinter.helper import load_protocol
+from pysinter.samples import mk_samples
+
+LOGGER = getLogger(__name__)
+DEFAULT_PROTOCOL = pjoin(dirname(dirname(__file__)), 'tests', 'protocol.json')
+DEFAULT_VERSION = 'v7.31'
+DEFAULT_BASELINE = pjoin(dirname(__file__), 'codec-baseline.json')
+DEFAULT_THRESHOLD = 0.3
+
+def _dynamic_formatter(plans, protocol, opname, direction):
+    fmt = Formatter(LOGGER, plans, opname, protocol['operations'][opname][direction])
+    def format_(inpt):
+        return b''.join(val for _, val in fmt.generate_fields(inpt))
+    return fmt, format_
+
+def dynamic_engine(protocol):
+    '''
+    The schema-driven codec in pysinter.dynamic.
+    '''
+    plans = StructPlans(protocol['structs'])
+    def codec(opname, direction):
+        fmt, format_ = _dynamic_formatter(plans, protocol, opname, direction)
+        return fmt.parse, format_
+    return codec
+
+def dynamic_view_engine(protocol):
+    '''
+    The lazy request views of pysinter.dynamic, decoded completely.
+    '''
+    plans = StructPlans(protocol['structs'])
+    def codec(opname, direction):
+        fmt, format_ = _dynamic_formatter(plans, protocol, opname, direction)
+        def parse(inpt):
+            return dict(fmt.view(inpt))
+        return parse, format_
+    return codec
+
+def old_engine(protocol):
+    '''
+    The flattened codec in pysinter._dynamic_old.
+    '''
+    from pysinter._dynamic_old import Formatter as OldFormatter
+    def codec(opname, direction):
+        fmt = OldFormatter(protocol['structs'], opname, protocol['operations'][opname][direction])
+        def format_(inpt):
+            return b''.join(fmt.generate_fields(inpt))
+        return fmt.parse, format_
+    return codec
+
+ENGINES = {
+    'dynamic': dynamic_engine
+    , 'dynamic-view': dynamic_view_engine
+    , 'old': old_engine
+    }
+
+def _resolve_engine(spec):
+    name, _, target = spec.partition('=')
+    modname, _, attrname = target.partition(':')
+    if not (name and modname and attrname):
+        raise ValueError('Engines are added as name=module:attribute', spec)
+    return name, getattr(import_module(modname), attrname)
+
+def mk_cases(protocol):
+    '''
+    The wire bytes of every sample message, keyed by 'OPCODE.direction'.
+    '''
+    format_with = dynamic_engine(protocol)
+    res = {}
+    for opname, direction, sample in mk_samples(protocol):
+        _, format_ = format_with(opname, direction)
+        res[f'{opname}.{direction}'] = (opname, direction, format_(sample))
+    return res
+
+def _rate(function, arg, mintime):
+    '''
+    Calls per second, the best of three runs of at least mintime each.
+    '''
+    number = 1
+    while True:
+        start = perf_counter()
+        for _ in range(number):
+            function(arg)
+        elapsed = perf_counter() - start
+        if elapsed >= mintime:
+            break
+        number = number * 2 if elapsed <= 0 else max(number * 2, int(number * mintime * 1.2 / elapsed))
+    best = elapsed
+    for _ in range(2):
+        start = perf_counter()
+        for _ in range(number):
+            function(arg)
+        best = min(best, perf_counter() - start)
+    return number / best
+
+def _calibration_work(values):
+    return b''.join(value.to_bytes(8, 'little') for value in values)
+
+def calibrate(mintime=0.01):
+    '''
+    Rate of a fixed workload resembling formatting, as a machine speed unit.
+    '''
+    return _rate(_calibration_work, tuple(range(64)), mintime)
+
+def run_engine(factory, protocol, cases, mintime=0.01):
+    '''
+    Round-trip check and throughput per case. Returns a dictionary of case
+    name to {'parse': ops/s, 'format': ops/s, 'calibration': ops/s} and a
+    list of unsupported cases.
+    '''
+    codec = factory(protocol)
+    results = {}
+    unsupported = []
+    for casename, (opname, direction, msg) in cases.items():
+        try:
+            parse, format_ = codec(opname, direction)
+            parsed = parse(msg)
+            supported = format_(parsed) == msg
+        except Exception:
+            supported = False
+        if not supported:
+            unsupported.append(casename)
+            continue
+        results[casename] = {
+            'calibration': calibrate(mintime)
+            , 'parse': _rate(parse, msg, mintime)
+            , 'format': _rate(format_, parsed, mintime)
+            }
+    return results, unsupported
+
+def compare(results, baseline, threshold):
+    '''
+    Compare calibrated rates to the baseline per engine and operation.
+    Returns (engine, operation, geometric mean of the speed ratios, slowest
+    cases as (ratio, case name)) tuples. Cases missing from the baseline are
+    not compared.
+    '''
+    res = []
+    for engine, cases in results.items():
+        ratios = {}
+        for casename, rates in cases.items():
+            base = baseline.get(engine, {}).get(casename)
+            if base is None:
+                continue
+            for operation in ('parse', 'format'):
+                ratio = (
+                    (rates[operation] / rates['calibration'])
+                    / (base[operation] / base['calibration'])
+                    )
+                ratios.setdefault(operation, []).append((ratio, casename))
+        for operation, opratios in ratios.items():
+            geomean = exp(fsum(log(ratio) for ratio, _ in opratios) / len(opratios))
+            res.append((engine, operation, geomean, sorted(opratios)[:3]))
+    return res
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--engine', action='append', help=f'One of {", ".join(ENGINES)}; repeatable')
+    parser.add_argument('--add-engine', action='append', default=[], help='name=module:attribute')
+    parser.add_argument('--mintime', type=float, default=0.01, help='Seconds per measurement')
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE)
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD, help='Tolerated slowdown as a fraction')
+    parser.add_argument('--check', action='store_true', help='Exit with failure on regressions')
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    engines = dict(ENGINES)
+    engines.update(_resolve_engine(spec) for spec in args.add_engine)
+    cases = mk_cases(protocol)
+    results = {}
+    for name in args.engine or engines:
+        results[name], unsupported = run_engine(engines[name], protocol, cases, args.mintime)
+        if not args.json:
+            rates = results[name].values()
+            parse_total = len(rates) / sum(1 / rate['parse'] for rate in rates)
+            format_total = len(rates) / sum(1 / rate['format'] for rate in rates)
+            print(
+                f'{name:<16}{len(rates):>4} cases  parse {parse_total:>10.0f} msg/s'
+                f'  format {format_total:>10.0f} msg/s'
+                f'  unsupported: {", ".join(unsupported) or "none"}'
+                )
+    if args.json:
+        print(dumps(results, indent=1))
+    if args.update_baseline:
+        try:
+            with open(args.baseline) as handle:
+                baseline = load(handle)
+        except FileNotFoundError:
+            baseline = {}
+        baseline.update(results)
+        with open(args.baseline, 'w') as handle:
+            handle.write(dumps(baseline, indent=1, sort_keys=True) + '\n')
+        return None
+    if args.check:
+        with open(args.baseline) as handle:
+            baseline = load(handle)
+        failed = False
+        for engine, operation, geomean, slowest in compare(results, baseline, args.threshold):
+            regressed = geomean < 1 - args.threshold
+            failed = failed or regressed
+            print(
+                f'{"REGRESSION" if regressed else "ok":<12}{engine:<16}{operation:<8}'
+                f'{geomean:>6.2f}x baseline, slowest: '
+                + ', '.join(f'{casename} {ratio:.2f}x' for ratio, casename in slowest)
+                )
+        if failed:
+            raise SystemExit(1)
+    return None
+
+if __name__ == '__main__':
+    main()
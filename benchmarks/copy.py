@@ -0,0 +1,102 @@
+'''
+Copy benchmark: copying a file through Passthrough served over the loopback
+harness, once as READ/WRITE pairs moving the data through the FUSE
+connection and once with COPY_FILE_RANGE, which keeps it in the kernel.
+
+    python -m benchmarks.copy
+    python -m benchmarks.copy --size 256 --chunk 65536
+'''
+
+from argparse import ArgumentParser
+from filecmp import cmp
+from json import dumps
+from os import O_RDONLY, O_RDWR, O_TRUNC, urandom
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from pysinter.examples.passthrough import Passthrough
+from pysinter.helper import load_protocol
+from pysinter.loopback import FakeKernel, LoopbackServer
+
+MODES = ('readwrite', 'copy_file_range')
+COPY_CHUNK_MAX = 1 << 30
+
+def _call(kernel, opname, fields, nodeid=1):
+    unique = kernel.request(opname, fields, nodeid=nodeid)
+    res_unique, errno, body = kernel.recv()
+    if res_unique != unique or errno:
+        raise RuntimeError(f'{opname} failed', res_unique, unique, errno)
+    return kernel.parse_reply(opname, body)
+
+def _open(kernel, name, flags):
+    entry, = _call(kernel, 'FUSE_LOOKUP', {'name': name})['entry']
+    ino = entry['nodeId']
+    return ino, _call(kernel, 'FUSE_OPEN', {'flags': flags}, nodeid=ino)['fh']
+
+def copy_readwrite(kernel, src, dst, size, chunk):
+    for offset in range(0, size, chunk):
+        data = _call(kernel, 'FUSE_READ', {'fh': src[1], 'offset': offset, 'size': chunk}, nodeid=src[0])['data']
+        _call(kernel, 'FUSE_WRITE', {
+            'fh': dst[1], 'offset': offset, 'size': len(data), 'data': data
+            }, nodeid=dst[0])
+    return None
+
+def copy_range(kernel, src, dst, size, chunk):
+    offset = 0
+    while offset < size:
+        copied = _call(kernel, 'FUSE_COPY_FILE_RANGE', {
+            'fhIn': src[1], 'offIn': offset, 'nodeidOut': dst[0], 'fhOut': dst[1]
+            , 'offOut': offset, 'len': min(size - offset, COPY_CHUNK_MAX), 'flags': 0
+            }, nodeid=src[0])['size']
+        if not copied:
+            raise RuntimeError('Short copy', offset, size)
+        offset = offset + copied
+    return None
+
+def run_mode(protocol, tmpdir, mode, size, chunk):
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, Passthrough(tmpdir).make()):
+            src = _open(kernel, b'src', O_RDONLY)
+            dst = _open(kernel, b'dst', O_RDWR | O_TRUNC)
+            start = perf_counter()
+            if mode == 'readwrite':
+                copy_readwrite(kernel, src, dst, size, chunk)
+            else:
+                copy_range(kernel, src, dst, size, chunk)
+            elapsed = perf_counter() - start
+            for ino, fh in (src, dst):
+                _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+    finally:
+        kernel.close_server()
+    if not cmp(f'{tmpdir}/src', f'{tmpdir}/dst', shallow=False):
+        raise RuntimeError('Copy differs from source', mode)
+    return {'seconds': elapsed, 'mib_per_sec': size / elapsed / (1 << 20)}
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--size', type=int, default=64, help='MiB to copy')
+    parser.add_argument('--chunk', type=int, default=1 << 16, help='Bytes per READ and WRITE')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    size = args.size << 20
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        with open(f'{tmpdir}/src', 'wb') as handle:
+            for _ in range(args.size):
+                handle.write(urandom(1 << 20))
+        open(f'{tmpdir}/dst', 'wb').close()
+        for mode in MODES:
+            res = results[mode] = run_mode(protocol, tmpdir, mode, size, args.chunk)
+            if not args.json:
+                print(f'{mode:<20}{res["mib_per_sec"]:>10.1f} MiB/s  {res["seconds"]:.3f}s')
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
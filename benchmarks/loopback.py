@@ -0,0 +1,79 @@
+'''
+Loopback benchmark: throughput and tail latency of Sinter + Operations + a
+handler set, driven by an in-process fake kernel instead of a mount.
+
+    python -m benchmarks.loopback --workload metadata
+    python -m benchmarks.loopback --protocol protocol.json --version '' --workload metadata
+    python -m benchmarks.loopback --workload lookup=3,getattr=1 --depth 64
+'''
+
+from argparse import ArgumentParser
+from json import dumps
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from pysinter.helper import load_protocol, import_handlers
+from pysinter.loopback import BENCH_DIR_ENTRIES, run_workload, WORKLOADS
+from pysinter.metrics import Metrics
+
+def print_summary(name, res):
+    print(
+        f'{name:<24}{res["ops_per_sec"]:>12.0f} ops/s'
+        f'  p50 {res["p50_us"]:>9.1f}us  p99 {res["p99_us"]:>9.1f}us'
+        f'  p99.9 {res["p999_us"]:>9.1f}us  max {res["max_us"]:>9.1f}us'
+        f'  errors {res["errors"] or 0}'
+        )
+    return None
+
+def print_phases(snapshot):
+    for opcode, opmetrics in snapshot['opcodes'].items():
+        phases = '  '.join(
+            f'{phase} p50 {hist["p50"] / 1000:.1f}us p99 {hist["p99"] / 1000:.1f}us'
+            for phase, hist in opmetrics['phases'].items()
+            )
+        print(f'    {opcode:<20}{phases}')
+    return None
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument(
+        '--workload', action='append'
+        , help=f'One of {", ".join(WORKLOADS)} or OPCODE=weight,...; repeatable'
+        )
+    parser.add_argument('--handlers', default=None, help='module:attribute, default synthetic')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--depth', type=int, default=16, help='Outstanding requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--direntries', type=int, default=BENCH_DIR_ENTRIES, help='Names in the directory looked up and read')
+    parser.add_argument('--metrics', action='store_true', help='Collect and show per-phase metrics')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    handlers = None if args.handlers is None else import_handlers(args.handlers)
+    results = {}
+    for workload in args.workload or WORKLOADS:
+        metrics = Metrics() if args.metrics else None
+        res = run_workload(
+            protocol
+            , workload
+            , handlers=handlers
+            , count=args.requests
+            , depth=args.depth
+            , seed=args.seed
+            , direntries=args.direntries
+            , metrics=metrics
+            )
+        if metrics is not None:
+            res['metrics'] = metrics.snapshot()
+        results[workload] = res
+        if not args.json:
+            print_summary(workload, res)
+            if metrics is not None:
+                print_phases(res['metrics'])
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
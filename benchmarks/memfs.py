@@ -0,0 +1,109 @@
+'''
+MemFS benchmark: the loopback workloads served by the in-memory filesystem
+of pysinter.examples.memfs next to the synthetic handlers, which do no
+work at all, and a namespace churn of CREATE, WRITE, GETATTR, RENAME,
+READDIRPLUS and UNLINK.
+
+    python -m benchmarks.memfs
+    python -m benchmarks.memfs --mmap --requests 50000
+    python -m benchmarks.loopback --handlers benchmarks.memfs:mk_handlers
+'''
+
+from argparse import ArgumentParser
+from json import dumps
+from os import O_RDWR
+from time import perf_counter
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from benchmarks.copy import _call
+from pysinter import ROOT_INODE
+from pysinter.examples.memfs import MemFS
+from pysinter.helper import load_protocol
+from pysinter.loopback import (
+    BENCH_DIR_ENTRIES, BENCH_FILE_SIZE, BENCH_INODE_FILE, FakeKernel, LoopbackServer
+    , WORKLOADS, mk_bench_handlers, run_workload
+    )
+
+def mk_memfs(use_mmap=False, filesize=BENCH_FILE_SIZE, direntries=BENCH_DIR_ENTRIES):
+    '''
+    A MemFS laid out like the synthetic handlers expect: the directory
+    entries in the root, the first of them a file of filesize bytes at
+    BENCH_INODE_FILE.
+    '''
+    fs = MemFS(use_mmap=use_mmap)
+    ino = fs.add(ROOT_INODE, b'file%08d' % 0, 0o644, data=bytes(filesize))
+    if ino != BENCH_INODE_FILE:
+        raise RuntimeError('Benchmark file at unexpected inode', ino)
+    for num in range(1, direntries):
+        fs.add(ROOT_INODE, b'file%08d' % num, 0o644)
+    return fs
+
+def mk_handlers():
+    return mk_memfs().make()
+
+def run_churn(protocol, fs, count, size):
+    '''
+    Create, fill, stat, rename, list, remove and forget count files one by
+    one. Returns operations per second and the inodes left, which should be
+    just the root and the churn directory.
+    '''
+    kernel = FakeKernel(protocol)
+    payload = bytes(size)
+    ops = 0
+    try:
+        with LoopbackServer(kernel, protocol, fs.make()):
+            directory = _call(kernel, 'FUSE_MKDIR', {'name': b'churn', 'mode': 0o755, 'umask': 0})['entry']['nodeId']
+            start = perf_counter()
+            for num in range(count):
+                name = b'new%08d' % num
+                created = _call(kernel, 'FUSE_CREATE', {
+                    'name': name, 'flags': O_RDWR, 'mode': 0o644, 'umask': 0
+                    }, nodeid=directory)
+                ino = created['entry']['nodeId']
+                _call(kernel, 'FUSE_WRITE', {'fh': created['fh'], 'offset': 0, 'size': size, 'data': payload}, nodeid=ino)
+                _call(kernel, 'FUSE_RELEASE', {'fh': created['fh']}, nodeid=ino)
+                _call(kernel, 'FUSE_GETATTR', {}, nodeid=ino)
+                _call(kernel, 'FUSE_RENAME', {'newdir': directory, 'oldname': name, 'newname': b'renamed'}, nodeid=directory)
+                _call(kernel, 'FUSE_READDIRPLUS', {'fh': directory, 'cookie': 0, 'size': 4096}, nodeid=directory)
+                _call(kernel, 'FUSE_UNLINK', {'name': b'renamed'}, nodeid=directory)
+                # CREATE and READDIRPLUS took references, FORGET gets no reply
+                kernel.request('FUSE_FORGET', {'nlookup': 2}, nodeid=ino)
+                ops = ops + 8
+            elapsed = perf_counter() - start
+            _call(kernel, 'FUSE_GETATTR', {}, nodeid=directory) # Behind the last FORGET
+    finally:
+        kernel.close_server()
+    return {'ops_per_sec': ops / elapsed, 'inodes_left': fs.stats()['inodes']}
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--requests', type=int, default=20000, help='Requests per loopback workload')
+    parser.add_argument('--depth', type=int, default=16, help='Outstanding requests')
+    parser.add_argument('--churn', type=int, default=2000, help='Files to cycle through in the churn')
+    parser.add_argument('--write-size', type=int, default=4096)
+    parser.add_argument('--mmap', action='store_true', help='Keep file contents in anonymous mmap regions')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    results = {}
+    for workload in WORKLOADS:
+        for name, handlers in (
+                ('synthetic', mk_bench_handlers())
+                , ('memfs', mk_memfs(use_mmap=args.mmap).make())
+                ):
+            res = run_workload(protocol, workload, handlers=handlers, count=args.requests, depth=args.depth)
+            results[f'{workload}-{name}'] = {'ops_per_sec': res['ops_per_sec'], 'p99_us': res['p99_us'], 'errors': res['errors']}
+    results['churn-memfs'] = run_churn(protocol, MemFS(use_mmap=args.mmap), args.churn, args.write_size)
+    if args.json:
+        print(dumps(results, indent=1))
+        return None
+    for name, res in results.items():
+        print(f'{name:<28}{res["ops_per_sec"]:>12.0f} ops/s' + (
+            f'  p99 {res["p99_us"]:>9.1f}us  errors {res["errors"] or 0}' if 'p99_us' in res else ''
+            ))
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+'''
+Many mounts from one process: memory, threads and throughput of serving N
+loopback mounts with a LoopbackServer (Sinter and Operations) each, against
+one pysinter.multiplex.Multiplexer serving them all.
+
+Memory is what tracemalloc sees allocated for the servers after every mount
+has answered the workload mix once, so all formatters in use are compiled.
+
+    python -m benchmarks.multiplex
+    python -m benchmarks.multiplex --mounts 64 --count 2000 --mix getattr=1,read=1
+'''
+
+from argparse import ArgumentParser
+from asyncio import run
+from json import dumps
+from logging import getLogger
+from threading import Thread, active_count
+from time import perf_counter
+from tracemalloc import start as trace_start, stop as trace_stop, take_snapshot
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from pysinter.helper import load_protocol
+from pysinter.loopback import (
+    FakeKernel, LoopbackServer, generate_requests, mk_bench_handlers, parse_mix
+    )
+from pysinter.multiplex import Multiplexer
+
+LOGGER = getLogger(__name__)
+
+def _traced():
+    return sum(stat.size for stat in take_snapshot().statistics('filename'))
+
+def _roundtrip(kernels, requests):
+    '''
+    Send each request to every mount, waiting for all replies in between.
+    '''
+    for name, nodeid, fields in requests:
+        for kernel in kernels:
+            kernel.request(name, fields, nodeid=nodeid)
+        for kernel in kernels:
+            kernel.recv()
+    return None
+
+def _measure(kernels, start, stop, mix, count):
+    warmup = generate_requests(mix, len(mix) * 4, seed=1)
+    trace_start()
+    threads = active_count()
+    before = _traced()
+    start()
+    _roundtrip(kernels, warmup)
+    memory = _traced() - before
+    threads = active_count() - threads
+    trace_stop()
+    requests = generate_requests(mix, count)
+    t_start = perf_counter()
+    _roundtrip(kernels, requests)
+    elapsed = perf_counter() - t_start
+    stop()
+    return {
+        'memory_bytes': memory
+        , 'threads': threads
+        , 'ops_per_sec': len(kernels) * count / elapsed
+        }
+
+def run_separate(protocol, mounts, mix, count):
+    kernels = [FakeKernel(protocol) for _ in range(mounts)]
+    servers = [LoopbackServer(kernel, protocol, mk_bench_handlers()) for kernel in kernels]
+    def start():
+        for server in servers:
+            server.start()
+        return None
+    def stop():
+        for server in servers:
+            server.stop()
+        return None
+    try:
+        return _measure(kernels, start, stop, mix, count)
+    finally:
+        for kernel in kernels:
+            kernel.close_server()
+
+def run_multiplexed(protocol, mounts, mix, count):
+    kernels = [FakeKernel(protocol) for _ in range(mounts)]
+    handlers = [mk_bench_handlers() for _ in range(mounts)]
+    thread = Thread(target=lambda: run(mux.serve()), daemon=True)
+    def start():
+        for num, kernel in enumerate(kernels):
+            mux.add(num, kernel.fd, handlers[num])
+        thread.start()
+        return None
+    def stop():
+        mux.stop()
+        thread.join()
+        return None
+    mux = Multiplexer(protocol, LOGGER)
+    try:
+        return _measure(kernels, start, stop, mix, count)
+    finally:
+        for kernel in kernels:
+            kernel.close()
+            kernel.close_server()
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--mounts', type=int, default=16)
+    parser.add_argument('--count', type=int, default=1000, help='Requests per mount')
+    parser.add_argument('--mix', default='lookup=1,getattr=2,read=2')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    mix = parse_mix(args.mix)
+    results = {}
+    for name, function in (('separate', run_separate), ('multiplexed', run_multiplexed)):
+        res = results[name] = function(protocol, args.mounts, mix, args.count)
+        if not args.json:
+            print(
+                f'{name:<14}{res["memory_bytes"] / args.mounts / 1024:>10.1f} KiB/mount'
+                f'{res["threads"]:>6} threads{res["ops_per_sec"]:>12.0f} ops/s'
+                )
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+'''
+Remote backend benchmark: LOOKUP and READ throughput of BackendFS over the
+loopback harness, on the local backend directly and through RemoteBackend
+and the stand-in BackendServer with injected latency, at several queue
+depths. Shows how much of the backend latency concurrency, pipelining and
+stat batching hide.
+
+    python -m benchmarks.remote
+    python -m benchmarks.remote --latency 0,0.002 --depth 1,64 --requests 2000
+'''
+
+from argparse import ArgumentParser
+from json import dumps
+from os import mkdir
+from os.path import join as pjoin
+from random import Random
+from tempfile import TemporaryDirectory
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from benchmarks.copy import _call
+from pysinter.examples.backend import LocalBackend
+from pysinter.examples.backendfs import BackendFS
+from pysinter.examples.remote import BackendServer, RemoteBackend
+from pysinter.helper import load_protocol
+from pysinter.loopback import FakeKernel, LoopbackServer, drive, summarize
+
+WORKLOADS = ('lookup', 'read')
+READ_SIZE = 1 << 17
+
+def _requests(workload, count, files, filesize, ino):
+    rand = Random(0)
+    if workload == 'lookup':
+        return [('FUSE_LOOKUP', 1, {'name': b'file%06d' % rand.randrange(files)}) for _ in range(count)]
+    return [
+        ('FUSE_READ', ino, {'fh': 0, 'offset': (num * READ_SIZE) % filesize, 'size': READ_SIZE})
+        for num in range(count)
+        ]
+
+def run_case(protocol, backend, workload, count, depth, files, filesize):
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, BackendFS(backend, timeout=0).make()):
+            entry, = _call(kernel, 'FUSE_LOOKUP', {'name': b'data'})['entry']
+            requests = _requests(workload, count, files, filesize, entry['nodeId'])
+            res = summarize(*drive(kernel, requests, depth=depth))
+    finally:
+        kernel.close_server()
+    return {'ops_per_sec': res['ops_per_sec'], 'p99_us': res['p99_us'], 'errors': res['errors']}
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--latency', default='0,0.001', help='Comma separated backend latencies in seconds')
+    parser.add_argument('--depth', default='1,16,64', help='Comma separated queue depths')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests per case')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--file-size', type=int, default=16, help='MiB')
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    filesize = args.file_size << 20
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        root = pjoin(tmpdir, 'root')
+        socket = pjoin(tmpdir, 'socket')
+        local = LocalBackend(root)
+        mkdir(root)
+        for num in range(args.files):
+            open(pjoin(root, 'file%06d' % num), 'wb').close()
+        with open(pjoin(root, 'data'), 'wb') as handle:
+            handle.truncate(filesize)
+        cases = [('local', None)] + [(f'remote-{latency}s', float(latency)) for latency in args.latency.split(',')]
+        for name, latency in cases:
+            for depth in (int(depth) for depth in args.depth.split(',')):
+                for workload in WORKLOADS:
+                    key = f'{workload}-{name}-depth{depth}'
+                    if latency is None:
+                        res = run_case(protocol, local, workload, args.requests, depth, args.files, filesize)
+                    else:
+                        backend = RemoteBackend(socket, max_connections=args.connections)
+                        with BackendServer(local, socket, latency=latency):
+                            res = run_case(protocol, backend, workload, args.requests, depth, args.files, filesize)
+                        res.update(backend.stats())
+                    results[key] = res
+                    if not args.json:
+                        extra = f'  {res["requests"]} backend requests' if 'requests' in res else ''
+                        print(f'{key:<32}{res["ops_per_sec"]:>10.0f} ops/s  p99 {res["p99_us"]:>9.1f}us{extra}')
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
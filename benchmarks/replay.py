@@ -0,0 +1,82 @@
+'''
+Replay a recorded trace through Operations with a chosen handler set, to
+measure codec and handler changes against captured traffic.
+
+Record with Sinter(trace=...) or PYSINTER_TRACE for python -m pysinter, then:
+
+    python -m benchmarks.replay trace.bin --handlers pysinter.examples.hello:FS_HELLO
+    python -m benchmarks.replay trace.bin --handlers ... --realtime --speed 2
+    python -m benchmarks.replay trace.bin --dump
+'''
+
+from argparse import ArgumentParser
+from asyncio import run
+from logging import getLogger
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from pysinter import HEADER_SIZE_RECV, parse_header_req
+from pysinter.dynamic import Operations
+from pysinter.helper import load_protocol, import_handlers
+from pysinter.loopback import percentile
+from pysinter.trace import read_trace, split_reply, TRACE_SESSION, TRACE_REQUEST
+
+LOGGER = getLogger(__name__)
+
+def dump(path, names):
+    for kind, timestamp, frame in read_trace(path):
+        if kind == TRACE_SESSION:
+            print(f'{timestamp:>20} session started at {frame} ns')
+        elif kind == TRACE_REQUEST:
+            header = parse_header_req(frame)
+            name = names.get(header.opcode, header.opcode)
+            print(f'{timestamp:>20} -> {name} {header} {len(frame) - HEADER_SIZE_RECV} bytes')
+        else:
+            unique, errno, body = split_reply(frame)
+            print(f'{timestamp:>20} <- unique={unique} errno={errno} {len(body)} bytes')
+    return None
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('trace')
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--handlers', help='module:attribute')
+    parser.add_argument('--realtime', action='store_true', help='Keep the recorded pace')
+    parser.add_argument('--speed', type=float, default=1.0)
+    parser.add_argument('--depth', type=int, default=64, help='Requests in flight without --realtime')
+    parser.add_argument('--verify', action='store_true', help='Compare replies with the recorded ones')
+    parser.add_argument('--dump', action='store_true', help='List the records instead')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    names = {value: name for name, value in protocol['opcodes'].items()}
+    if args.dump:
+        return dump(args.trace, names)
+    if args.handlers is None:
+        parser.error('--handlers is required for replay')
+    ops = Operations(LOGGER, protocol, import_handlers(args.handlers))
+    from pysinter.trace import replay
+    elapsed, latencies, mismatches = run(replay(
+        args.trace
+        , ops
+        , realtime=args.realtime
+        , speed=args.speed
+        , verify=args.verify
+        , depth=args.depth
+        ))
+    total = sum(len(values) for values in latencies.values())
+    print(f'{total} requests in {elapsed:.3f}s, {total / elapsed if elapsed else 0:.0f} requests/s')
+    if mismatches is not None:
+        print(f'{mismatches} replies differ from the recording')
+    print(f'{"opcode":<24}{"count":>8}{"p50 us":>10}{"p99 us":>10}{"max us":>10}')
+    for opcode, values in sorted(latencies.items()):
+        ordered = sorted(values)
+        print(
+            f'{names.get(opcode, opcode):<24}{len(ordered):>8}'
+            f'{percentile(ordered, 0.5) / 1000:>10.1f}'
+            f'{percentile(ordered, 0.99) / 1000:>10.1f}'
+            f'{ordered[-1] / 1000:>10.1f}'
+            )
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Splice benchmark: sequential READ and WRITE throughput of a large file
+through Passthrough served over the loopback harness, with the data copied
+through Python buffers and with Sinter(splice=True).
+
+    python -m benchmarks.splice
+    python -m benchmarks.splice --size 512 --chunk 65536
+'''
+
+from argparse import ArgumentParser
+from json import dumps
+from os import O_RDWR, urandom
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from benchmarks.copy import _call, _open
+from pysinter.examples.passthrough import Passthrough
+from pysinter.helper import load_protocol
+from pysinter.loopback import FakeKernel, LoopbackServer
+from pysinter.splice import splice_available
+
+def run_transport(protocol, tmpdir, splice, size, chunk):
+    kernel = FakeKernel(protocol)
+    res = {}
+    try:
+        handlers = Passthrough(tmpdir, splice=splice).make()
+        with LoopbackServer(kernel, protocol, handlers, splice=splice) as server:
+            target = _open(kernel, b'data', O_RDWR)
+            ino, fh = target
+            payload = urandom(chunk)
+            start = perf_counter()
+            for offset in range(0, size, chunk):
+                _call(kernel, 'FUSE_WRITE', {
+                    'fh': fh, 'offset': offset, 'size': chunk, 'data': payload
+                    }, nodeid=ino)
+            res['write_mib_per_sec'] = size / (perf_counter() - start) / (1 << 20)
+            start = perf_counter()
+            for offset in range(0, size, chunk):
+                _call(kernel, 'FUSE_READ', {'fh': fh, 'offset': offset, 'size': chunk}, nodeid=ino)
+            res['read_mib_per_sec'] = size / (perf_counter() - start) / (1 << 20)
+            _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+            transport = server.sinter._splice
+            if transport is not None:
+                res['spliced_requests'] = transport.spliced_requests
+                res['spliced_replies'] = transport.spliced_replies
+    finally:
+        kernel.close_server()
+    return res
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--size', type=int, default=256, help='MiB to write and read')
+    parser.add_argument('--chunk', type=int, default=1 << 16, help='Bytes per READ and WRITE')
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        open(f'{tmpdir}/data', 'wb').close()
+        for splice in (False, True) if splice_available() else (False,):
+            name = 'splice' if splice else 'copy'
+            res = results[name] = run_transport(protocol, tmpdir, splice, args.size << 20, args.chunk)
+            if not args.json:
+                print(
+                    f'{name:<10}write {res["write_mib_per_sec"]:>8.1f} MiB/s'
+                    f'  read {res["read_mib_per_sec"]:>8.1f} MiB/s'
+                    )
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+'''
+Startup benchmark: time from process start to the FUSE_INIT reply.
+
+A FUSE_INIT request is queued on one end of a socket pair, then a fresh
+interpreter is started with the other end in FUSEFD, the same way a mount
+helper hands over /dev/fuse. The child imports pysinter, builds Operations
+and answers the request; the parent measures the wall clock time until the
+reply arrives. The child reports its own breakdown on stdout.
+
+    python -m benchmarks.startup --runs 20
+    python -m benchmarks.startup --protocol path/to/protocol.json --version '' --runs 20
+'''
+
+from argparse import ArgumentParser
+from json import dumps, loads
+from os import close, environ
+from os.path import dirname, join as pjoin
+from socket import socketpair, AF_UNIX, SOCK_SEQPACKET
+from statistics import median
+from subprocess import Popen, PIPE
+from sys import executable
+from time import perf_counter
+
+# As in benchmarks.codec, which is not imported to keep pysinter out of the
+# child's measured imports
+DEFAULT_PROTOCOL = pjoin(dirname(dirname(__file__)), 'tests', 'protocol.json')
+DEFAULT_VERSION = 'v7.31'
+DEFAULT_HANDLERS = 'pysinter.examples.hello:FS_HELLO'
+
+def child(protocol_path, version, handlers):
+    '''
+    Serve exactly one request from FUSEFD, then report timings.
+    '''
+    t_start = perf_counter()
+    from asyncio import run
+    from logging import getLogger
+    from pysinter import Sinter
+    from pysinter.dynamic import Operations
+    from pysinter.helper import load_protocol, import_handlers
+    t_import = perf_counter()
+    protocol = load_protocol(protocol_path, version)
+    s = Sinter(fd='FUSEFD')
+    ops = Operations(getLogger('startup'), protocol, import_handlers(handlers))
+    t_setup = perf_counter()
+    header, msg = s._recv()
+    run(ops._complete_one(s.tx_async, header, msg))
+    header, errno, res = s.tx_sync.get()
+    s._send(header, errno, res)
+    t_reply = perf_counter()
+    print(dumps({
+        'import': t_import - t_start
+        , 'setup': t_setup - t_import
+        , 'first_request': t_reply - t_setup
+        }))
+    return None
+
+def init_request(protocol_path, version):
+    from logging import getLogger
+    from pysinter import Header, format_header_req
+    from pysinter.dynamic import Operations
+    from pysinter.helper import load_protocol
+    protocol = load_protocol(protocol_path, version)
+    opcode = protocol['opcodes']['FUSE_INIT']
+    ops = Operations(getLogger('startup'), protocol, {})
+    body = ops.format_input(opcode, {
+        'major': 7
+        , 'minor': 31
+        , 'maxReadAhead': 0x20000
+        , 'flags': 0
+        })
+    return format_header_req(Header(opcode, 1, 0, 0, 0, 0), len(body)) + body
+
+def run_once(protocol_path, version, handlers, request):
+    kernel, server = socketpair(AF_UNIX, SOCK_SEQPACKET)
+    kernel.send(request)
+    cmd = [
+        executable, '-m', 'benchmarks.startup', '--child', '--handlers', handlers
+        , '--protocol', protocol_path, '--version', version or ''
+        ]
+    env = dict(environ, FUSEFD=str(server.fileno()))
+    t_start = perf_counter()
+    proc = Popen(cmd, env=env, stdout=PIPE, pass_fds=(server.fileno(),))
+    reply = kernel.recv(65536)
+    t_reply = perf_counter()
+    out, _ = proc.communicate()
+    kernel.close()
+    server.close()
+    if proc.returncode or len(reply) < 16:
+        raise RuntimeError('Child failed', proc.returncode, reply)
+    res = loads(out)
+    res['total'] = t_reply - t_start
+    return res
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--handlers', default=DEFAULT_HANDLERS)
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--child', action='store_true', help='internal')
+    args = parser.parse_args()
+    version = args.version or None
+    if args.child:
+        return child(args.protocol, version, args.handlers)
+    request = init_request(args.protocol, version)
+    results = [
+        run_once(args.protocol, version, args.handlers, request)
+        for _ in range(args.runs)
+        ]
+    print(f'{"phase":<16}{"min ms":>10}{"median ms":>12}{"max ms":>10}')
+    for phase in ('import', 'setup', 'first_request', 'total'):
+        values = [res[phase] * 1000 for res in results]
+        print(f'{phase:<16}{min(values):>10.2f}{median(values):>12.2f}{max(values):>10.2f}')
+    return None
+
+if __name__ == '__main__':
+    main()
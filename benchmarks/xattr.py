@@ -0,0 +1,81 @@
+'''
+Small write benchmark: WRITEs through Passthrough over the loopback harness
+the way the kernel sends them with and without FUSE_HANDLE_KILLPRIV.
+Without it, every WRITE follows a GETXATTR of security.capability, answered
+from disk or from the xattr cache with its negative entries.
+
+    python -m benchmarks.xattr
+    python -m benchmarks.xattr --writes 50000 --write-size 128
+'''
+
+from argparse import ArgumentParser
+from json import dumps
+from os import O_RDWR
+from tempfile import TemporaryDirectory
+from time import perf_counter
+
+from benchmarks.codec import DEFAULT_PROTOCOL, DEFAULT_VERSION
+from benchmarks.copy import _call, _open
+from pysinter.constants import FUSE_HANDLE_KILLPRIV, FUSE_HANDLE_KILLPRIV_V2
+from pysinter.examples.passthrough import Passthrough
+from pysinter.examples.xattrcache import CAPABILITY
+from pysinter.helper import load_protocol
+from pysinter.loopback import FakeKernel, LoopbackServer
+
+# Name, xattr cache size, kernel INIT flags
+MODES = (
+    ('getxattr', 0, 0)
+    , ('getxattr-cached', 4096, 0)
+    , ('killpriv', 4096, FUSE_HANDLE_KILLPRIV | FUSE_HANDLE_KILLPRIV_V2)
+    )
+
+def run_mode(protocol, tmpdir, xattrs, kernel_flags, writes, size):
+    kernel = FakeKernel(protocol)
+    payload = bytes(size)
+    requests = 0
+    try:
+        with LoopbackServer(kernel, protocol, Passthrough(tmpdir, xattrs=xattrs).make()):
+            init = _call(kernel, 'FUSE_INIT', {'major': 7, 'minor': 31, 'flags': kernel_flags})
+            killpriv = init['flags'] & (FUSE_HANDLE_KILLPRIV | FUSE_HANDLE_KILLPRIV_V2)
+            ino, fh = _open(kernel, b'data', O_RDWR)
+            start = perf_counter()
+            for num in range(writes):
+                if not killpriv:
+                    kernel.request('FUSE_GETXATTR', {'size': 0, 'name': CAPABILITY}, nodeid=ino)
+                    kernel.recv() # ENODATA
+                    requests = requests + 1
+                _call(kernel, 'FUSE_WRITE', {
+                    'fh': fh, 'offset': num * size, 'size': size, 'data': payload
+                    }, nodeid=ino)
+                requests = requests + 1
+            elapsed = perf_counter() - start
+            _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+    finally:
+        kernel.close_server()
+    return {
+        'writes_per_sec': writes / elapsed
+        , 'requests_per_write': requests / writes
+        }
+
+def main():
+    parser = ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--protocol', default=DEFAULT_PROTOCOL)
+    parser.add_argument('--version', default=DEFAULT_VERSION, help='Version key in the protocol file, empty for none')
+    parser.add_argument('--writes', type=int, default=20000)
+    parser.add_argument('--write-size', type=int, default=512)
+    parser.add_argument('--json', action='store_true')
+    args = parser.parse_args()
+    protocol = load_protocol(args.protocol, args.version or None)
+    results = {}
+    with TemporaryDirectory() as tmpdir:
+        for name, xattrs, kernel_flags in MODES:
+            open(f'{tmpdir}/data', 'wb').close()
+            res = results[name] = run_mode(protocol, tmpdir, xattrs, kernel_flags, args.writes, args.write_size)
+            if not args.json:
+                print(f'{name:<20}{res["writes_per_sec"]:>10.0f} writes/s  {res["requests_per_write"]:.0f} requests/write')
+    if args.json:
+        print(dumps(results, indent=1))
+    return None
+
+if __name__ == '__main__':
+    main()
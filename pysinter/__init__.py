@@ -1,10 +1,10 @@
 
-from collections import namedtuple
 from errno import ENODEV
-from os import environ, read, readv, write, writev, close
+from os import environ, pread, read, readv, write, writev, close, pipe, set_blocking
 from resource import getpagesize
-
-from janus import Queue
+from struct import Struct
+from threading import Event
+from time import perf_counter_ns
 
 __version__ = '0.1.0'
 
@@ -41,7 +41,53 @@ def pad64(inpt):
         return inpt
     return inpt + bytes(8 - residue)
 
-Header = namedtuple('Header', ('opcode', 'unique', 'nodeid', 'uid', 'gid', 'pid'))
+HEADER_STRUCT_RECV = Struct('<IQQIII')
+HEADER_STRUCT_SEND = Struct('<IiQ')
+
+class Header():
+    '''
+    The parsed request header. The unique value is kept as an integer and only
+    turned back into bytes when the reply is sent. If metrics are collected,
+    received holds the perf_counter_ns() timestamp of reading the request.
+    If the request was received by splicing, splice holds the WRITE data as a
+    pysinter.splice.SplicedPayload for handlers marked with
+    pysinter.helper.accepts_spliced.
+    '''
+    __slots__ = ('opcode', 'unique', 'nodeid', 'uid', 'gid', 'pid', 'received', 'splice')
+    def __init__(self, opcode, unique, nodeid, uid, gid, pid, received=0):
+        self.opcode = opcode
+        self.unique = unique
+        self.nodeid = nodeid
+        self.uid = uid
+        self.gid = gid
+        self.pid = pid
+        self.received = received
+        self.splice = None
+        return None
+    def __repr__(self):
+        return (
+            f'Header(opcode={self.opcode}, unique={self.unique}'
+            f', nodeid={self.nodeid}, uid={self.uid}, gid={self.gid}'
+            f', pid={self.pid})'
+            )
+
+class FileSlice():
+    '''
+    A reply body of size bytes of the file fd at offset, as a handler result
+    in place of formatted bytes. Sinter splices it to the FUSE fd without
+    the data passing through Python memory where it can, and reads it
+    otherwise.
+    '''
+    __slots__ = ('fd', 'offset', 'size')
+    def __init__(self, fd, offset, size):
+        self.fd = fd
+        self.offset = offset
+        self.size = size
+        return None
+    def read(self):
+        return pread(self.fd, self.size, self.offset)
+    def __repr__(self):
+        return f'FileSlice(fd={self.fd}, offset={self.offset}, size={self.size})'
 
 class FUSEError(Exception):
     '''
@@ -67,14 +113,20 @@ def parse_header_req(buffer):
     The header format has not changed since 2005 (as of 2022), so there's no
     need to version this parser.
     '''
-    return Header(
-        frombytes(buffer[4:8])
-        , bytes(buffer[8:16])
-        , frombytes(buffer[16:24])
-        , frombytes(buffer[24:28])
-        , frombytes(buffer[28:32])
-        , frombytes(buffer[32:36])
-        )
+    return Header(*HEADER_STRUCT_RECV.unpack_from(buffer, 4))
+
+def format_header_req(header, bodysize):
+    '''
+    The inverse of parse_header_req, as seen from the kernel side.
+    '''
+    return to32(HEADER_SIZE_RECV + bodysize) + HEADER_STRUCT_RECV.pack(
+        header.opcode
+        , header.unique
+        , header.nodeid
+        , header.uid
+        , header.gid
+        , header.pid
+        ) + bytes(4)
 
 class Sinter():
     '''
@@ -82,10 +134,20 @@ class Sinter():
     RX and TX queues.
     Will raise FUSEUnmountError on unmount.
     '''
-    def __init__(self, fd=None, bufsize=MINIMUM_BUFFER_SIZE):
+    def __init__(self, fd=None, bufsize=MINIMUM_BUFFER_SIZE, trace=None, metrics=None, splice=False, interruptible=False):
         '''
         Initialize buffers and queues. If fd is a string, extract the FUSE
         descriptor from an environment variable.
+        If trace is given as a path or a pysinter.trace.TraceWriter, all
+        request and reply frames are recorded to it.
+        If metrics is given as a pysinter.metrics.Metrics instance, receive
+        timestamps, write times and queue depths are recorded to it.
+        If splice is true and the platform supports it, requests are received
+        and FileSlice replies sent with splice, see pysinter.splice. Tracing
+        needs all data in memory and turns splicing off.
+        If interruptible is true, the fd is switched to non-blocking mode and
+        stop_receiving() ends recv_loop right away rather than after the next
+        request, as needed to hand the fd over, see pysinter.handoff.
         '''
         if bufsize < MINIMUM_BUFFER_SIZE:
             raise ValueError(
@@ -99,6 +161,7 @@ class Sinter():
             self._fd = int(environ[fd])
         else:
             raise ValueError("Could not interpret value for FUSE device.")
+        from janus import Queue # Deferred, pulls in asyncio
         self._recvbuf = bytearray(bufsize)
         self._sendbuf = bytearray(HEADER_SIZE_SEND)
         self._tx = Queue()
@@ -108,6 +171,26 @@ class Sinter():
         self.rx_sync = self._rx.sync_q
         self.rx_async = self._rx.async_q
 
+        if isinstance(trace, (str, bytes)):
+            from pysinter.trace import TraceWriter
+            trace = TraceWriter(trace)
+        self._trace = trace
+        self._splice = None
+        if splice and trace is None:
+            from pysinter.splice import SpliceTransport, splice_available
+            if splice_available():
+                self._splice = SpliceTransport(self._fd, bufsize)
+        self._metrics = metrics
+        if metrics is not None:
+            metrics.gauge('rx_depth', self.rx_sync.qsize)
+            metrics.gauge('tx_depth', self.tx_sync.qsize)
+
+        self.recv_stopped = Event() # Set when recv_loop returns
+        self._wakeup = None
+        if interruptible:
+            set_blocking(self._fd, False)
+            self._wakeup = pipe()
+
         self.receiving = True #Is this the right way to stop the operation?
         self.sending = True #Is this the right way to stop the operation?
 
@@ -116,40 +199,69 @@ class Sinter():
         '''
         Read from fd and queue synchronously.
         '''
+        splice = self._splice
+        if splice is not None and splice.recv_enabled:
+            res = splice.recv()
+            if res is not None:
+                if self._metrics is not None:
+                    res[0].received = perf_counter_ns()
+                return res
         buffer = self._recvbuf
         numread = readv(self._fd, (buffer,))
+        if numread == 0: # The other end is gone, as when unmounted
+            raise FUSEUnmountError("End of file on FUSE fd")
         if numread < HEADER_SIZE_RECV:
             raise RuntimeError(f"Read only {numread} bytes from FUSE fd")
         total = frombytes(buffer[:4])
         header = parse_header_req(buffer)
+        if self._metrics is not None:
+            header.received = perf_counter_ns()
         head = bytes(buffer[HEADER_SIZE_RECV:numread])
 
         remainder = total - numread
         if remainder <= 0:
-            return header, head
-        if remainder < MINIMUM_BUFFER_SIZE:
+            msg = head
+        elif remainder < MINIMUM_BUFFER_SIZE:
             backupnum = readv(self._fd, (buffer,))
             if backupnum != remainder:
                 raise RuntimeError(
                     f"Read {backupnum} bytes from FUSE fd, expected {remainder}"
                 )
-            return header, head + bytes(buffer[:remainder])
-        return header, head + read(self._fd, remainder)
+            msg = head + bytes(buffer[:remainder])
+        else:
+            msg = head + read(self._fd, remainder)
+        if self._trace is not None:
+            self._trace.request(format_header_req(header, len(msg)), msg)
+        return header, msg
     def _send(self, header, errno, msg):
         '''
         Read from queue and write to fd synchronously.
         '''
         if msg is None:
             return True
+        metrics = self._metrics
+        if metrics is not None:
+            t_start = perf_counter_ns()
+        if isinstance(msg, FileSlice):
+            splice = self._splice
+            if splice is not None and splice.send_enabled:
+                numsent = splice.send_slice(header.unique, errno, msg)
+                if numsent is not None:
+                    if metrics is not None:
+                        metrics.observe(header.opcode, 'write', perf_counter_ns() - t_start)
+                    return True
+            msg = msg.read()
         total = HEADER_SIZE_SEND + len(msg)
         sendbuf = self._sendbuf
-        sendbuf[:4] = to32(total)
-        sendbuf[4:8] = (-errno).to_bytes(4, byteorder=BYTEORDER, signed=True)
-        sendbuf[8:16] = header.unique
+        HEADER_STRUCT_SEND.pack_into(sendbuf, 0, total, -errno, header.unique)
         try:
             numsent = writev(self._fd, (sendbuf, msg))
         except OSError as e:
             raise e
+        if metrics is not None:
+            metrics.observe(header.opcode, 'write', perf_counter_ns() - t_start)
+        if self._trace is not None:
+            self._trace.reply(sendbuf, msg)
         return (numsent == total)
     def recv_loop(self):
         '''
@@ -157,12 +269,20 @@ class Sinter():
         '''
         try:
             while self.receiving:
-                msg = self._recv()
+                try:
+                    msg = self._recv()
+                except BlockingIOError:
+                    self._wait_readable()
+                    continue
                 self.rx_sync.put(msg)
         except OSError as e:
             if e.errno == ENODEV:
                 raise FUSEUnmountError from e
             raise
+        finally:
+            self.recv_stopped.set()
+            if self._trace is not None:
+                self._trace.flush()
         return None
     def send_loop(self):
         '''
@@ -172,8 +292,56 @@ class Sinter():
             while self.sending:
                 header, errno, msg = self.tx_sync.get()
                 self._send(header, errno, msg)
+                self.tx_sync.task_done()
         except OSError as e:
             if e.errno == ENODEV:
                 raise FUSEUnmountError from e
             raise
+        finally:
+            if self._trace is not None:
+                self._trace.flush()
+        return None
+    @property
+    def fd(self):
+        return self._fd
+    def _wait_readable(self):
+        '''
+        Block until the fd is readable or stop_receiving() is called.
+        '''
+        from select import poll, POLLIN
+        poller = poll()
+        poller.register(self._fd, POLLIN)
+        if self._wakeup is not None:
+            poller.register(self._wakeup[0], POLLIN)
+        poller.poll()
         return None
+    def stop_receiving(self):
+        '''
+        Make recv_loop return without reading another request. Safe to call
+        from any thread; an interruptible Sinter's loop returns right away,
+        others after the next request.
+        '''
+        self.receiving = False
+        if self._wakeup is not None:
+            write(self._wakeup[1], b'\0')
+        return None
+    def memory_stats(self):
+        '''
+        Requests and replies waiting in the queues with their payload bytes,
+        and the buffers, see pysinter.memory.
+        '''
+        def queued(queue, position):
+            items = list(getattr(queue, '_queue', ())) # janus keeps them in a deque like queue.Queue
+            return {
+                'count': len(items)
+                , 'bytes': sum(
+                    len(item[position]) for item in items
+                    if isinstance(item[position], (bytes, bytearray, memoryview))
+                    )
+                }
+        buffers = len(self._recvbuf) + len(self._sendbuf)
+        return {
+            'rx_queue': queued(self._rx, 1)
+            , 'tx_queue': queued(self._tx, 2)
+            , 'buffers': {'count': 2, 'bytes': buffers}
+            }
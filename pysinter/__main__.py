@@ -1,12 +1,14 @@
 
-from asyncio import run
-from json import loads, dumps
-from logging import getLogger
-from os import open as osopen, close as osclose, O_RDWR
-from pkgutil import get_data
+from asyncio import get_running_loop, run
+from logging import basicConfig, getLogger, DEBUG
+from os import environ, open as osopen, close as osclose, O_RDWR
+from signal import SIGUSR1, SIGUSR2
 
 from pysinter import Sinter, MAX32, FUSEError
 from pysinter.dynamic import Operations
+from pysinter.helper import load_protocol
+from pysinter.memory import AllocationTracker, MemoryAccounting, install_memory_signal
+from pysinter.profiling import install_profile_signal
 # from pysinter.examples.hello import FS_HELLO
 from pysinter.examples.passthrough import Passthrough
 
@@ -14,39 +16,84 @@ LOGGER = getLogger(__name__)
 
 async def main():
     '''
-    Testing the components. No threading, the FUSE read write loop runs
-    synchronously in this function.
+    Testing the components. Requests are answered one at a time by serve().
+
+    Set PYSINTER_TRACE to a file name to record all traffic for replay with
+    benchmarks/replay.py.
+
+    Set PYSINTER_PROFILE_DIR to toggle profiling with SIGUSR2, writing
+    results there. PYSINTER_PROFILE_OPCODES restricts it to a comma separated
+    list of opcode names, PYSINTER_PROFILE_MODE selects cprofile or sample.
+
+    Set PYSINTER_MEMORY_REPORT to a file name to write a memory report there
+    on SIGUSR1. With PYSINTER_MEMORY_TRACE set as well, the first SIGUSR1
+    starts tracemalloc and later reports include the allocations kept per
+    opcode since the one before.
 
     TODO: A bit of an interface. Specifying protocol location and version
             would be nice, for example.
     '''
-    protocol = loads(get_data('pysinter', 'protocol/protocol-latest.json'))
-    s = Sinter(fd='FUSEFD')
+    protocol = load_protocol()
+    s = Sinter(fd='FUSEFD', trace=environ.get('PYSINTER_TRACE'))
     pt = Passthrough('../mnt')
     ops = Operations(LOGGER, protocol, pt.make())
+    if 'PYSINTER_PROFILE_DIR' in environ:
+        opcodes = environ.get('PYSINTER_PROFILE_OPCODES')
+        install_profile_signal(
+            ops
+            , SIGUSR2
+            , opcodes.split(',') if opcodes else protocol['opcodes'].values()
+            , environ['PYSINTER_PROFILE_DIR']
+            , mode=environ.get('PYSINTER_PROFILE_MODE', 'cprofile')
+            )
+    if 'PYSINTER_MEMORY_REPORT' in environ:
+        install_memory_signal(
+            MemoryAccounting(operations=ops, sinter=s, passthrough=pt)
+            , SIGUSR1
+            , environ['PYSINTER_MEMORY_REPORT']
+            , tracker=AllocationTracker(ops) if environ.get('PYSINTER_MEMORY_TRACE') else None
+            )
+    return await serve(s, ops)
+
+async def serve(s, ops):
+    '''
+    Answer the requests read from the Sinter one at a time, until unmounted.
+    Reading waits in an executor thread rather than blocking the event loop,
+    which would keep signal handlers and timers from running.
+    '''
+    loop = get_running_loop()
     tx = s.tx_async
     tx_sync = s.tx_sync
     while True:
-        header, msg = s._recv()
-        parsed = ops.parse(header.opcode, msg)
-        print('\nRequest', header, parsed, msg)
+        header, msg = await loop.run_in_executor(None, s._recv)
+        debug = LOGGER.isEnabledFor(DEBUG)
+        parsed = None
+        if debug:
+            try: # Left to the handler to reject
+                parsed = ops.parse(header.opcode, msg)
+            except (FUSEError, ValueError) as e:
+                parsed = e
+            LOGGER.debug('Request %s %s %s', header, parsed, msg)
         try:
             await ops._complete_one(tx, header, msg)
             header, errno, resmsg = tx_sync.get()
         except FUSEError as e:
-            print('\nThrew error', header, parsed, e)
+            LOGGER.debug('Threw error %s %s %s', header, parsed, e)
             errno = e.errno
             resmsg = b''
-        if resmsg is None:
-            print('\nNo reply necessary', header, parsed, resmsg)
+        if not debug:
+            pass
+        elif resmsg is None:
+            LOGGER.debug('No reply necessary %s %s', header, parsed)
         else:
             try:
                 parsed_output = ops.parse_output(header.opcode, resmsg)
-                print('\nRegular reply', header, parsed, parsed_output, '\nRaw reply body:', resmsg.hex())
+                LOGGER.debug('Regular reply %s %s %s, raw reply body: %s', header, parsed, parsed_output, resmsg.hex())
             except ValueError:
-                print('Value Error while parsing output', header, parsed, '\nRaw reply body:', resmsg.hex())
+                LOGGER.debug('Value Error while parsing output %s %s, raw reply body: %s', header, parsed, resmsg.hex())
         s._send(header, errno, resmsg)
 
 
 if __name__ == "__main__":
+    basicConfig(level=environ.get('PYSINTER_LOGLEVEL', 'DEBUG'))
     run(main())
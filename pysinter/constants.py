@@ -13,19 +13,26 @@ FATTR_ATIME_NOW	= (1 << 7)
 FATTR_MTIME_NOW	= (1 << 8)
 FATTR_LOCKOWNER	= (1 << 9)
 FATTR_CTIME	= (1 << 10)
+FATTR_KILL_SUIDGID	= (1 << 11)
 
-# Flags used by OPEN requests
-FATTR_MODE	= (1 << 0)
-FATTR_UID	= (1 << 1)
-FATTR_GID	= (1 << 2)
-FATTR_SIZE	= (1 << 3)
-FATTR_ATIME	= (1 << 4)
-FATTR_MTIME	= (1 << 5)
-FATTR_FH	= (1 << 6)
-FATTR_ATIME_NOW	= (1 << 7)
-FATTR_MTIME_NOW	= (1 << 8)
-FATTR_LOCKOWNER	= (1 << 9)
-FATTR_CTIME	= (1 << 10)
+# Flags used by OPEN requests - field openFlags
+FUSE_OPEN_KILL_SUIDGID	= (1 << 0)
+
+# Open reply flags - field openFlags
+FOPEN_DIRECT_IO		= (1 << 0)
+FOPEN_KEEP_CACHE	= (1 << 1)
+FOPEN_NONSEEKABLE	= (1 << 2)
+FOPEN_CACHE_DIR		= (1 << 3)
+FOPEN_STREAM		= (1 << 4)
+FOPEN_NOFLUSH		= (1 << 5)
+
+# Fsync flags - field fsyncFlags
+FUSE_FSYNC_FDATASYNC	= (1 << 0)
+
+# Write flags - field writeFlags
+FUSE_WRITE_CACHE	= (1 << 0)
+FUSE_WRITE_LOCKOWNER	= (1 << 1)
+FUSE_WRITE_KILL_SUIDGID	= (1 << 2)
 
 # INIT request/reply flags - field flags.
 # Because pysinter treats the fields flags and flags2 as one
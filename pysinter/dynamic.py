@@ -1,10 +1,12 @@
 
-from asyncio import create_task, all_tasks, gather
-from copy import deepcopy
-from errno import ENOSYS
-from json import dumps
+from asyncio import CancelledError, get_running_loop, shield
+from collections import OrderedDict
+from collections.abc import Mapping
+from errno import ENOSYS, EIO
+from sys import getsizeof
+from time import perf_counter_ns
 
-from pysinter import FUSEError, ENCODING, BYTEORDER, frombytes
+from pysinter import FUSEError, FileSlice, ENCODING, BYTEORDER, frombytes
 
 INFINITY = float('inf')
 
@@ -16,7 +18,7 @@ def _struct_key(inpt):
     cstringpos = fieldval.get('cstringposition', INFINITY)
     return (offset, cstringpos)
 
-def _replace_struct(logger, structs, schema, schema_is_struct=False):
+def _replace_struct(plans, schema, schema_is_struct=False):
     if schema_is_struct:
         res = {
             None: {
@@ -24,24 +26,41 @@ def _replace_struct(logger, structs, schema, schema_is_struct=False):
                 , 'pad_to': schema.get('pad_to', 0)
                 }
             }
-        schema = deepcopy(schema['fields'])
+        schema = schema['fields']
     else:
-        schema = deepcopy(schema)
         res = {}
     for fieldname, fieldval in sorted(schema.items(), key=_struct_key):
         structname = fieldval.get('struct')
-        resval = deepcopy(fieldval)
+        resval = dict(fieldval)
         if structname is not None: #Recursion shouldn't go too deep here
-            struct = _replace_struct(
-                logger.getChild(structname)
-                , structs
-                , structs[structname]
-                , schema_is_struct=True
-                )
-            resval['struct'] = struct
+            resval['struct'] = plans.resolve(structname)
         res[fieldname] = resval
     return res
 
+class StructPlans():
+    '''
+    Resolved struct schemas, built on first use and shared between all
+    formatters created from the same protocol. Resolved plans are treated as
+    read-only.
+    '''
+    def __init__(self, structs):
+        self._structs = structs
+        self._resolved = {}
+        return None
+    def resolve(self, structname):
+        '''
+        The resolved schema for the named struct.
+        '''
+        plan = self._resolved.get(structname)
+        if plan is None:
+            plan = _replace_struct(
+                self
+                , self._structs[structname]
+                , schema_is_struct=True
+                )
+            self._resolved[structname] = plan
+        return plan
+
 def _generate_fields(logger, schema, inpt, is_single_instance=False, is_struct=False, pos=0):
     logger.debug('Generating: %s , %s', schema, inpt)
     meta = schema.get(None, {})
@@ -92,7 +111,7 @@ def _generate_fields(logger, schema, inpt, is_single_instance=False, is_struct=F
             continue
         size = fshape['size']
         if size is None:
-            cstrpos = schema.get('cstringposition')
+            cstrpos = fshape.get('cstringposition')
             if cstrpos is None:
                 val = inpt.get(fname, b'')
                 logger.debug(
@@ -149,7 +168,7 @@ def _parse_fields(logger, schema, inpt, position):
             if zero_or_more: # Edge case zero_or_more == 0 takes care of itself
                 structres = []
                 total_length = len(inpt)
-                maxcount = zero_or_more if isinstance(zero_or_more, int) else INFINITY
+                maxcount = INFINITY if zero_or_more is True else zero_or_more
                 while position < total_length and len(structres) < maxcount:
                     position, fval = _parse_fields(
                         logger.getChild(struct[None]['structname'])
@@ -202,8 +221,147 @@ def _parse_fields(logger, schema, inpt, position):
         position = position + (-position % pad_to)
     return position, res
 
+class RequestView(Mapping):
+    '''
+    Base class for the per-opcode request classes built by _mk_view_class.
+    Instances keep the raw message and decode each field on first access.
+    Dictionary-style access is kept for handlers written against the output
+    of Formatter.parse.
+    '''
+    __slots__ = ('_buffer',)
+    _fields = ()
+    _lazy = {}
+    _minsize = 0
+    _fixed = False
+    def __init__(self, buffer):
+        self._buffer = buffer
+        return None
+    def __getitem__(self, key):
+        field = self._lazy.get(key)
+        if field is None:
+            raise KeyError(key)
+        return field.__get__(self)
+    def __iter__(self):
+        return iter(self._fields)
+    def __len__(self):
+        return len(self._fields)
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(self)!r})'
+
+class _LazyField():
+    '''
+    Descriptor decoding one field into its backing slot on first access.
+    '''
+    __slots__ = ('_slot', '_decode')
+    def __init__(self, slot, decode):
+        self._slot = slot
+        self._decode = decode
+        return None
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        try:
+            return self._slot.__get__(instance, owner)
+        except AttributeError:
+            pass
+        val = self._decode(instance)
+        self._slot.__set__(instance, val)
+        return val
+
+def _mk_decoder(logger, fshape, position, last=False):
+    '''
+    Decoder for a field whose offset does not depend on the message content.
+    A C string ending the message must end at its end.
+    '''
+    struct = fshape.get('struct')
+    if struct:
+        return lambda view: _parse_fields(logger, struct, view._buffer, position)[1]
+    size = fshape['size']
+    if size is None:
+        if fshape.get('cstringposition') is None:
+            return lambda view: view._buffer[position:]
+        def decode_cstring(view):
+            buffer = view._buffer
+            nullbytepos = buffer.find(b'\x00', position)
+            if nullbytepos == -1:
+                raise ValueError('Bad C string', fshape, position, buffer)
+            if last and nullbytepos + 1 != len(buffer):
+                raise ValueError('Trailing bytes after C string', fshape, position, buffer)
+            return buffer[position:nullbytepos]
+        return decode_cstring
+    end = position + size // 8
+    if size <= 64:
+        signed = bool(fshape.get('signed'))
+        return lambda view: int.from_bytes(
+            view._buffer[position:end]
+            , BYTEORDER
+            , signed=signed
+            )
+    return lambda view: view._buffer[position:end]
+
+def _mk_view_class(logger, name, schema):
+    '''
+    Build a slotted RequestView subclass for one resolved schema. Fields at a
+    fixed position are decoded individually. Fields behind a variable-length
+    field are decoded together by a full parse on first access to any of them,
+    which rejects messages of the wrong length like Formatter.parse.
+    '''
+    fields = tuple(fname for fname in schema if fname is not None)
+    slotnames = tuple(f'_f{num}' for num in range(len(fields)))
+    cls = type(name, (RequestView,), {
+        '__slots__': slotnames
+        , '_fields': fields
+        , '_lazy': {}
+        })
+    slots = {
+        fname: getattr(cls, slotname)
+        for fname, slotname in zip(fields, slotnames)
+        }
+    parselogger = logger.getChild('parse')
+    def decode_all(fname):
+        def decode(view):
+            respos, res = _parse_fields(parselogger, schema, view._buffer, 0)
+            if respos != len(view._buffer):
+                raise ValueError(
+                    f'Incomplete parse in {name}, parsed to position {respos}'
+                    , view._buffer
+                    )
+            for resname, resval in res.items():
+                slots[resname].__set__(view, resval)
+            return res.get(fname)
+        return decode
+    pad_to = (schema.get(None) or {}).get('pad_to', 0) // 8
+    position = 0
+    for num, fname in enumerate(fields):
+        fshape = schema[fname]
+        if position is None or fshape.get('zero_or_more'):
+            decode = decode_all(fname)
+        else:
+            last = num == len(fields) - 1 and not pad_to
+            decode = _mk_decoder(parselogger, fshape, position, last=last)
+        if position is not None:
+            size = fshape['size']
+            if size is None or fshape.get('zero_or_more'):
+                position = None
+            else:
+                position = position + size // 8
+        field = _LazyField(slots[fname], decode)
+        cls._lazy[fname] = field
+        # Attribute access as a shortcut, unless it would shadow the mapping
+        if fname.isidentifier() and not hasattr(RequestView, fname):
+            setattr(cls, fname, field)
+    if position is not None and pad_to:
+        position = position + (-position % pad_to)
+    cls._minsize = 0 if position is None else position
+    cls._fixed = position is not None
+    return cls
+
 class Formatter():
     def __init__(self, logger, structs, name, schema):
+        '''
+        The structs may be given as the protocol's struct dictionary or as a
+        StructPlans instance to share resolved structs between formatters.
+        '''
         self._name = name
         self._logger = logger
         if schema == -1:
@@ -216,9 +374,33 @@ class Formatter():
                 , self._name
                 )
         else:
-            self._schema = _replace_struct(logger, structs, schema)
+            if not isinstance(structs, StructPlans):
+                structs = StructPlans(structs)
+            self._schema = _replace_struct(structs, schema)
             self._exception = None
+        self._view_class = None
         return None
+    def view(self, inpt):
+        '''
+        Lazy parsing: From message to a RequestView decoding on access.
+        '''
+        if self._exception:
+            raise self._exception
+        cls = self._view_class
+        if cls is None:
+            cls = _mk_view_class(self._logger, self._name, self._schema)
+            self._view_class = cls
+        if len(inpt) < cls._minsize:
+            raise ValueError(
+                f'Message too short for {self._name}, expected at least {cls._minsize} bytes'
+                , inpt
+                )
+        if cls._fixed and len(inpt) != cls._minsize:
+            raise ValueError(
+                f'Message too long for {self._name}, expected {cls._minsize} bytes'
+                , inpt
+                )
+        return cls(inpt)
     def parse(self, inpt):
         '''
         Parsing: From message to dictionary.
@@ -250,6 +432,210 @@ class Formatter():
             )
 
 
+def _freeze(inpt):
+    '''
+    Hashable representation of a nested reply value.
+    '''
+    if isinstance(inpt, Mapping):
+        return frozenset((k, _freeze(v)) for k, v in inpt.items())
+    if isinstance(inpt, (list, tuple)):
+        return tuple(_freeze(v) for v in inpt)
+    if isinstance(inpt, (bytearray, memoryview)):
+        return bytes(inpt)
+    return inpt
+
+class FrozenReply(Mapping):
+    '''
+    An immutable reply dictionary. Operations caches the formatted bytes of
+    frozen replies per opcode, so handlers returning the same (or an equal)
+    FrozenReply skip formatting after the first time.
+    The value is copied on construction and must not be modified afterwards.
+    '''
+    __slots__ = ('_data', '_key', '_hash')
+    def __init__(self, data):
+        from copy import deepcopy
+        self._data = deepcopy(dict(data))
+        self._key = _freeze(self._data)
+        self._hash = hash(self._key)
+        return None
+    def __getitem__(self, key):
+        return self._data[key]
+    def __iter__(self):
+        return iter(self._data)
+    def __len__(self):
+        return len(self._data)
+    def __hash__(self):
+        return self._hash
+    def __eq__(self, other):
+        if isinstance(other, FrozenReply):
+            return self._hash == other._hash and self._key == other._key
+        return super().__eq__(other)
+    def __repr__(self):
+        return f'FrozenReply({self._data!r})'
+
+class ReplyCache():
+    '''
+    Per-opcode LRU cache for the formatted bytes of FrozenReply instances,
+    with hit and miss counters.
+    '''
+    def __init__(self, maxsize=128):
+        if maxsize < 1:
+            raise ValueError('Reply cache size must be positive', maxsize)
+        self._maxsize = maxsize
+        self._entries = {}
+        self._hits = {}
+        self._misses = {}
+        return None
+    def get(self, opcode, reply):
+        '''
+        Look up the formatted reply, marking it as recently used.
+        '''
+        entries = self._entries.get(opcode)
+        formatted = None if entries is None else entries.get(reply)
+        if formatted is None:
+            self._misses[opcode] = self._misses.get(opcode, 0) + 1
+            return None
+        entries.move_to_end(reply)
+        self._hits[opcode] = self._hits.get(opcode, 0) + 1
+        return formatted
+    def put(self, opcode, reply, formatted):
+        '''
+        Store a formatted reply, evicting the least recently used one if the
+        opcode's cache is full.
+        '''
+        entries = self._entries.get(opcode)
+        if entries is None:
+            entries = self._entries[opcode] = OrderedDict()
+        entries[reply] = formatted
+        entries.move_to_end(reply)
+        if len(entries) > self._maxsize:
+            entries.popitem(last=False)
+        return None
+    def invalidate(self, reply=None, opcode=None):
+        '''
+        Drop cached replies. Without arguments, everything is dropped. A given
+        reply is dropped for the given opcode or, by default, for all opcodes.
+        '''
+        if opcode is None:
+            caches = self._entries.values()
+        else:
+            caches = (self._entries.get(opcode, {}),)
+        for entries in caches:
+            if reply is None:
+                entries.clear()
+            else:
+                entries.pop(reply, None)
+        return None
+    def stats(self):
+        '''
+        Hits, misses, hit rate and size per opcode.
+        '''
+        res = {}
+        for opcode in set(self._hits) | set(self._misses) | set(self._entries):
+            hits = self._hits.get(opcode, 0)
+            misses = self._misses.get(opcode, 0)
+            total = hits + misses
+            res[opcode] = {
+                'hits': hits
+                , 'misses': misses
+                , 'hit_rate': (hits / total) if total else 0.0
+                , 'size': len(self._entries.get(opcode, ()))
+                }
+        return res
+
+class SingleFlight():
+    '''
+    Handler calls in flight by opcode and key. A request arriving while a
+    call with the same key is running waits for it and shares its result
+    instead of calling the handler again. Keys come from a function
+    (header, parsed) per opcode value, or None to key on the node and the
+    raw request body, i.e. identical requests.
+    '''
+    def __init__(self, keys):
+        self._keys = keys
+        self._flights = {}
+        self._calls = {}
+        self._shared = {}
+        return None
+    def __contains__(self, opcode):
+        return opcode in self._keys
+    def key(self, opcode, header, parsed, msg):
+        function = self._keys[opcode]
+        if function is None:
+            return header.nodeid, bytes(msg)
+        return function(header, parsed)
+    async def run(self, opcode, key, operation, header, parsed):
+        '''
+        Await operation(header, parsed), or the call already in flight for
+        the key. Errors are shared like results. If the call in flight is
+        cancelled, e.g. by an INTERRUPT, the requests waiting for it try
+        again.
+        '''
+        flight = (opcode, key)
+        future = self._flights.get(flight)
+        while future is not None:
+            self._shared[opcode] = self._shared.get(opcode, 0) + 1
+            try:
+                return await shield(future)
+            except CancelledError:
+                if not future.cancelled(): # This request was cancelled itself
+                    raise
+            self._shared[opcode] = self._shared[opcode] - 1
+            future = self._flights.get(flight)
+        future = self._flights[flight] = get_running_loop().create_future()
+        self._calls[opcode] = self._calls.get(opcode, 0) + 1
+        try:
+            res = await operation(header, parsed)
+        except CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception() # Retrieved, whether anybody was waiting or not
+            raise
+        else:
+            future.set_result(res)
+        finally:
+            del self._flights[flight]
+        return res
+    def stats(self):
+        '''
+        Handler calls, requests that shared one and the share of requests
+        deduplicated, per opcode.
+        '''
+        res = {}
+        for opcode in set(self._calls) | set(self._shared):
+            calls = self._calls.get(opcode, 0)
+            shared = self._shared.get(opcode, 0)
+            res[opcode] = {
+                'calls': calls
+                , 'shared': shared
+                , 'dedup_rate': shared / (calls + shared)
+                }
+        return res
+
+class _FormatterTable(dict):
+    '''
+    Formatters for one direction keyed by opcode value, built on first use.
+    '''
+    def __init__(self, factory, direction):
+        self._factory = factory
+        self._direction = direction
+        return None
+    def __missing__(self, opcode):
+        fmt = self._factory(opcode, self._direction)
+        if fmt is not None:
+            self[opcode] = fmt
+        return fmt
+    def get(self, opcode, default=None):
+        fmt = self[opcode]
+        return default if fmt is None else fmt
+
+def _mk_profiled(profiler, opcode, operation):
+    def profiled(header, parsed):
+        return profiler.wrap(opcode, 'handler', operation(header, parsed))
+    return profiled
+
 class Operations():
     '''
     A class to run per-opcode functions against a pair of asynchronous RX and
@@ -258,10 +644,34 @@ class Operations():
     and produce dictionaries of field values. These dictionaries are extracted
     from and converted to FUSE messages according to the schema supplied with
     the first parameter.
+    Replies given as FrozenReply instances are formatted once and then served
+    from a per-opcode LRU cache holding up to reply_cache_size entries; a size
+    of 0 disables the cache.
+    Request counts, errors and timings are recorded to a
+    pysinter.metrics.Metrics instance if one is given.
+    With single_flight, a dict from opcode name or value to a key function
+    or None (see SingleFlight), concurrent requests of those opcodes with
+    equal keys share one handler call and each get the reply to their own
+    unique. Keys should cover whatever the handler's answer depends on, and
+    handlers that count replies, like lookup references, must not be
+    deduplicated.
+    Requests are handled as they arrive unless a dispatcher, e.g. a
+    pysinter.fairqueue.FairQueue, is given to decide the order.
+    Given another Operations instance for the same schema as codec, its
+    formatters, struct plans and reply cache are shared instead of built
+    anew, as for many mounts served from one process.
     '''
-    def __init__(self, logger, schema, action_by_opcode):
+    def __init__(self, logger, schema, action_by_opcode, reply_cache_size=128, metrics=None, single_flight=None, dispatcher=None, codec=None):
         self.active = True
         self._logger = logger
+        if codec is not None:
+            self._reply_cache = codec._reply_cache
+        else:
+            self._reply_cache = ReplyCache(reply_cache_size) if reply_cache_size else None
+        self._metrics = metrics
+        self._profiler = None
+        self._inflight = 0
+        self._inflight_bytes = 0
         self._action_by_opcode = {
             opcode_value: action_by_opcode.get(opcode_name)
             for opcode_name, opcode_value in schema['opcodes'].items()
@@ -271,25 +681,39 @@ class Operations():
             opcode_value: opcode_name
             for opcode_name, opcode_value in schema['opcodes'].items()
             }
-        self._formatter_request = {
-            opcode_value: Formatter(
-                logger.getChild(opcode_name)
-                , schema['structs']
-                , opcode_name
-                , schema['operations'].get(opcode_name, {}).get('request')
-                )
-            for opcode_name, opcode_value in schema['opcodes'].items()
-            }
-        self._formatter_response = {
-            opcode_value: Formatter(
-                logger.getChild(opcode_name)
-                , schema['structs']
-                , opcode_name
-                , schema['operations'].get(opcode_name, {}).get('response')
-                )
-            for opcode_name, opcode_value in schema['opcodes'].items()
-            }
+        if metrics is not None:
+            metrics.set_names(self._opcode_value_to_name)
+        self._single_flight = None
+        if single_flight:
+            self._single_flight = SingleFlight({
+                self._opcode_name_to_value.get(opcode, opcode): key
+                for opcode, key in single_flight.items()
+                })
+        self._dispatcher = dispatcher
+        self._operations = schema['operations']
+        if codec is not None:
+            self._plans = codec._plans
+            self._formatter_request = codec._formatter_request
+            self._formatter_response = codec._formatter_response
+            return None
+        self._plans = StructPlans(schema['structs'])
+        self._formatter_request = _FormatterTable(self._mk_formatter, 'request')
+        self._formatter_response = _FormatterTable(self._mk_formatter, 'response')
         return None
+    def _mk_formatter(self, opcode, direction):
+        '''
+        Build the formatter for one opcode and direction, None for unknown
+        opcodes.
+        '''
+        opcode_name = self._opcode_value_to_name.get(opcode)
+        if opcode_name is None:
+            return None
+        return Formatter(
+            self._logger.getChild(opcode_name)
+            , self._plans
+            , opcode_name
+            , self._operations.get(opcode_name, {}).get(direction)
+            )
     def format(self, opcode, inpt):
         '''
         Run the opcode's response formatter.
@@ -299,8 +723,78 @@ class Operations():
         fmt = self._formatter_response.get(opcode)
         if fmt is None:
             raise FUSEError(ENOSYS, "Opcode without formatter", opcode, inpt)
+        cache = self._reply_cache
+        if cache is not None and isinstance(inpt, FrozenReply):
+            formatted = cache.get(opcode, inpt)
+            if formatted is None:
+                formatted = b''.join((field for _, field in fmt.generate_fields(inpt)))
+                cache.put(opcode, inpt, formatted)
+            return formatted
         #TODO: Cut off at a maximum write size here
         return b''.join((field for _, field in fmt.generate_fields(inpt)))
+    def invalidate_reply(self, reply=None, opcode=None):
+        '''
+        Drop cached formatted replies, see ReplyCache.invalidate. The opcode
+        may be given by name or value.
+        '''
+        if self._reply_cache is None:
+            return None
+        opcode = self._opcode_name_to_value.get(opcode, opcode)
+        return self._reply_cache.invalidate(reply=reply, opcode=opcode)
+    def reply_cache_stats(self):
+        '''
+        Reply cache counters keyed by opcode name.
+        '''
+        if self._reply_cache is None:
+            return {}
+        return {
+            self._opcode_value_to_name.get(opcode, opcode): stats
+            for opcode, stats in self._reply_cache.stats().items()
+            }
+    def single_flight_stats(self):
+        '''
+        Single-flight counters keyed by opcode name.
+        '''
+        if self._single_flight is None:
+            return {}
+        return {
+            self._opcode_value_to_name.get(opcode, opcode): stats
+            for opcode, stats in self._single_flight.stats().items()
+            }
+    @property
+    def inflight(self):
+        '''
+        The number of requests being handled.
+        '''
+        return self._inflight
+    def memory_stats(self):
+        '''
+        Counts and estimated bytes of formatters, struct plans, their
+        loggers, cached replies and the payloads of requests being handled,
+        see pysinter.memory.
+        '''
+        from pysinter.memory import deep_size, logger_stats, usage
+        seen = set() # Formatters share the struct plans
+        formatters = [
+            fmt for table in (self._formatter_request, self._formatter_response)
+            for fmt in list(table.values())
+            ]
+        res = {
+            'struct_plans': usage(len(self._plans._resolved), deep_size(self._plans._resolved, seen=seen))
+            , 'formatters': usage(len(formatters), sum(deep_size(fmt, seen=seen) for fmt in formatters))
+            , 'loggers': logger_stats(self._logger)
+            , 'inflight': usage(self._inflight, self._inflight_bytes)
+            }
+        cache = self._reply_cache
+        if cache is not None:
+            entries = [item for entries in cache._entries.values() for item in entries.items()]
+            res['reply_cache'] = usage(
+                len(entries)
+                , sum(deep_size(reply) + getsizeof(formatted) for reply, formatted in entries)
+                )
+        if self._single_flight is not None:
+            res['single_flight'] = usage(len(self._single_flight._flights), deep_size(self._single_flight._flights))
+        return res
     def parse(self, opcode, inpt):
         '''
         Run the opcode's request parser.
@@ -309,6 +803,14 @@ class Operations():
         if fmt is None:
             raise FUSEError(ENOSYS, "Opcode without formatter", opcode, inpt)
         return fmt.parse(inpt)
+    def view(self, opcode, inpt):
+        '''
+        Wrap the request in the opcode's lazily decoding request class.
+        '''
+        fmt = self._formatter_request.get(opcode)
+        if fmt is None:
+            raise FUSEError(ENOSYS, "Opcode without formatter", opcode, inpt)
+        return fmt.view(inpt)
     def parse_output(self, opcode, inpt):
         '''
         Run the opcode's response parser.
@@ -317,26 +819,122 @@ class Operations():
         if fmt is None:
             raise FUSEError(ENOSYS, "Opcode without formatter", opcode, inpt)
         return fmt.parse(inpt)
+    def format_input(self, opcode, inpt):
+        '''
+        Run the opcode's request formatter.
+        '''
+        fmt = self._formatter_request.get(opcode)
+        if fmt is None:
+            raise FUSEError(ENOSYS, "Opcode without formatter", opcode, inpt)
+        return b''.join((field for _, field in fmt.generate_fields(inpt)))
+    @property
+    def profiling(self):
+        return self._profiler is not None and not self._profiler.done
+    def arm_profiler(self, opcodes, output_dir, requests=None, duration=None, mode='cprofile', **kwargs):
+        '''
+        Start profiling the given opcodes (names or values), see
+        pysinter.profiling.OpcodeProfiler. A running profiler is finished
+        first, writing its results.
+        '''
+        from pysinter.profiling import OpcodeProfiler
+        self.disarm_profiler()
+        profiler = OpcodeProfiler(
+            [self._opcode_name_to_value.get(opcode, opcode) for opcode in opcodes]
+            , output_dir
+            , self._opcode_value_to_name
+            , requests=requests
+            , duration=duration
+            , mode=mode
+            , **kwargs
+            )
+        self._profiler = profiler
+        if duration is not None:
+            try:
+                get_running_loop().call_later(duration, profiler.finish)
+            except RuntimeError: # No loop: ends with the next request
+                pass
+        return profiler
+    def disarm_profiler(self):
+        '''
+        Stop profiling and write the results, returning the written paths.
+        '''
+        profiler = self._profiler
+        self._profiler = None
+        if profiler is None:
+            return []
+        return profiler.finish()
     async def _complete_one(self, tx, header, msg):
         opcode = header.opcode
-        operation = self._action_by_opcode.get(opcode)
-        if operation is None:
-            raise FUSEError(ENOSYS, "Unknown or unimplemented opcode", header, msg)
-        parsed = self.parse(opcode, msg)
+        metrics = self._metrics
+        if metrics is not None:
+            t_start = metrics.begin(header)
+        profiler = self._profiler
+        if profiler is not None and not profiler.wants(opcode):
+            profiler = None
+        self._inflight = self._inflight + 1
+        nbytes = len(msg)
+        self._inflight_bytes = self._inflight_bytes + nbytes
         try:
-            opres = await operation(header, parsed)
+            operation = self._action_by_opcode.get(opcode)
+            if operation is None:
+                raise FUSEError(ENOSYS, "Unknown or unimplemented opcode", header, msg)
+            payload = header.splice
+            if payload is not None and not getattr(operation, 'accepts_spliced', False):
+                header.splice = None
+                try:
+                    msg = msg + payload.read()
+                finally:
+                    payload.close()
+            if profiler is None:
+                parsed = self.view(opcode, msg)
+            else:
+                parsed = profiler.request(opcode, profiler.call(opcode, 'parse', self.view, opcode, msg))
+                operation = _mk_profiled(profiler, opcode, operation)
+            flights = self._single_flight
+            if flights is None or opcode not in flights or header.splice is not None:
+                opres = await operation(header, parsed)
+            else:
+                key = flights.key(opcode, header, parsed, msg)
+                opres = await flights.run(opcode, key, operation, header, parsed)
             errno, res = opres
-            if isinstance(res, bytes):
+            if metrics is not None:
+                t_handler = perf_counter_ns()
+                metrics.observe(opcode, 'handler', t_handler - t_start)
+            if isinstance(res, (bytes, FileSlice)):
                 formatted = res
             else:
-                formatted = self.format(opcode, res)
+                if profiler is None:
+                    formatted = self.format(opcode, res)
+                else:
+                    formatted = profiler.call(opcode, 'format', self.format, opcode, res)
+                if metrics is not None:
+                    metrics.observe(opcode, 'format', perf_counter_ns() - t_handler)
         except FUSEError as e:
             errno = e.errno
             formatted = b''
+        except Exception:
+            # Without a reply, the request would hang in the kernel forever
+            self._logger.exception('Request failed: %s', header)
+            errno = EIO
+            formatted = b''
+        self._inflight = self._inflight - 1
+        self._inflight_bytes = self._inflight_bytes - nbytes
+        if header.splice is not None:
+            header.splice.close()
+        if metrics is not None:
+            metrics.end(opcode, errno)
+        if profiler is not None:
+            profiler.request_done(opcode)
         return await tx.put((header, errno, formatted))
     async def operate(self, rx, tx):
+        from asyncio import create_task, all_tasks, gather
+        dispatcher = self._dispatcher
+        complete = lambda header, msg: self._complete_one(tx, header, msg)
         while self.active:
             header, msg = await rx.get()
-            create_task(self._complete_one(tx, header, msg))
+            if dispatcher is None:
+                create_task(self._complete_one(tx, header, msg))
+            else:
+                dispatcher.submit(complete, header, msg)
         await gather(*all_tasks()) #TODO: Make sure we only catch FUSE tasks here
         return None
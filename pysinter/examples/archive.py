@@ -0,0 +1,269 @@
+from errno import EACCES, EINVAL, EIO, EISDIR, ENOENT, ENOTDIR, EOPNOTSUPP, EROFS
+from mmap import mmap, ACCESS_READ
+from os import O_ACCMODE, O_RDONLY, O_TRUNC, open as osopen, close as osclose
+from stat import S_ISDIR, S_ISLNK, S_ISREG
+from zlib import decompressobj, MAX_WBITS, error as ZlibError
+
+from pysinter import FUSEError, ROOT_INODE
+from pysinter.constants import (
+    FOPEN_KEEP_CACHE, FOPEN_CACHE_DIR
+    , FUSE_ASYNC_READ, FUSE_DO_READDIRPLUS, FUSE_READDIRPLUS_AUTO, FUSE_PARALLEL_DIROPS
+    , FUSE_MAX_PAGES, FUSE_CACHE_SYMLINKS
+    )
+from pysinter.examples.archiveindex import ArchiveIndex
+from pysinter.examples.fdpool import HandleTable
+from pysinter.helper import fuse_negotiate, dyn_nop, dyn_nosend
+
+'''
+A read-only filesystem serving the contents of a tar or zip archive, for
+immutable datasets.
+
+LOOKUP, GETATTR and READDIR are answered from the archive's index, see
+pysinter.examples.archiveindex, without touching the archive itself. READ
+replies are views into a read-only mapping of the archive, so file data is
+only ever copied into the reply. Since nothing changes, entries and
+attributes are valid for a day and opened files and directories keep the
+kernel's page cache.
+'''
+
+DEFAULT_TIMEOUT = 86400.0
+DEFAULT_FLAGS = (
+    FUSE_ASYNC_READ | FUSE_DO_READDIRPLUS | FUSE_READDIRPLUS_AUTO | FUSE_PARALLEL_DIROPS
+    | FUSE_MAX_PAGES | FUSE_CACHE_SYMLINKS
+    )
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+BLOCK_SIZE = 512
+NAME_MAX = 255
+NS = 1000000000
+DIRENT_SIZE = 24
+ENTRY_OUT_SIZE = 128
+FIRST_COOKIE = 3 # After . and ..
+
+def _dirent_size(name, plus=False):
+    return (ENTRY_OUT_SIZE if plus else 0) + ((DIRENT_SIZE + len(name) + 7) & ~7)
+
+class ArchiveFS():
+    '''
+    Serve the archive at path. The index is cached at index_path, by
+    default next to the archive.
+    '''
+    def __init__(self, path, index_path=None, timeout=DEFAULT_TIMEOUT, major=7, minor=31, flags=DEFAULT_FLAGS):
+        self._index = ArchiveIndex(path, index_path=index_path)
+        fd = osopen(path, O_RDONLY)
+        try:
+            self._map = mmap(fd, 0, access=ACCESS_READ)
+        finally:
+            osclose(fd)
+        self._view = memoryview(self._map)
+        self._inflated = HandleTable()
+        self._timeout_sec = int(timeout)
+        self._timeout_nsec = int(timeout * NS) % NS
+        self._major = major
+        self._minor = minor
+        self._flags = flags
+        return None
+    def _record(self, ino):
+        num = ino - ROOT_INODE
+        if not 0 <= num < self._index.count:
+            raise FUSEError(ENOENT)
+        return self._index.record(num)
+    def _attr(self, ino, record):
+        mode = record[3]
+        mtime = record[6]
+        size = record[8]
+        if S_ISDIR(mode):
+            size = 0
+        return {
+            'ino': ino
+            , 'size': size
+            , 'blocks': (size + BLOCK_SIZE - 1) // BLOCK_SIZE
+            , 'timeandmode': {
+                'atime': mtime // NS
+                , 'mtime': mtime // NS
+                , 'ctime': mtime // NS
+                , 'atimensec': mtime % NS
+                , 'mtimensec': mtime % NS
+                , 'ctimensec': mtime % NS
+                , 'mode': mode
+                }
+            , 'nlink': record[11]
+            , 'uid': record[4]
+            , 'gid': record[5]
+            , 'blksize': BLOCK_SIZE
+            }
+    def _entry(self, ino, record):
+        '''
+        Inodes never go away, so lookups are not counted.
+        '''
+        return {
+            'nodeId': ino
+            , 'entryValid': self._timeout_sec
+            , 'attrValid': self._timeout_sec
+            , 'entryValidNsec': self._timeout_nsec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': self._attr(ino, record)
+            }
+    async def init(self, header, parsed):
+        return 0, fuse_negotiate(parsed, major=self._major, minor=self._minor, flags=self._flags)
+    async def lookup(self, header, parsed):
+        record = self._record(header.nodeid)
+        if not S_ISDIR(record[3]):
+            raise FUSEError(ENOTDIR)
+        name = parsed['name']
+        if name == b'..':
+            num = record[0]
+        else:
+            num = self._index.find(header.nodeid - ROOT_INODE, name)
+        if num is None: # Cached by the kernel as absent, which it stays
+            return 0, {'entry': [{'entryValid': self._timeout_sec, 'entryValidNsec': self._timeout_nsec}]}
+        ino = num + ROOT_INODE
+        return 0, {'entry': [self._entry(ino, self._index.record(num))]}
+    async def getattr(self, header, parsed):
+        return 0, {
+            'attrValid': self._timeout_sec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': self._attr(header.nodeid, self._record(header.nodeid))
+            }
+    async def readlink(self, header, parsed):
+        record = self._record(header.nodeid)
+        if not S_ISLNK(record[3]):
+            raise FUSEError(EINVAL)
+        return 0, {'data': self._index.heap(record[7], record[8])}
+    def _inflate(self, record):
+        offset, size, stored, method = record[7], record[8], record[9], record[10]
+        if method != ZIP_DEFLATED:
+            raise FUSEError(EOPNOTSUPP)
+        try:
+            data = decompressobj(-MAX_WBITS).decompress(self._view[offset:offset + stored], size)
+        except ZlibError as e:
+            raise FUSEError(EIO) from e
+        return data
+    async def open(self, header, parsed):
+        '''
+        Deflated zip members are inflated into memory here, for as long as
+        they are open. Stored data needs no file handle.
+        '''
+        record = self._record(header.nodeid)
+        if S_ISDIR(record[3]):
+            raise FUSEError(EISDIR)
+        if not S_ISREG(record[3]):
+            raise FUSEError(EACCES)
+        if parsed['flags'] & O_ACCMODE != O_RDONLY or parsed['flags'] & O_TRUNC:
+            raise FUSEError(EROFS)
+        fh = 0
+        if record[10] != ZIP_STORED:
+            fh = self._inflated.add(self._inflate(record)) + 1
+        return 0, {'fh': fh, 'openFlags': FOPEN_KEEP_CACHE}
+    async def read(self, header, parsed):
+        offset = parsed['offset']
+        fh = parsed['fh']
+        if fh:
+            data = self._inflated.get(fh - 1)
+            if data is None:
+                raise FUSEError(ENOENT)
+            return 0, {'data': data[offset:offset + parsed['size']]}
+        record = self._record(header.nodeid)
+        size = record[8]
+        if offset >= size:
+            return 0, {'data': b''}
+        start = record[7] + offset
+        return 0, {'data': self._view[start:start + min(parsed['size'], size - offset)]}
+    async def release(self, header, parsed):
+        if parsed['fh']:
+            self._inflated.remove(parsed['fh'] - 1)
+        return 0, {}
+    async def opendir(self, header, parsed):
+        if not S_ISDIR(self._record(header.nodeid)[3]):
+            raise FUSEError(ENOTDIR)
+        return 0, {'fh': 0, 'openFlags': FOPEN_KEEP_CACHE | FOPEN_CACHE_DIR}
+    def _dirents(self, ino, cookie):
+        '''
+        Yield (cookie, name, inode, record) after cookie, including . and ..
+        '''
+        index = self._index
+        record = self._record(ino)
+        if not S_ISDIR(record[3]):
+            raise FUSEError(ENOTDIR)
+        if cookie < 1:
+            yield 1, b'.', ino, record
+        if cookie < 2:
+            yield 2, b'..', record[0] + ROOT_INODE, index.record(record[0])
+        first, count = record[7], record[8]
+        for num in range(first + max(0, cookie - 2), first + count):
+            child = index.record(num)
+            yield num - first + FIRST_COOKIE, index.name(child), num + ROOT_INODE, child
+    async def readdir(self, header, parsed):
+        remaining = parsed['size']
+        entries = []
+        for cookie, name, ino, record in self._dirents(header.nodeid, parsed['cookie']):
+            remaining = remaining - _dirent_size(name)
+            if remaining < 0:
+                break
+            entries.append({
+                'ino': ino
+                , 'cookie': cookie
+                , 'namelen': len(name)
+                , 'type': record[3] >> 12
+                , 'name': name
+                })
+        return 0, {'data': entries}
+    async def readdirplus(self, header, parsed):
+        remaining = parsed['size']
+        entries = []
+        for cookie, name, ino, record in self._dirents(header.nodeid, parsed['cookie']):
+            remaining = remaining - _dirent_size(name, plus=True)
+            if remaining < 0:
+                break
+            if cookie < FIRST_COOKIE:
+                entry = {'nodeId': ino, 'attr': self._attr(ino, record)}
+            else:
+                entry = self._entry(ino, record)
+            entries.append({
+                'entryOut': entry
+                , 'dirent': {
+                    'ino': ino
+                    , 'cookie': cookie
+                    , 'namelen': len(name)
+                    , 'type': record[3] >> 12
+                    , 'name': name
+                    }
+                })
+        return 0, {'data': entries}
+    async def statfs(self, header, parsed):
+        return 0, {'st': {
+            'blocks': (len(self._map) + BLOCK_SIZE - 1) // BLOCK_SIZE
+            , 'files': self._index.count
+            , 'bsize': BLOCK_SIZE
+            , 'namelen': NAME_MAX
+            , 'frsize': BLOCK_SIZE
+            }}
+    def close(self):
+        '''
+        READ replies may still hold views of the mapping, e.g. in a log
+        record, so it is not closed here but unmapped once the last view
+        is gone.
+        '''
+        self._view = None
+        self._map = None
+        self._index.close()
+        return None
+    def make(self):
+        return {
+            'FUSE_INIT': self.init
+            , 'FUSE_LOOKUP': self.lookup
+            , 'FUSE_FORGET': dyn_nosend
+            , 'FUSE_BATCH_FORGET': dyn_nosend
+            , 'FUSE_GETATTR': self.getattr
+            , 'FUSE_READLINK': self.readlink
+            , 'FUSE_OPEN': self.open
+            , 'FUSE_READ': self.read
+            , 'FUSE_FLUSH': dyn_nop
+            , 'FUSE_RELEASE': self.release
+            , 'FUSE_OPENDIR': self.opendir
+            , 'FUSE_READDIR': self.readdir
+            , 'FUSE_READDIRPLUS': self.readdirplus
+            , 'FUSE_RELEASEDIR': dyn_nop
+            , 'FUSE_STATFS': self.statfs
+            , 'FUSE_ACCESS': dyn_nop
+            }
@@ -0,0 +1,269 @@
+from bisect import bisect_left
+from calendar import timegm
+from collections import deque
+from mmap import mmap, ACCESS_READ
+from os import O_RDONLY, open as osopen, close as osclose, fstat, replace, getpid
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_ISDIR, S_ISLNK
+from struct import Struct
+from tarfile import open as taropen
+from zipfile import ZipFile, is_zipfile, ZIP_STORED
+
+'''
+The index of a tar or zip archive served by pysinter.examples.archive.
+
+Entries are numbered breadth first from the root, so every directory's
+children are one contiguous run of records sorted by name, found from the
+directory's record by binary search. The inode of an entry is its record
+number plus one, the root being ROOT_INODE. Names and symlink targets live
+in a heap behind the records.
+The index is built once and cached in a file next to the archive, stamped
+with the archive's size and modification time; it is mapped rather than
+parsed when opened again.
+
+Only data stored as is can be served straight from a mapping of the
+archive: tar members of uncompressed tars and zip members stored without
+compression. Deflated zip members are recorded with their method and
+inflated when opened. Sparse tar members, devices and fifos are left out.
+'''
+
+MAGIC = b'PYSARC01'
+HEADER = Struct('<8sIIQQq') # magic, version, record size, count, archive size, archive mtime
+# parent, name offset, name length, mode, uid, gid, mtime, data offset or first child,
+# size or child count, stored size, method, nlink
+RECORD = Struct('<QQIIIIqQQQII')
+VERSION = 1
+INDEX_SUFFIX = '.pysidx'
+ZIP_LOCAL_HEADER = Struct('<IHHHHHIIIHH')
+ZIP_LOCAL_MAGIC = 0x04034b50
+ZIP_ENCRYPTED = 0x1
+ENCRYPTED = 0xffffffff # Method recorded for encrypted zip members
+DEFAULT_FILE_MODE = 0o644
+DEFAULT_DIR_MODE = 0o755
+NS = 1000000000
+
+class _Entry():
+    __slots__ = ('name', 'mode', 'uid', 'gid', 'mtime', 'offset', 'size', 'stored', 'method', 'target', 'children', 'parent')
+    def __init__(self, name, mode, uid=0, gid=0, mtime=0, offset=0, size=0, stored=0, method=ZIP_STORED, target=b''):
+        self.name = name
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.mtime = mtime
+        self.offset = offset
+        self.size = size
+        self.stored = stored
+        self.method = method
+        self.target = target
+        self.children = {} if S_ISDIR(mode) else None
+        self.parent = 0
+        return None
+
+def _split(name):
+    '''
+    Path components of an archive member name, without ., .. or empty ones.
+    '''
+    if isinstance(name, str):
+        name = name.encode('utf-8', 'surrogateescape')
+    return [part for part in name.split(b'/') if part and part not in (b'.', b'..')]
+
+def _insert(root, parts, entry):
+    directory = root
+    for part in parts[:-1]:
+        child = directory.children.get(part)
+        if child is None or child.children is None:
+            child = directory.children[part] = _Entry(part, S_IFDIR | DEFAULT_DIR_MODE, mtime=entry.mtime)
+        directory = child
+    old = directory.children.get(parts[-1])
+    if old is not None and old.children is not None and entry.children is not None:
+        entry.children = old.children # Directory listed after its contents
+    directory.children[parts[-1]] = entry
+    return None
+
+def _tar_entries(path, root):
+    members = {}
+    with taropen(path, 'r:') as tar:
+        for member in tar:
+            parts = _split(member.name)
+            if not parts:
+                continue
+            mode = member.mode & 0o7777
+            mtime = int(member.mtime) * NS
+            if member.isdir():
+                entry = _Entry(parts[-1], S_IFDIR | mode, member.uid, member.gid, mtime)
+            elif member.issym():
+                target = member.linkname.encode('utf-8', 'surrogateescape')
+                entry = _Entry(parts[-1], S_IFLNK | 0o777, member.uid, member.gid, mtime, size=len(target), target=target)
+            elif member.islnk(): # Hard link, shares the data of an earlier member
+                linked = members.get(tuple(_split(member.linkname)))
+                if linked is None:
+                    continue
+                entry = _Entry(parts[-1], S_IFREG | mode, member.uid, member.gid, mtime, linked.offset, linked.size, linked.stored)
+            elif member.isreg() and not member.issparse():
+                entry = _Entry(parts[-1], S_IFREG | mode, member.uid, member.gid, mtime, member.offset_data, member.size, member.size)
+            else:
+                continue
+            members[tuple(parts)] = entry
+            _insert(root, parts, entry)
+    return None
+
+def _zip_entries(path, root):
+    with ZipFile(path) as archive, open(path, 'rb') as raw:
+        for info in archive.infolist():
+            parts = _split(info.filename)
+            if not parts:
+                continue
+            mode = info.external_attr >> 16
+            year, month, day, hour, minute, second = info.date_time
+            mtime = timegm((year, month, day, hour, minute, second, 0, 0, 0)) * NS
+            if info.is_dir():
+                entry = _Entry(parts[-1], S_IFDIR | (mode & 0o7777 or DEFAULT_DIR_MODE), mtime=mtime)
+                _insert(root, parts, entry)
+                continue
+            raw.seek(info.header_offset)
+            local = ZIP_LOCAL_HEADER.unpack(raw.read(ZIP_LOCAL_HEADER.size))
+            if local[0] != ZIP_LOCAL_MAGIC:
+                raise ValueError('Bad local header in zip archive', path, info.filename)
+            offset = info.header_offset + ZIP_LOCAL_HEADER.size + local[9] + local[10]
+            method = info.compress_type
+            if info.flag_bits & ZIP_ENCRYPTED:
+                method = ENCRYPTED # Never served
+            if S_ISLNK(mode):
+                target = archive.read(info)
+                entry = _Entry(parts[-1], S_IFLNK | 0o777, mtime=mtime, size=len(target), target=target)
+            else:
+                entry = _Entry(
+                    parts[-1], S_IFREG | (mode & 0o7777 or DEFAULT_FILE_MODE), mtime=mtime
+                    , offset=offset, size=info.file_size, stored=info.compress_size, method=method
+                    )
+            _insert(root, parts, entry)
+    return None
+
+def build_index(path, archive_size, archive_mtime):
+    '''
+    The index of the archive at path as bytes.
+    '''
+    root = _Entry(b'', S_IFDIR | DEFAULT_DIR_MODE, mtime=archive_mtime)
+    if is_zipfile(path):
+        _zip_entries(path, root)
+    else:
+        _tar_entries(path, root)
+    order = [root]
+    queue = deque([0])
+    while queue: # Breadth first, so children follow each other by name
+        num = queue.popleft()
+        directory = order[num]
+        first = len(order)
+        for name in sorted(directory.children):
+            child = directory.children[name]
+            child.parent = num
+            order.append(child)
+            if child.children is not None:
+                queue.append(len(order) - 1)
+        directory.offset = first
+        directory.size = len(order) - first
+    heap = bytearray()
+    records = bytearray()
+    for entry in order:
+        name_offset = len(heap)
+        heap += entry.name
+        offset = entry.offset
+        if entry.children is None and S_ISLNK(entry.mode):
+            offset = len(heap)
+            heap += entry.target
+        nlink = 1
+        if entry.children is not None:
+            nlink = 2 + sum(1 for child in entry.children.values() if child.children is not None)
+        records += RECORD.pack(
+            entry.parent, name_offset, len(entry.name), entry.mode, entry.uid, entry.gid, entry.mtime
+            , offset, entry.size, entry.stored, entry.method, nlink
+            )
+    return HEADER.pack(MAGIC, VERSION, RECORD.size, len(order), archive_size, archive_mtime) + records + heap
+
+class ArchiveIndex():
+    '''
+    The index of the archive at path, loaded from index_path (by default
+    next to the archive) or built and written there. If the index cannot be
+    written, it is kept in memory.
+    '''
+    def __init__(self, path, index_path=None):
+        if index_path is None:
+            index_path = f'{path}{INDEX_SUFFIX}'
+        fd = osopen(path, O_RDONLY)
+        try:
+            data = fstat(fd)
+        finally:
+            osclose(fd)
+        self.built = False
+        self._map = self._load(index_path, data.st_size, data.st_mtime_ns)
+        if self._map is None:
+            self._map = build_index(path, data.st_size, data.st_mtime_ns)
+            self.built = True
+            tmppath = f'{index_path}.{getpid()}.tmp'
+            try:
+                with open(tmppath, 'wb') as f:
+                    f.write(self._map)
+                replace(tmppath, index_path)
+            except OSError:
+                pass
+        self.count = HEADER.unpack_from(self._map, 0)[3]
+        self._heap = HEADER.size + self.count * RECORD.size
+        return None
+    def _load(self, index_path, size, mtime):
+        try:
+            fd = osopen(index_path, O_RDONLY)
+        except OSError:
+            return None
+        try:
+            if fstat(fd).st_size < HEADER.size:
+                return None
+            res = mmap(fd, 0, access=ACCESS_READ)
+        finally:
+            osclose(fd)
+        magic, version, record_size, _, archive_size, archive_mtime = HEADER.unpack_from(res, 0)
+        if (magic, version, record_size, archive_size, archive_mtime) != (MAGIC, VERSION, RECORD.size, size, mtime):
+            res.close()
+            return None
+        return res
+    def record(self, num):
+        '''
+        (parent, name offset, name length, mode, uid, gid, mtime, offset,
+        size, stored size, method, nlink) of the record.
+        '''
+        return RECORD.unpack_from(self._map, HEADER.size + num * RECORD.size)
+    def heap(self, offset, length):
+        start = self._heap + offset
+        return bytes(self._map[start:start + length])
+    def name(self, record):
+        return self.heap(record[1], record[2])
+    def find(self, directory, name):
+        '''
+        The record number of name in the directory record, or None.
+        '''
+        record = self.record(directory)
+        if not S_ISDIR(record[3]):
+            return None
+        first, count = record[7], record[8]
+        names = _Names(self, first, count)
+        pos = bisect_left(names, name)
+        if pos < count and names[pos] == name:
+            return first + pos
+        return None
+    def close(self):
+        if isinstance(self._map, mmap):
+            self._map.close()
+        return None
+
+class _Names():
+    '''
+    The names of a run of records as a sequence for bisect.
+    '''
+    __slots__ = ('_index', '_first', '_count')
+    def __init__(self, index, first, count):
+        self._index = index
+        self._first = first
+        self._count = count
+        return None
+    def __len__(self):
+        return self._count
+    def __getitem__(self, pos):
+        return self._index.name(self._index.record(self._first + pos))
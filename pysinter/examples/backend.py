@@ -0,0 +1,168 @@
+from asyncio import gather
+from collections import namedtuple
+from os import (
+    O_CREAT, O_RDONLY, O_WRONLY, open as osopen, close as osclose, pread, pwrite
+    , stat, scandir, fsencode, mkdir, rmdir, chmod, remove as osremove
+    , rename as osrename, truncate as ostruncate
+    )
+from os.path import join as pjoin
+
+from pysinter import FUSEError
+from pysinter.examples.passthrough import dirent_type
+
+'''
+Storage behind pysinter.examples.backendfs.BackendFS. A backend is reached by
+path rather than by fd, the way object and metadata services are, and every
+operation is a coroutine, so slow backends only hold up the requests that
+wait for them.
+'''
+
+STAT_FIELDS = (
+    'st_ino', 'st_mode', 'st_nlink', 'st_uid', 'st_gid', 'st_size', 'st_blksize'
+    , 'st_atime_ns', 'st_mtime_ns', 'st_ctime_ns'
+    )
+NS = 1000000000
+
+class Stat(namedtuple('Stat', STAT_FIELDS)):
+    '''
+    The part of os.stat_result that makes up FUSE attributes, plain enough
+    to send over the wire.
+    '''
+    __slots__ = ()
+    @classmethod
+    def from_stat(cls, data):
+        return cls(*(getattr(data, name) for name in STAT_FIELDS))
+    @property
+    def st_atime(self):
+        return self.st_atime_ns // NS
+    @property
+    def st_mtime(self):
+        return self.st_mtime_ns // NS
+    @property
+    def st_ctime(self):
+        return self.st_ctime_ns // NS
+
+class Backend():
+    '''
+    The storage operations of BackendFS. Paths are bytes relative to the
+    backend's root, b'' being the root itself. Failures raise FUSEError
+    with the errno to reply with.
+    '''
+    async def stat(self, path):
+        '''
+        A Stat of the path, not following symlinks.
+        '''
+        raise NotImplementedError
+    async def stat_many(self, paths):
+        '''
+        A Stat per path, None for paths that do not exist.
+        '''
+        async def maybe_stat(path):
+            try:
+                return await self.stat(path)
+            except FUSEError:
+                return None
+        return await gather(*(maybe_stat(path) for path in paths))
+    async def listdir(self, path):
+        '''
+        (name, inode, type) per entry, type being the file type bits of the
+        mode shifted down like in READDIR.
+        '''
+        raise NotImplementedError
+    async def read(self, path, offset, size):
+        raise NotImplementedError
+    async def write(self, path, offset, data):
+        '''
+        Returns the number of bytes written.
+        '''
+        raise NotImplementedError
+    async def create(self, path, mode):
+        '''
+        Create an empty file if none exists, returning its Stat.
+        '''
+        raise NotImplementedError
+    async def mkdir(self, path, mode):
+        '''
+        Returns the new directory's Stat.
+        '''
+        raise NotImplementedError
+    async def unlink(self, path):
+        raise NotImplementedError
+    async def rmdir(self, path):
+        raise NotImplementedError
+    async def rename(self, old, new):
+        raise NotImplementedError
+    async def truncate(self, path, size):
+        raise NotImplementedError
+    async def chmod(self, path, mode):
+        raise NotImplementedError
+    async def close(self):
+        return None
+
+def _oserror(function, *args, **kwargs):
+    try:
+        return function(*args, **kwargs)
+    except OSError as e:
+        raise FUSEError(e.errno) from e
+
+class LocalBackend(Backend):
+    '''
+    A directory of the local filesystem. Calls block the event loop, which
+    is fine as long as the directory is local.
+    '''
+    def __init__(self, root):
+        if isinstance(root, str):
+            root = fsencode(root)
+        self._root = root
+        return None
+    def _path(self, path):
+        return pjoin(self._root, path) if path else self._root
+    async def stat(self, path):
+        return Stat.from_stat(_oserror(stat, self._path(path), follow_symlinks=False))
+    async def stat_many(self, paths):
+        res = []
+        for path in paths:
+            try:
+                res.append(Stat.from_stat(stat(self._path(path), follow_symlinks=False)))
+            except OSError:
+                res.append(None)
+        return res
+    async def listdir(self, path):
+        def scan():
+            with scandir(self._path(path)) as entries:
+                return [(entry.name, entry.inode(), dirent_type(entry)) for entry in entries]
+        return _oserror(scan)
+    async def read(self, path, offset, size):
+        fd = _oserror(osopen, self._path(path), O_RDONLY)
+        try:
+            return _oserror(pread, fd, size, offset)
+        finally:
+            osclose(fd)
+    async def write(self, path, offset, data):
+        fd = _oserror(osopen, self._path(path), O_WRONLY)
+        try:
+            return _oserror(pwrite, fd, data, offset)
+        finally:
+            osclose(fd)
+    async def create(self, path, mode):
+        fd = _oserror(osopen, self._path(path), O_WRONLY | O_CREAT, mode)
+        osclose(fd)
+        return await self.stat(path)
+    async def mkdir(self, path, mode):
+        _oserror(mkdir, self._path(path), mode)
+        return await self.stat(path)
+    async def unlink(self, path):
+        _oserror(osremove, self._path(path))
+        return None
+    async def rmdir(self, path):
+        _oserror(rmdir, self._path(path))
+        return None
+    async def rename(self, old, new):
+        _oserror(osrename, self._path(old), self._path(new))
+        return None
+    async def truncate(self, path, size):
+        _oserror(ostruncate, self._path(path), size)
+        return None
+    async def chmod(self, path, mode):
+        _oserror(chmod, self._path(path), mode)
+        return None
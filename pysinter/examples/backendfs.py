@@ -0,0 +1,220 @@
+from errno import ENOENT
+from os import O_TRUNC
+
+from pysinter import FUSEError, ROOT_INODE
+from pysinter.constants import FATTR_MODE, FATTR_SIZE
+from pysinter.examples.fdpool import HandleTable
+from pysinter.examples.passthrough import stat_to_attr
+from pysinter.helper import mk_dyn_negotiate, dyn_nop, dyn_nosend
+
+'''
+A passthrough filesystem over a pysinter.examples.backend.Backend instead of
+local fds, for storage reached by path like a remote metadata and object
+service. Inodes are known by their path, which is all a backend offers;
+renaming a directory rewrites the paths below it.
+Attributes and entries are valid for timeout seconds, so the kernel only
+comes back for them that often. READDIRPLUS fetches the attributes of a
+whole batch of entries with one stat_many call.
+'''
+
+DEFAULT_TIMEOUT = 1.0
+DIRENT_SIZE = 24
+ENTRY_OUT_SIZE = 128
+
+def _dirent_size(name, plus=False):
+    return (ENTRY_OUT_SIZE if plus else 0) + ((DIRENT_SIZE + len(name) + 7) & ~7)
+
+class BackendFS():
+    def __init__(self, backend, timeout=DEFAULT_TIMEOUT, major=7, minor=31, flags=0):
+        self._backend = backend
+        self._paths = {ROOT_INODE: b''}
+        self._inos = {b'': ROOT_INODE}
+        self._listings = HandleTable()
+        self._timeout_sec = int(timeout)
+        self._timeout_nsec = int(timeout * 1000000000) % 1000000000
+        self._major = major
+        self._minor = minor
+        self._flags = flags
+        return None
+    def _path(self, nodeid):
+        path = self._paths.get(nodeid)
+        if path is None:
+            raise FUSEError(ENOENT)
+        return path
+    def _child(self, nodeid, name):
+        path = self._path(nodeid)
+        return path + b'/' + name if path else name
+    def _register(self, ino, path):
+        if ino == ROOT_INODE:
+            raise NotImplementedError(
+                'Cannot cope with inode same as ROOT_INODE yet'
+                , path
+                )
+        old = self._paths.get(ino)
+        if old is not None and self._inos.get(old) == ino:
+            del self._inos[old]
+        self._paths[ino] = path
+        self._inos[path] = ino
+        return None
+    def _drop(self, path):
+        ino = self._inos.pop(path, None)
+        if ino is not None:
+            del self._paths[ino]
+        return None
+    def _entry(self, data):
+        return {
+            'nodeId': data.st_ino
+            , 'entryValid': self._timeout_sec
+            , 'attrValid': self._timeout_sec
+            , 'entryValidNsec': self._timeout_nsec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': stat_to_attr(data, ino=data.st_ino)
+            }
+    def _attr_reply(self, data, ino):
+        return {
+            'attrValid': self._timeout_sec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': stat_to_attr(data, ino=ino)
+            }
+    async def getattr(self, header, parsed):
+        data = await self._backend.stat(self._path(header.nodeid))
+        return 0, self._attr_reply(data, header.nodeid)
+    async def lookup(self, header, parsed):
+        path = self._child(header.nodeid, parsed['name'])
+        data = await self._backend.stat(path)
+        self._register(data.st_ino, path)
+        return 0, {'entry': [self._entry(data)]}
+    async def setattr(self, header, parsed):
+        path = self._path(header.nodeid)
+        valid = parsed['valid']
+        if valid & FATTR_SIZE:
+            await self._backend.truncate(path, parsed['size'])
+        if valid & FATTR_MODE:
+            await self._backend.chmod(path, parsed['timeandmode']['mode'] & 0o7777)
+        return 0, self._attr_reply(await self._backend.stat(path), header.nodeid)
+    async def mkdir(self, header, parsed):
+        path = self._child(header.nodeid, parsed['name'])
+        data = await self._backend.mkdir(path, parsed['mode'] & ~parsed['umask'])
+        self._register(data.st_ino, path)
+        return 0, {'entry': self._entry(data)}
+    async def create(self, header, parsed):
+        path = self._child(header.nodeid, parsed['name'])
+        data = await self._backend.create(path, parsed['mode'] & ~parsed['umask'])
+        if parsed['flags'] & O_TRUNC and data.st_size:
+            await self._backend.truncate(path, 0)
+            data = data._replace(st_size=0)
+        self._register(data.st_ino, path)
+        return 0, {'entry': self._entry(data), 'fh': 0, 'openFlags': 0}
+    async def unlink(self, header, parsed):
+        path = self._child(header.nodeid, parsed['name'])
+        await self._backend.unlink(path)
+        self._drop(path)
+        return 0, {}
+    async def rmdir(self, header, parsed):
+        path = self._child(header.nodeid, parsed['name'])
+        await self._backend.rmdir(path)
+        self._drop(path)
+        return 0, {}
+    async def rename(self, header, parsed):
+        old = self._child(header.nodeid, parsed['oldname'])
+        new = self._child(parsed['newdir'], parsed['newname'])
+        await self._backend.rename(old, new)
+        self._drop(new)
+        prefix = old + b'/'
+        for path in [path for path in self._inos if path == old or path.startswith(prefix)]:
+            self._register(self._inos[path], new + path[len(old):])
+        return 0, {}
+    async def open(self, header, parsed):
+        if parsed['flags'] & O_TRUNC:
+            await self._backend.truncate(self._path(header.nodeid), 0)
+        return 0, {'fh': 0}
+    async def read(self, header, parsed):
+        data = await self._backend.read(self._path(header.nodeid), parsed['offset'], parsed['size'])
+        return 0, {'data': data}
+    async def write(self, header, parsed):
+        count = await self._backend.write(self._path(header.nodeid), parsed['offset'], parsed['data'])
+        return 0, {'size': count}
+    async def opendir(self, header, parsed):
+        '''
+        The listing is taken once, READDIR cookies are positions in it.
+        '''
+        path = self._path(header.nodeid)
+        listing = await self._backend.listdir(path)
+        return 0, {'fh': self._listings.add((path, listing))}
+    def _listing(self, fh):
+        res = self._listings.get(fh)
+        if res is None:
+            raise FUSEError(ENOENT)
+        return res
+    async def readdir(self, header, parsed):
+        _, listing = self._listing(parsed['fh'])
+        remaining = parsed['size']
+        entries = []
+        for cookie, (name, ino, dtype) in enumerate(listing[parsed['cookie']:], start=parsed['cookie'] + 1):
+            remaining = remaining - _dirent_size(name)
+            if remaining < 0:
+                break
+            entries.append({
+                'ino': ino
+                , 'cookie': cookie
+                , 'namelen': len(name)
+                , 'type': dtype
+                , 'name': name
+                })
+        return 0, {'data': entries}
+    async def readdirplus(self, header, parsed):
+        path, listing = self._listing(parsed['fh'])
+        remaining = parsed['size']
+        batch = []
+        for cookie, (name, ino, dtype) in enumerate(listing[parsed['cookie']:], start=parsed['cookie'] + 1):
+            remaining = remaining - _dirent_size(name, plus=True)
+            if remaining < 0:
+                break
+            batch.append((cookie, name, dtype))
+        paths = [path + b'/' + name if path else name for _, name, _ in batch]
+        entries = []
+        for (cookie, name, dtype), child, data in zip(batch, paths, await self._backend.stat_many(paths)):
+            if data is None: # Gone since OPENDIR
+                continue
+            self._register(data.st_ino, child)
+            entries.append({
+                'entryOut': self._entry(data)
+                , 'dirent': {
+                    'ino': data.st_ino
+                    , 'cookie': cookie
+                    , 'namelen': len(name)
+                    , 'type': dtype
+                    , 'name': name
+                    }
+                })
+        return 0, {'data': entries}
+    async def releasedir(self, header, parsed):
+        self._listings.remove(parsed['fh'])
+        return 0, {}
+    async def destroy(self, header, parsed):
+        await self._backend.close()
+        return 0, {}
+    def make(self):
+        return {
+            'FUSE_INIT': mk_dyn_negotiate(major=self._major, minor=self._minor, flags=self._flags)
+            , 'FUSE_DESTROY': self.destroy
+            , 'FUSE_GETATTR': self.getattr
+            , 'FUSE_SETATTR': self.setattr
+            , 'FUSE_LOOKUP': self.lookup
+            , 'FUSE_FORGET': dyn_nosend
+            , 'FUSE_MKDIR': self.mkdir
+            , 'FUSE_CREATE': self.create
+            , 'FUSE_UNLINK': self.unlink
+            , 'FUSE_RMDIR': self.rmdir
+            , 'FUSE_RENAME': self.rename
+            , 'FUSE_OPEN': self.open
+            , 'FUSE_READ': self.read
+            , 'FUSE_WRITE': self.write
+            , 'FUSE_RELEASE': dyn_nop
+            , 'FUSE_FLUSH': dyn_nop
+            , 'FUSE_FSYNC': dyn_nop
+            , 'FUSE_OPENDIR': self.opendir
+            , 'FUSE_READDIR': self.readdir
+            , 'FUSE_READDIRPLUS': self.readdirplus
+            , 'FUSE_RELEASEDIR': self.releasedir
+            }
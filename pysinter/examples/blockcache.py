@@ -0,0 +1,218 @@
+from asyncio import get_running_loop
+from collections import OrderedDict
+from os import close as osclose, dup, pread as ospread
+
+'''
+Block cache for the passthrough example: file contents are read from the
+backing file in fixed-size blocks, kept in an LRU under a memory budget and
+served from there. Sequential reads on a file handle make the following
+blocks load ahead of time on a thread pool.
+All bookkeeping happens on the event loop thread, only the reads run on the
+pool.
+'''
+
+DEFAULT_BLOCKSIZE = 1 << 17
+DEFAULT_BUDGET = 64 << 20
+DEFAULT_PREFETCH = 8
+DEFAULT_WORKERS = 4
+SEQUENTIAL_THRESHOLD = 2
+
+def _pread_closing(pread, fd, size, offset):
+    '''
+    pread on a fd of its own, closed after.
+    '''
+    try:
+        return pread(fd, size, offset)
+    finally:
+        osclose(fd)
+
+class BlockCache():
+    '''
+    Cached reads keyed by inode. Writers must call invalidate(ino) when file
+    contents change, which drops the inode's blocks and makes reads still in
+    flight for it discard their results.
+    '''
+    def __init__(self, blocksize=DEFAULT_BLOCKSIZE, budget=DEFAULT_BUDGET, prefetch=DEFAULT_PREFETCH, workers=DEFAULT_WORKERS, pread=ospread):
+        if blocksize < 1 or budget < blocksize:
+            raise ValueError('Budget must hold at least one block', blocksize, budget)
+        self._blocksize = blocksize
+        self._budget = budget
+        self._prefetch = prefetch
+        self._workers = workers
+        self._pread = pread
+        self._executor = None
+        self._blocks = OrderedDict() # (ino, blockno) -> bytes
+        self._blocks_by_ino = {}
+        self._pending = {} # (ino, blockno) -> (generation, asyncio future, prefetch)
+        self._generation = {}
+        self._unused_prefetch = set() # Prefetched blocks not read yet
+        self._last_block = {} # ino -> number of the short block at end of file
+        self._streams = {} # fh -> (next offset, sequential run length)
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.evictions = 0
+        return None
+    def _submit(self, ino, fd, blockno, prefetch=False):
+        '''
+        Prefetches read from a duplicate of fd: nothing waits for them, so
+        the handle may be released and its fd closed and reused for another
+        file before they run. Reads on demand hold their handle open.
+        '''
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor(self._workers, thread_name_prefix='blockcache')
+        key = (ino, blockno)
+        generation = self._generation.get(ino, 0)
+        if prefetch:
+            args = (_pread_closing, self._pread, dup(fd))
+        else:
+            args = (self._pread, fd)
+        future = get_running_loop().run_in_executor(
+            self._executor
+            , *args
+            , self._blocksize
+            , blockno * self._blocksize
+            )
+        self._pending[key] = (generation, future, prefetch)
+        future.add_done_callback(lambda fut: self._loaded(key, generation, prefetch, fut))
+        return future
+    def _loaded(self, key, generation, prefetch, future):
+        pending = self._pending.get(key)
+        if pending is not None and pending[1] is future:
+            del self._pending[key]
+        if future.cancelled() or future.exception() is not None:
+            return None
+        if self._generation.get(key[0], 0) != generation:
+            return None # Invalidated while loading
+        block = future.result()
+        if len(block) < self._blocksize:
+            ino, blockno = key
+            self._last_block[ino] = min(blockno, self._last_block.get(ino, blockno))
+        self._store(key, block)
+        if prefetch:
+            self._unused_prefetch.add(key)
+        return None
+    def _store(self, key, block):
+        old = self._blocks.pop(key, None)
+        if old is not None:
+            self._size = self._size - len(old)
+        self._blocks[key] = block
+        self._blocks_by_ino.setdefault(key[0], set()).add(key[1])
+        self._size = self._size + len(block)
+        while self._size > self._budget:
+            (ino, blockno), evicted = self._blocks.popitem(last=False)
+            self._size = self._size - len(evicted)
+            self._unused_prefetch.discard((ino, blockno))
+            self._drop_index(ino, blockno)
+            self.evictions = self.evictions + 1
+        return None
+    def _drop_index(self, ino, blockno):
+        blocknos = self._blocks_by_ino.get(ino)
+        if blocknos is not None:
+            blocknos.discard(blockno)
+            if not blocknos:
+                del self._blocks_by_ino[ino]
+        return None
+    async def _block(self, ino, fd, blockno):
+        key = (ino, blockno)
+        block = self._blocks.get(key)
+        if block is not None:
+            self._blocks.move_to_end(key)
+            if key in self._unused_prefetch:
+                self._unused_prefetch.discard(key)
+                self.prefetch_hits = self.prefetch_hits + 1
+            else:
+                self.hits = self.hits + 1
+            return block
+        pending = self._pending.get(key)
+        if pending is not None and pending[0] == self._generation.get(ino, 0):
+            if pending[2]:
+                self.prefetch_hits = self.prefetch_hits + 1
+            else:
+                self.hits = self.hits + 1
+            future = pending[1]
+        else:
+            self.misses = self.misses + 1
+            future = self._submit(ino, fd, blockno)
+        return await future
+    def _track(self, ino, fh, fd, offset, size):
+        '''
+        Sequential detection per file handle, prefetching when it triggers.
+        '''
+        expected, run = self._streams.get(fh, (None, 0))
+        run = run + 1 if offset == expected else 0
+        self._streams[fh] = (offset + size, run)
+        if run < SEQUENTIAL_THRESHOLD or not self._prefetch:
+            return None
+        first = (offset + size + self._blocksize - 1) // self._blocksize
+        last = first + self._prefetch
+        if ino in self._last_block:
+            last = min(last, self._last_block[ino] + 1)
+        generation = self._generation.get(ino, 0)
+        for blockno in range(first, last):
+            key = (ino, blockno)
+            if key in self._blocks:
+                continue
+            pending = self._pending.get(key)
+            if pending is not None and pending[0] == generation:
+                continue
+            self._submit(ino, fd, blockno, prefetch=True)
+            self.prefetched = self.prefetched + 1
+        return None
+    async def read(self, ino, fh, fd, offset, size):
+        '''
+        Read size bytes at offset, like pread on fd, through the cache.
+        '''
+        if size <= 0:
+            return b''
+        blocksize = self._blocksize
+        self._track(ino, fh, fd, offset, size)
+        first = offset // blocksize
+        last = (offset + size - 1) // blocksize
+        start = offset - first * blocksize
+        if first == last:
+            block = await self._block(ino, fd, first)
+            return memoryview(block)[start:start + size]
+        parts = []
+        for blockno in range(first, last + 1):
+            block = await self._block(ino, fd, blockno)
+            parts.append(block)
+            if len(block) < blocksize: # End of file
+                break
+        return b''.join(parts)[start:start + size]
+    def invalidate(self, ino):
+        '''
+        Drop all cached blocks of the inode.
+        '''
+        self._generation[ino] = self._generation.get(ino, 0) + 1
+        self._last_block.pop(ino, None)
+        for blockno in self._blocks_by_ino.pop(ino, ()):
+            block = self._blocks.pop((ino, blockno))
+            self._size = self._size - len(block)
+            self._unused_prefetch.discard((ino, blockno))
+        return None
+    def release(self, fh):
+        '''
+        Forget the access pattern of a closed file handle.
+        '''
+        self._streams.pop(fh, None)
+        return None
+    def stats(self):
+        return {
+            'hits': self.hits
+            , 'misses': self.misses
+            , 'prefetched': self.prefetched
+            , 'prefetch_hits': self.prefetch_hits
+            , 'evictions': self.evictions
+            , 'blocks': len(self._blocks)
+            , 'bytes': self._size
+            , 'budget': self._budget
+            }
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        return None
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+from os import close as osclose
+
+'''
+A bounded pool of O_PATH directory fds for the passthrough example, so that
+names can be resolved with the *at calls relative to their parent directory
+instead of walking a full path from the root every time.
+'''
+
+DEFAULT_MAXSIZE = 256
+
+class DirFdPool():
+    '''
+    O_PATH fds keyed by inode, least recently used first. A miss calls
+    opener(ino), which may in turn get the fds of parent directories.
+    Evicting only happens when a top-level get misses, before the new fd is
+    opened, so that fds handed out earlier in the same operation stay open:
+    they are the most recently used and a pool of at least two never evicts
+    them.
+    '''
+    def __init__(self, opener, maxsize=DEFAULT_MAXSIZE):
+        if maxsize < 2:
+            raise ValueError('Pool needs room for at least two fds', maxsize)
+        self._opener = opener
+        self._maxsize = maxsize
+        self._fds = OrderedDict()
+        self._depth = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        return None
+    def _trim(self, size):
+        while len(self._fds) > size:
+            _, fd = self._fds.popitem(last=False)
+            osclose(fd)
+            self.evictions = self.evictions + 1
+        return None
+    def get(self, ino):
+        fd = self._fds.get(ino)
+        if fd is not None:
+            self._fds.move_to_end(ino)
+            self.hits = self.hits + 1
+            return fd
+        if self._depth == 0:
+            self._trim(self._maxsize - 1)
+        self._depth = self._depth + 1
+        try:
+            fd = self._opener(ino)
+        finally:
+            self._depth = self._depth - 1
+        self.misses = self.misses + 1
+        self._fds[ino] = fd
+        return fd
+    def discard(self, ino):
+        fd = self._fds.pop(ino, None)
+        if fd is not None:
+            osclose(fd)
+        return None
+    def stats(self):
+        return {
+            'open': len(self._fds)
+            , 'hits': self.hits
+            , 'misses': self.misses
+            , 'evictions': self.evictions
+            }
+    def close(self):
+        self._trim(0)
+        return None
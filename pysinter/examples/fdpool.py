@@ -0,0 +1,151 @@
+from collections import OrderedDict
+from heapq import heapify, heappop, heappush
+from os import close as osclose
+from time import monotonic
+
+'''
+File descriptor sharing for the passthrough example. Opens of the same inode
+with the same access mode share one OS fd, which is kept open for a while
+after the last release so that tools reopening files in a loop do not pay
+for an open and a close every time. FUSE file handles are indices into a
+HandleTable rather than OS fds.
+Sharing is safe because the passthrough only does positioned I/O.
+'''
+
+DEFAULT_MAX_IDLE = 64
+DEFAULT_IDLE_TIMEOUT = 5.0
+
+class Handle():
+    '''
+    An open FUSE file handle: the OS fd and the pool key it was acquired
+    under, None for fds of its own.
+    '''
+    __slots__ = ('fd', 'ino', 'key')
+    def __init__(self, fd, ino, key):
+        self.fd = fd
+        self.ino = ino
+        self.key = key
+        return None
+
+class HandleTable():
+    '''
+    Objects by small integer, reusing the lowest free index first to keep
+    the table compact.
+    '''
+    def __init__(self):
+        self._slots = []
+        self._free = []
+        return None
+    def add(self, obj):
+        if self._free:
+            index = heappop(self._free)
+            self._slots[index] = obj
+            return index
+        self._slots.append(obj)
+        return len(self._slots) - 1
+    def get(self, index):
+        if 0 <= index < len(self._slots):
+            return self._slots[index]
+        return None
+    def remove(self, index):
+        obj = self.get(index)
+        if obj is not None:
+            self._slots[index] = None
+            heappush(self._free, index)
+        return obj
+    def insert(self, index, obj):
+        '''
+        Put obj at a free index of choice, as when restoring a table.
+        '''
+        while len(self._slots) <= index:
+            self._free.append(len(self._slots))
+            self._slots.append(None)
+        if self._slots[index] is not None:
+            raise ValueError('Handle in use', index)
+        self._free.remove(index)
+        heapify(self._free)
+        self._slots[index] = obj
+        return None
+    def items(self):
+        return [(index, obj) for index, obj in enumerate(self._slots) if obj is not None]
+    def __len__(self):
+        return len(self._slots) - len(self._free)
+
+class _Entry():
+    __slots__ = ('fd', 'refs')
+    def __init__(self, fd):
+        self.fd = fd
+        self.refs = 0
+        return None
+
+class FdPool():
+    '''
+    Reference counted fds by key. Fds nobody holds stay open until there are
+    more than max_idle of them or they have been idle for idle_timeout
+    seconds, checked whenever the pool is used.
+    '''
+    def __init__(self, max_idle=DEFAULT_MAX_IDLE, idle_timeout=DEFAULT_IDLE_TIMEOUT, clock=monotonic):
+        self._max_idle = max_idle
+        self._idle_timeout = idle_timeout
+        self._clock = clock
+        self._entries = {}
+        self._idle = OrderedDict()
+        self.hits = 0
+        self.opens = 0
+        self.evictions = 0
+        return None
+    def _close(self, key):
+        del self._idle[key]
+        osclose(self._entries.pop(key).fd)
+        self.evictions = self.evictions + 1
+        return None
+    def sweep(self):
+        '''
+        Close fds idle for too long, and the oldest ones over max_idle.
+        '''
+        deadline = self._clock() - self._idle_timeout
+        for key, since in list(self._idle.items()):
+            if since > deadline and len(self._idle) <= self._max_idle:
+                break
+            self._close(key)
+        return None
+    def acquire(self, key, opener):
+        '''
+        The fd for key, from opener() if there is none yet.
+        '''
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = _Entry(opener())
+            self.opens = self.opens + 1
+        else:
+            self._idle.pop(key, None)
+            self.hits = self.hits + 1
+        entry.refs = entry.refs + 1
+        self.sweep()
+        return entry.fd
+    def release(self, key):
+        entry = self._entries[key]
+        entry.refs = entry.refs - 1
+        if not entry.refs:
+            self._idle[key] = self._clock()
+        self.sweep()
+        return None
+    def discard(self, ino):
+        '''
+        Close the idle fds of an inode, e.g. once it is unlinked.
+        '''
+        for key in [key for key in self._idle if key[0] == ino]:
+            self._close(key)
+        return None
+    def stats(self):
+        return {
+            'open': len(self._entries)
+            , 'idle': len(self._idle)
+            , 'hits': self.hits
+            , 'opens': self.opens
+            , 'evictions': self.evictions
+            }
+    def close(self):
+        for key in list(self._idle):
+            self._close(key)
+        return None
@@ -4,7 +4,7 @@ from os import getuid, getgid
 from stat import S_IFDIR, S_IFREG
 
 from pysinter import FUSEError, ROOT_INODE, MAX32, pad64, to32, to64
-from pysinter.dynamic import Operations
+from pysinter.dynamic import Operations, FrozenReply
 from pysinter.helper import fuse_negotiate, mk_dyn_negotiate, dyn_nop, dyn_nosend
 
 FILE_HELLO = b'hello'
@@ -15,7 +15,7 @@ FILE_HELLO2 = b'hello2'
 INODE_HELLO2 = ROOT_INODE + 2
 MSG_HELLO2 = b'Once again - hello, world!'
 
-ATTRS_HELLO = {
+ATTRS_HELLO = FrozenReply({
     "attr": {
         'ino': 0
         , 'size': len(MSG_HELLO)
@@ -28,8 +28,8 @@ ATTRS_HELLO = {
         , 'blocks': 1
         , 'nlink': 1
         }
-    }
-ATTRS_HELLO2 = {
+    })
+ATTRS_HELLO2 = FrozenReply({
     "attr": {
         'ino': 0
         , 'size': len(MSG_HELLO2)
@@ -42,8 +42,8 @@ ATTRS_HELLO2 = {
         , 'blocks': 1
         , 'nlink': 1
         }
-    }
-ATTRS_ROOT = {
+    })
+ATTRS_ROOT = FrozenReply({
     "attr": {
         'ino': 0
         , 'size': 0
@@ -55,7 +55,7 @@ ATTRS_ROOT = {
         , 'blksize': 512
         , 'nlink': 1
         }
-    }
+    })
 
 async def hello_getattr(header, parsed):
     '''
@@ -0,0 +1,208 @@
+from mmap import mmap
+from os import O_CREAT, O_RDWR, open as osopen, close as osclose, ftruncate, replace
+from struct import Struct
+
+'''
+A persistent index of the inodes known to the passthrough example, so that a
+restarted server still resolves the nodeids the kernel holds from before.
+
+The index is one memory-mapped file: a header, an open addressing hash
+table of fixed-size records (inode, parent inode, name offset, name length,
+state) and a heap of names behind it. Opening it parses nothing, lookups
+probe the table in place, so only the pages touched are ever read in and
+an index of tens of millions of inodes costs little resident memory.
+Changes are written into the mapping as they happen and reach the file with
+the page cache or flush(). When the table fills up or the heap holds more
+dead names than live ones, the index is rebuilt into a new file that
+replaces the old one.
+'''
+
+MAGIC = b'PYSNIDX1'
+HEADER = Struct('<8sIIQQQQQ') # magic, version, record size, capacity, live, used, heap end, heap live
+RECORD = Struct('<QQQII') # inode, parent, name offset, name length, state
+VERSION = 1
+EMPTY = 0
+LIVE = 1
+DELETED = 2
+NO_PARENT = 0xffffffffffffffff
+DEFAULT_CAPACITY = 1 << 16
+MAX_LOAD = 0.7
+HASH_MULTIPLIER = 0x9e3779b97f4a7c15
+MASK64 = 0xffffffffffffffff
+
+def _create(path, capacity, heap_size):
+    fd = osopen(path, O_RDWR | O_CREAT, 0o600)
+    try:
+        ftruncate(fd, 0)
+        ftruncate(fd, HEADER.size + capacity * RECORD.size + heap_size) # Sparse
+        with mmap(fd, HEADER.size) as header:
+            HEADER.pack_into(header, 0, MAGIC, VERSION, RECORD.size, capacity, 0, 0, 0, 0)
+    finally:
+        osclose(fd)
+    return None
+
+class InodeIndex():
+    '''
+    A mapping from inode to (parent inode, name), parent None for the root,
+    kept in the file at path. Capacity is the initial number of table slots,
+    a power of two.
+    '''
+    def __init__(self, path, capacity=DEFAULT_CAPACITY):
+        self._path = path
+        try:
+            self._open()
+        except FileNotFoundError:
+            _create(path, capacity, capacity * 16)
+            self._open()
+        return None
+    def _open(self):
+        fd = osopen(self._path, O_RDWR)
+        try:
+            self._map = mmap(fd, 0)
+        finally:
+            osclose(fd)
+        magic, version, record_size, capacity, live, used, heap_end, heap_live = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            self._map.close()
+            raise ValueError('Not an inode index', self._path)
+        self._capacity = capacity
+        self._mask = capacity - 1
+        self._live = live
+        self._used = used
+        self._heap_end = heap_end
+        self._heap_live = heap_live
+        self._heap_start = HEADER.size + capacity * RECORD.size
+        return None
+    def _store_header(self):
+        HEADER.pack_into(
+            self._map, 0, MAGIC, VERSION, RECORD.size, self._capacity
+            , self._live, self._used, self._heap_end, self._heap_live
+            )
+        return None
+    def _find(self, ino):
+        '''
+        The slot holding ino and its record, or the slot to insert it at,
+        None and whether that slot was never used.
+        '''
+        slot = (((ino * HASH_MULTIPLIER) & MASK64) >> 24) & self._mask
+        insert = None
+        while True:
+            record = RECORD.unpack_from(self._map, HEADER.size + slot * RECORD.size)
+            state = record[4]
+            if state == EMPTY:
+                if insert is None:
+                    return slot, None, True
+                return insert, None, False
+            if state == LIVE and record[0] == ino:
+                return slot, record, False
+            if state == DELETED and insert is None:
+                insert = slot
+            slot = (slot + 1) & self._mask
+    def _name(self, record):
+        start = self._heap_start + record[2]
+        return self._map[start:start + record[3]]
+    def _append_name(self, name):
+        offset = self._heap_end
+        end = self._heap_start + offset + len(name)
+        if end > len(self._map):
+            size = max(end, 2 * len(self._map))
+            self._map.resize(size)
+        self._map[self._heap_start + offset:end] = name
+        self._heap_end = offset + len(name)
+        return offset
+    def __getitem__(self, ino):
+        _, record, _ = self._find(ino)
+        if record is None:
+            raise KeyError(ino)
+        parent = None if record[1] == NO_PARENT else record[1]
+        return parent, self._name(record)
+    def get(self, ino, default=None):
+        try:
+            return self[ino]
+        except KeyError:
+            return default
+    def __contains__(self, ino):
+        return self._find(ino)[1] is not None
+    def __setitem__(self, ino, value):
+        parent, name = value
+        slot, record, empty = self._find(ino)
+        if record is not None:
+            if self._name(record) == name:
+                offset = record[2]
+            else:
+                self._heap_live = self._heap_live - record[3]
+                offset = self._append_name(name)
+                self._heap_live = self._heap_live + len(name)
+        else:
+            if self._used + 1 > self._capacity * MAX_LOAD:
+                self._rebuild(self._capacity * 2 if self._live + 1 > self._capacity * MAX_LOAD / 2 else self._capacity)
+                return self.__setitem__(ino, value)
+            if empty:
+                self._used = self._used + 1
+            self._live = self._live + 1
+            offset = self._append_name(name)
+            self._heap_live = self._heap_live + len(name)
+        RECORD.pack_into(
+            self._map, HEADER.size + slot * RECORD.size
+            , ino, NO_PARENT if parent is None else parent, offset, len(name), LIVE
+            )
+        self._store_header()
+        if self._heap_end > 2 * self._heap_live + (1 << 20):
+            self._rebuild(self._capacity)
+        return None
+    def __delitem__(self, ino):
+        slot, record, _ = self._find(ino)
+        if record is None:
+            raise KeyError(ino)
+        RECORD.pack_into(self._map, HEADER.size + slot * RECORD.size, *record[:4], DELETED)
+        self._live = self._live - 1
+        self._heap_live = self._heap_live - record[3]
+        self._store_header()
+        return None
+    def pop(self, ino, *default):
+        try:
+            res = self[ino]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        del self[ino]
+        return res
+    def __len__(self):
+        return self._live
+    def items(self):
+        for slot in range(self._capacity):
+            record = RECORD.unpack_from(self._map, HEADER.size + slot * RECORD.size)
+            if record[4] == LIVE:
+                parent = None if record[1] == NO_PARENT else record[1]
+                yield record[0], (parent, self._name(record))
+    def _rebuild(self, capacity):
+        '''
+        Copy the live records into a fresh file of the given capacity, which
+        then replaces this one.
+        '''
+        tmppath = f'{self._path}.tmp'
+        _create(tmppath, capacity, max(self._heap_live * 2, capacity * 16))
+        fresh = InodeIndex(tmppath)
+        for ino, value in self.items():
+            fresh[ino] = value
+        fresh.close()
+        self._map.close()
+        replace(tmppath, self._path)
+        self._open()
+        return None
+    def stats(self):
+        return {
+            'inodes': self._live
+            , 'capacity': self._capacity
+            , 'heap_bytes': self._heap_end
+            , 'heap_live_bytes': self._heap_live
+            , 'file_bytes': len(self._map)
+            }
+    def flush(self):
+        self._map.flush()
+        return None
+    def close(self):
+        self._map.flush()
+        self._map.close()
+        return None
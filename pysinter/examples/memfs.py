@@ -0,0 +1,742 @@
+from bisect import bisect_right
+from errno import EEXIST, EINVAL, EISDIR, ENAMETOOLONG, ENOENT, ENOTDIR, ENOTEMPTY, EOPNOTSUPP, EPERM
+from heapq import heappop, heappush
+from mmap import mmap
+from os import O_EXCL, O_TRUNC, getuid, getgid
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_ISDIR, S_ISLNK, S_ISREG
+from time import time_ns
+
+from pysinter import FUSEError, ROOT_INODE
+from pysinter.constants import (
+    FATTR_MODE, FATTR_UID, FATTR_GID, FATTR_SIZE, FATTR_ATIME, FATTR_MTIME
+    , FATTR_ATIME_NOW, FATTR_MTIME_NOW, FATTR_CTIME
+    , FUSE_ASYNC_READ, FUSE_BIG_WRITES, FUSE_DO_READDIRPLUS, FUSE_READDIRPLUS_AUTO
+    , FUSE_PARALLEL_DIROPS, FUSE_MAX_PAGES
+    )
+from pysinter.helper import mk_dyn_negotiate, dyn_nop
+
+'''
+An in-memory filesystem, to measure what the framework can do without a
+backing store getting in the way.
+
+Inodes live in a list indexed by inode number. File contents are kept in
+fixed-size extents, either bytearrays that grow by replacement or
+anonymous mmap regions, and directories are dicts with a side list for
+stable READDIR cookies. Inodes are freed once they are neither linked,
+known to the kernel nor open.
+Permissions are not checked, mount with default_permissions. Access times
+are not updated by reads.
+'''
+
+DEFAULT_CHUNK_SIZE = 1 << 16
+MIN_EXTENT_SIZE = 1 << 12
+DEFAULT_TIMEOUT = 1.0
+DEFAULT_CAPACITY = 1 << 40
+DEFAULT_FLAGS = (
+    FUSE_ASYNC_READ | FUSE_BIG_WRITES | FUSE_DO_READDIRPLUS | FUSE_READDIRPLUS_AUTO
+    | FUSE_PARALLEL_DIROPS | FUSE_MAX_PAGES
+    )
+IFMT = 0o170000 # File type bits of a mode
+BLOCK_SIZE = 4096
+NAME_MAX = 255
+NS = 1000000000
+DIRENT_SIZE = 24
+ENTRY_OUT_SIZE = 128
+FIRST_COOKIE = 3 # After . and ..
+COMPACT_MIN_HOLES = 16
+RENAME_NOREPLACE = 1
+RENAME_EXCHANGE = 2
+
+def _dirent_size(name, plus=False):
+    return (ENTRY_OUT_SIZE if plus else 0) + ((DIRENT_SIZE + len(name) + 7) & ~7)
+
+class FileData():
+    '''
+    File contents as extents of chunk_size bytes by index. Missing extents
+    and the part of an extent beyond its length read as zeros.
+    Extents are never resized in place, which a view into them would not
+    allow: reads within one extent return such a view, which Operations
+    copies into the reply before another handler can write.
+    '''
+    __slots__ = ('extents', 'size', 'allocated', '_chunk', '_mmap')
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False):
+        self.extents = {}
+        self.size = 0
+        self.allocated = 0
+        self._chunk = chunk_size
+        self._mmap = use_mmap
+        return None
+    def _extent(self, index, end):
+        '''
+        The extent at index, at least end bytes long.
+        '''
+        extent = self.extents.get(index)
+        if extent is not None and len(extent) >= end:
+            return extent
+        if self._mmap:
+            new = mmap(-1, self._chunk)
+        else:
+            capacity = MIN_EXTENT_SIZE
+            while capacity < end:
+                capacity = capacity << 1
+            new = bytearray(min(capacity, self._chunk))
+        if extent is not None:
+            new[:len(extent)] = extent
+            self.allocated = self.allocated - len(extent)
+        self.allocated = self.allocated + len(new)
+        self.extents[index] = new
+        return new
+    def read(self, offset, size):
+        end = min(offset + size, self.size)
+        if offset >= end:
+            return b''
+        chunk = self._chunk
+        index, start = divmod(offset, chunk)
+        base = index * chunk
+        if end - base <= chunk:
+            extent = self.extents.get(index)
+            if extent is None:
+                return bytes(end - offset)
+            if end - base <= len(extent):
+                return memoryview(extent)[start:end - base]
+        res = bytearray(end - offset)
+        pos = offset
+        while pos < end:
+            index, start = divmod(pos, chunk)
+            base = index * chunk
+            stop = min(chunk, end - base)
+            extent = self.extents.get(index)
+            if extent is not None:
+                avail = min(stop, len(extent))
+                if avail > start:
+                    res[pos - offset:base + avail - offset] = memoryview(extent)[start:avail]
+            pos = base + stop
+        return res
+    def write(self, offset, data):
+        view = memoryview(data)
+        chunk = self._chunk
+        pos = 0
+        while pos < len(view):
+            index, start = divmod(offset + pos, chunk)
+            count = min(chunk - start, len(view) - pos)
+            self._extent(index, start + count)[start:start + count] = view[pos:pos + count]
+            pos = pos + count
+        if offset + len(view) > self.size:
+            self.size = offset + len(view)
+        return len(view)
+    def truncate(self, size):
+        if size < self.size:
+            chunk = self._chunk
+            first_gone = (size + chunk - 1) // chunk
+            for index in [index for index in self.extents if index >= first_gone]:
+                self.allocated = self.allocated - len(self.extents.pop(index))
+            index, start = divmod(size, chunk)
+            extent = self.extents.get(index)
+            if extent is not None and start < len(extent):
+                extent[start:] = bytes(len(extent) - start)
+        self.size = size
+        return None
+
+class DirIndex():
+    '''
+    Directory entries by name, and the names in order of insertion under
+    increasing cookies, so that READDIR can resume after any cookie. Removed
+    names leave holes in the order until they are the majority.
+    '''
+    __slots__ = ('entries', '_cookies', '_names', '_positions', '_next', '_holes')
+    def __init__(self):
+        self.entries = {}
+        self._cookies = []
+        self._names = []
+        self._positions = {}
+        self._next = FIRST_COOKIE
+        self._holes = 0
+        return None
+    def add(self, name, ino):
+        self.entries[name] = ino
+        self._positions[name] = len(self._names)
+        self._cookies.append(self._next)
+        self._names.append(name)
+        self._next = self._next + 1
+        return None
+    def replace(self, name, ino):
+        '''
+        Point an existing name elsewhere, keeping its cookie.
+        '''
+        self.entries[name] = ino
+        return None
+    def remove(self, name):
+        ino = self.entries.pop(name)
+        self._names[self._positions.pop(name)] = None
+        self._holes = self._holes + 1
+        if self._holes >= COMPACT_MIN_HOLES and 2 * self._holes > len(self._names):
+            keep = [(cookie, name) for cookie, name in zip(self._cookies, self._names) if name is not None]
+            self._cookies = [cookie for cookie, _ in keep]
+            self._names = [name for _, name in keep]
+            self._positions = {name: pos for pos, (_, name) in enumerate(keep)}
+            self._holes = 0
+        return ino
+    def after(self, cookie):
+        '''
+        Yield (cookie, name, ino) for the entries after cookie.
+        '''
+        cookies = self._cookies
+        names = self._names
+        for pos in range(bisect_right(cookies, cookie), len(names)):
+            name = names[pos]
+            if name is not None:
+                yield cookies[pos], name, self.entries[name]
+    def __len__(self):
+        return len(self.entries)
+
+class Inode():
+    '''
+    data is FileData for regular files, DirIndex for directories and the
+    target for symlinks. lookups counts the kernel's references, opens
+    the open file handles.
+    '''
+    __slots__ = (
+        'ino', 'generation', 'mode', 'uid', 'gid', 'rdev', 'nlink'
+        , 'atime', 'mtime', 'ctime', 'data', 'parent', 'lookups', 'opens'
+        )
+    def __init__(self, mode, uid, gid, rdev=0, data=None):
+        self.ino = 0
+        self.generation = 0
+        self.mode = mode
+        self.uid = uid
+        self.gid = gid
+        self.rdev = rdev
+        self.nlink = 2 if S_ISDIR(mode) else 0
+        self.atime = self.mtime = self.ctime = time_ns()
+        self.data = data
+        self.parent = None
+        self.lookups = 0
+        self.opens = 0
+        return None
+
+class InodeTable():
+    '''
+    Inodes by number, in a list. Freed numbers are reused, lowest first,
+    with the generation bumped so the kernel can tell the inodes apart.
+    '''
+    def __init__(self):
+        self._slots = [None]
+        self._generations = [0]
+        self._free = []
+        return None
+    def add(self, inode):
+        if self._free:
+            ino = heappop(self._free)
+            self._slots[ino] = inode
+        else:
+            ino = len(self._slots)
+            self._slots.append(inode)
+            self._generations.append(0)
+        inode.ino = ino
+        inode.generation = self._generations[ino]
+        return ino
+    def get(self, ino):
+        if 0 < ino < len(self._slots):
+            return self._slots[ino]
+        return None
+    def remove(self, ino):
+        self._slots[ino] = None
+        self._generations[ino] = self._generations[ino] + 1
+        heappush(self._free, ino)
+        return None
+    def __iter__(self):
+        return (inode for inode in self._slots if inode is not None)
+    def __len__(self):
+        return len(self._slots) - 1 - len(self._free)
+
+class MemFS():
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, use_mmap=False, timeout=DEFAULT_TIMEOUT, capacity=DEFAULT_CAPACITY, major=7, minor=31, flags=DEFAULT_FLAGS, mode=0o755):
+        '''
+        File contents are kept in extents of chunk_size bytes, anonymous
+        mmap regions with use_mmap and bytearrays otherwise. Entries and
+        attributes are valid for timeout seconds, which can be long since
+        nobody else changes the filesystem. capacity is what STATFS
+        reports as the size.
+        '''
+        self._chunk_size = chunk_size
+        self._use_mmap = use_mmap
+        self._timeout_sec = int(timeout)
+        self._timeout_nsec = int((timeout - int(timeout)) * NS)
+        self._capacity = capacity
+        self._major = major
+        self._minor = minor
+        self._flags = flags
+        self._inodes = InodeTable()
+        root = Inode(S_IFDIR | mode, getuid(), getgid(), data=DirIndex())
+        root.parent = self._inodes.add(root)
+        if root.ino != ROOT_INODE:
+            raise RuntimeError('Root inode not at ROOT_INODE', root.ino)
+        return None
+    def _get(self, ino):
+        inode = self._inodes.get(ino)
+        if inode is None:
+            raise FUSEError(ENOENT)
+        return inode
+    def _dir(self, ino):
+        inode = self._get(ino)
+        if not S_ISDIR(inode.mode):
+            raise FUSEError(ENOTDIR)
+        return inode
+    def _file(self, ino):
+        inode = self._get(ino)
+        if S_ISDIR(inode.mode):
+            raise FUSEError(EISDIR)
+        if not S_ISREG(inode.mode):
+            raise FUSEError(EINVAL)
+        return inode
+    def _attr(self, inode):
+        mode = inode.mode
+        if S_ISREG(mode):
+            size = inode.data.size
+            blocks = inode.data.allocated >> 9
+        elif S_ISLNK(mode):
+            size = len(inode.data)
+            blocks = 0
+        else:
+            size = len(inode.data) if S_ISDIR(mode) else 0
+            blocks = 0
+        return {
+            'ino': inode.ino
+            , 'size': size
+            , 'blocks': blocks
+            , 'timeandmode': {
+                'atime': inode.atime // NS
+                , 'mtime': inode.mtime // NS
+                , 'ctime': inode.ctime // NS
+                , 'atimensec': inode.atime % NS
+                , 'mtimensec': inode.mtime % NS
+                , 'ctimensec': inode.ctime % NS
+                , 'mode': mode
+                }
+            , 'nlink': inode.nlink
+            , 'uid': inode.uid
+            , 'gid': inode.gid
+            , 'rdev': inode.rdev
+            , 'blksize': BLOCK_SIZE
+            }
+    def _attr_reply(self, inode):
+        return {
+            'attrValid': self._timeout_sec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': self._attr(inode)
+            }
+    def _entry(self, inode):
+        '''
+        The entry for a reply that makes the kernel take a reference.
+        '''
+        inode.lookups = inode.lookups + 1
+        return {
+            'nodeId': inode.ino
+            , 'generation': inode.generation
+            , 'entryValid': self._timeout_sec
+            , 'attrValid': self._timeout_sec
+            , 'entryValidNsec': self._timeout_nsec
+            , 'attrValidNsec': self._timeout_nsec
+            , 'attr': self._attr(inode)
+            }
+    def _maybe_free(self, inode):
+        if inode.nlink == 0 and inode.lookups <= 0 and inode.opens <= 0 and inode.ino != ROOT_INODE:
+            self._inodes.remove(inode.ino)
+            inode.data = None
+        return None
+    def _attach(self, parent, name, inode):
+        '''
+        Enter inode under name in parent, which must be free.
+        '''
+        if S_ISDIR(inode.mode):
+            parent.nlink = parent.nlink + 1
+            inode.parent = parent.ino
+        else:
+            inode.nlink = inode.nlink + 1
+        parent.data.add(name, inode.ino)
+        parent.mtime = parent.ctime = inode.ctime = time_ns()
+        return None
+    def _detach(self, parent, name):
+        '''
+        Remove name from parent, returning the inode it pointed to.
+        Directories lose all their links, the caller checks they are empty.
+        '''
+        inode = self._inodes.get(parent.data.remove(name))
+        if S_ISDIR(inode.mode):
+            parent.nlink = parent.nlink - 1
+            inode.nlink = 0
+        else:
+            inode.nlink = inode.nlink - 1
+        parent.mtime = parent.ctime = inode.ctime = time_ns()
+        return inode
+    def _check_name(self, parent, name):
+        if len(name) > NAME_MAX:
+            raise FUSEError(ENAMETOOLONG)
+        if name in parent.data.entries:
+            raise FUSEError(EEXIST)
+        return None
+    def _mknode(self, parent, name, mode, uid, gid, rdev=0, data=None):
+        self._check_name(parent, name)
+        if S_ISDIR(mode):
+            data = DirIndex()
+        elif S_ISREG(mode):
+            data = FileData(self._chunk_size, self._use_mmap)
+        inode = Inode(mode, uid, gid, rdev=rdev, data=data)
+        self._inodes.add(inode)
+        self._attach(parent, name, inode)
+        return inode
+    def add(self, parent, name, mode, data=b'', uid=None, gid=None):
+        '''
+        Create a node without going through FUSE, e.g. to populate the
+        filesystem before it is mounted. data is the content of regular
+        files and the target of symlinks. Returns the inode number.
+        '''
+        if not mode & IFMT:
+            mode = mode | S_IFREG
+        inode = self._mknode(
+            self._dir(parent)
+            , name
+            , mode
+            , getuid() if uid is None else uid
+            , getgid() if gid is None else gid
+            , data=data if S_ISLNK(mode) else None
+            )
+        if S_ISREG(mode) and data:
+            inode.data.write(0, data)
+        return inode.ino
+    def stats(self):
+        inodes = list(self._inodes)
+        return {
+            'inodes': len(inodes)
+            , 'allocated': sum(inode.data.allocated for inode in inodes if S_ISREG(inode.mode))
+            }
+    async def lookup(self, header, parsed):
+        parent = self._dir(header.nodeid)
+        name = parsed['name']
+        if name == b'..':
+            ino = parent.parent
+        else:
+            ino = parent.data.entries.get(name)
+            if ino is None:
+                raise FUSEError(ENOENT)
+        return 0, {'entry': [self._entry(self._inodes.get(ino))]}
+    async def forget(self, header, parsed):
+        inode = self._inodes.get(header.nodeid)
+        if inode is not None:
+            inode.lookups = inode.lookups - parsed['nlookup']
+            self._maybe_free(inode)
+        return 0, None
+    async def batch_forget(self, header, parsed):
+        for node in parsed['nodes']:
+            inode = self._inodes.get(node['nodeid'])
+            if inode is not None:
+                inode.lookups = inode.lookups - node['nlookup']
+                self._maybe_free(inode)
+        return 0, None
+    async def getattr(self, header, parsed):
+        return 0, self._attr_reply(self._get(header.nodeid))
+    async def setattr(self, header, parsed):
+        inode = self._get(header.nodeid)
+        valid = parsed['valid']
+        time_mode = parsed['timeandmode']
+        now = time_ns()
+        if valid & FATTR_SIZE:
+            self._file(header.nodeid).data.truncate(parsed['size'])
+            if not valid & (FATTR_MTIME | FATTR_MTIME_NOW):
+                inode.mtime = now
+        if valid & FATTR_MODE:
+            inode.mode = (inode.mode & IFMT) | (time_mode['mode'] & ~IFMT)
+        if valid & FATTR_UID:
+            inode.uid = parsed['uid']
+        if valid & FATTR_GID:
+            inode.gid = parsed['gid']
+        if valid & FATTR_ATIME_NOW:
+            inode.atime = now
+        elif valid & FATTR_ATIME:
+            inode.atime = time_mode['atime'] * NS + time_mode['atimensec']
+        if valid & FATTR_MTIME_NOW:
+            inode.mtime = now
+        elif valid & FATTR_MTIME:
+            inode.mtime = time_mode['mtime'] * NS + time_mode['mtimensec']
+        if valid & FATTR_CTIME:
+            inode.ctime = time_mode['ctime'] * NS + time_mode['ctimensec']
+        else:
+            inode.ctime = now
+        return 0, self._attr_reply(inode)
+    async def mknod(self, header, parsed):
+        mode = parsed['mode'] & ~parsed['umask']
+        if not mode & IFMT:
+            mode = mode | S_IFREG
+        if S_ISDIR(mode) or S_ISLNK(mode):
+            raise FUSEError(EINVAL)
+        inode = self._mknode(self._dir(header.nodeid), parsed['name'], mode, header.uid, header.gid, rdev=parsed['rdev'])
+        return 0, {'entry': self._entry(inode)}
+    async def mkdir(self, header, parsed):
+        mode = S_IFDIR | (parsed['mode'] & ~parsed['umask'] & ~IFMT)
+        inode = self._mknode(self._dir(header.nodeid), parsed['name'], mode, header.uid, header.gid)
+        return 0, {'entry': self._entry(inode)}
+    async def symlink(self, header, parsed):
+        inode = self._mknode(
+            self._dir(header.nodeid), parsed['name'], S_IFLNK | 0o777
+            , header.uid, header.gid, data=bytes(parsed['link'])
+            )
+        return 0, {'entry': self._entry(inode)}
+    async def readlink(self, header, parsed):
+        inode = self._get(header.nodeid)
+        if not S_ISLNK(inode.mode):
+            raise FUSEError(EINVAL)
+        return 0, {'data': inode.data}
+    async def link(self, header, parsed):
+        parent = self._dir(header.nodeid)
+        inode = self._get(parsed['oldnodeid'])
+        if S_ISDIR(inode.mode):
+            raise FUSEError(EPERM)
+        self._check_name(parent, parsed['newname'])
+        self._attach(parent, parsed['newname'], inode)
+        return 0, {'entry': self._entry(inode)}
+    async def create(self, header, parsed):
+        parent = self._dir(header.nodeid)
+        name = parsed['name']
+        flags = parsed['flags']
+        ino = parent.data.entries.get(name)
+        if ino is None:
+            mode = S_IFREG | (parsed['mode'] & ~parsed['umask'] & ~IFMT)
+            inode = self._mknode(parent, name, mode, header.uid, header.gid)
+        elif flags & O_EXCL:
+            raise FUSEError(EEXIST)
+        else:
+            inode = self._file(ino)
+            if flags & O_TRUNC:
+                inode.data.truncate(0)
+        inode.opens = inode.opens + 1
+        return 0, {'entry': self._entry(inode), 'fh': inode.ino}
+    async def unlink(self, header, parsed):
+        parent = self._dir(header.nodeid)
+        ino = parent.data.entries.get(parsed['name'])
+        if ino is None:
+            raise FUSEError(ENOENT)
+        if S_ISDIR(self._inodes.get(ino).mode):
+            raise FUSEError(EISDIR)
+        self._maybe_free(self._detach(parent, parsed['name']))
+        return 0, {}
+    async def rmdir(self, header, parsed):
+        parent = self._dir(header.nodeid)
+        ino = parent.data.entries.get(parsed['name'])
+        if ino is None:
+            raise FUSEError(ENOENT)
+        inode = self._inodes.get(ino)
+        if not S_ISDIR(inode.mode):
+            raise FUSEError(ENOTDIR)
+        if inode.data:
+            raise FUSEError(ENOTEMPTY)
+        self._maybe_free(self._detach(parent, parsed['name']))
+        return 0, {}
+    def _check_move(self, inode, newdir):
+        '''
+        A directory cannot move below itself.
+        '''
+        if not S_ISDIR(inode.mode):
+            return None
+        ino = newdir.ino
+        while ino != ROOT_INODE:
+            if ino == inode.ino:
+                raise FUSEError(EINVAL)
+            ino = self._inodes.get(ino).parent
+        return None
+    def _rename(self, olddir, oldname, newdir, newname, flags):
+        if flags & ~(RENAME_NOREPLACE | RENAME_EXCHANGE):
+            raise FUSEError(EINVAL)
+        src_ino = olddir.data.entries.get(oldname)
+        if src_ino is None:
+            raise FUSEError(ENOENT)
+        src = self._inodes.get(src_ino)
+        dst_ino = newdir.data.entries.get(newname)
+        dst = None if dst_ino is None else self._inodes.get(dst_ino)
+        if len(newname) > NAME_MAX:
+            raise FUSEError(ENAMETOOLONG)
+        if flags & RENAME_EXCHANGE:
+            if dst is None:
+                raise FUSEError(ENOENT)
+            self._check_move(src, newdir)
+            self._check_move(dst, olddir)
+            olddir.data.replace(oldname, dst_ino)
+            newdir.data.replace(newname, src_ino)
+            for inode, parent, other in ((src, newdir, olddir), (dst, olddir, newdir)):
+                if S_ISDIR(inode.mode) and parent is not other:
+                    inode.parent = parent.ino
+                    parent.nlink = parent.nlink + 1
+                    other.nlink = other.nlink - 1
+            olddir.mtime = olddir.ctime = newdir.mtime = newdir.ctime = time_ns()
+            return 0, {}
+        if dst is not None and flags & RENAME_NOREPLACE:
+            raise FUSEError(EEXIST)
+        if dst is src:
+            return 0, {}
+        if dst is not None:
+            if S_ISDIR(src.mode) and not S_ISDIR(dst.mode):
+                raise FUSEError(ENOTDIR)
+            if S_ISDIR(dst.mode):
+                if not S_ISDIR(src.mode):
+                    raise FUSEError(EISDIR)
+                if dst.data:
+                    raise FUSEError(ENOTEMPTY)
+        self._check_move(src, newdir)
+        if dst is not None:
+            self._maybe_free(self._detach(newdir, newname))
+        self._detach(olddir, oldname)
+        if S_ISDIR(src.mode):
+            src.nlink = 2 + sum(
+                1 for ino in src.data.entries.values()
+                if S_ISDIR(self._inodes.get(ino).mode)
+                )
+        self._attach(newdir, newname, src)
+        return 0, {}
+    async def rename(self, header, parsed):
+        return self._rename(
+            self._dir(header.nodeid), parsed['oldname']
+            , self._dir(parsed['newdir']), parsed['newname']
+            , 0
+            )
+    async def rename2(self, header, parsed):
+        return self._rename(
+            self._dir(header.nodeid), parsed['oldname']
+            , self._dir(parsed['newdir']), parsed['newname']
+            , parsed['flags']
+            )
+    async def open(self, header, parsed):
+        inode = self._file(header.nodeid)
+        if parsed['flags'] & O_TRUNC:
+            inode.data.truncate(0)
+            inode.mtime = inode.ctime = time_ns()
+        inode.opens = inode.opens + 1
+        return 0, {'fh': inode.ino}
+    async def read(self, header, parsed):
+        return 0, {'data': self._file(header.nodeid).data.read(parsed['offset'], parsed['size'])}
+    async def write(self, header, parsed):
+        inode = self._file(header.nodeid)
+        count = inode.data.write(parsed['offset'], parsed['data'])
+        inode.mtime = inode.ctime = time_ns()
+        return 0, {'size': count}
+    async def fallocate(self, header, parsed):
+        '''
+        Only extends files, extents are allocated when written.
+        '''
+        inode = self._file(header.nodeid)
+        if parsed['mode']:
+            raise FUSEError(EOPNOTSUPP)
+        end = parsed['offset'] + parsed['length']
+        if end > inode.data.size:
+            inode.data.truncate(end)
+            inode.mtime = inode.ctime = time_ns()
+        return 0, {}
+    async def release(self, header, parsed):
+        inode = self._inodes.get(header.nodeid)
+        if inode is not None:
+            inode.opens = inode.opens - 1
+            self._maybe_free(inode)
+        return 0, {}
+    async def opendir(self, header, parsed):
+        inode = self._dir(header.nodeid)
+        inode.opens = inode.opens + 1
+        return 0, {'fh': inode.ino}
+    def _dirents(self, directory, cookie):
+        '''
+        Yield (cookie, name, inode) after cookie, including . and ..
+        '''
+        if cookie < 1:
+            yield 1, b'.', directory
+        if cookie < 2:
+            yield 2, b'..', self._inodes.get(directory.parent)
+        for entry_cookie, name, ino in directory.data.after(cookie):
+            yield entry_cookie, name, self._inodes.get(ino)
+    async def readdir(self, header, parsed):
+        directory = self._dir(header.nodeid)
+        remaining = parsed['size']
+        entries = []
+        for cookie, name, inode in self._dirents(directory, parsed['cookie']):
+            remaining = remaining - _dirent_size(name)
+            if remaining < 0:
+                break
+            entries.append({
+                'ino': inode.ino
+                , 'cookie': cookie
+                , 'namelen': len(name)
+                , 'type': inode.mode >> 12
+                , 'name': name
+                })
+        return 0, {'data': entries}
+    async def readdirplus(self, header, parsed):
+        '''
+        Every entry but . and .. makes the kernel take a reference.
+        '''
+        directory = self._dir(header.nodeid)
+        remaining = parsed['size']
+        entries = []
+        for cookie, name, inode in self._dirents(directory, parsed['cookie']):
+            remaining = remaining - _dirent_size(name, plus=True)
+            if remaining < 0:
+                break
+            if cookie < FIRST_COOKIE:
+                entry = {'nodeId': inode.ino, 'attr': self._attr(inode)}
+            else:
+                entry = self._entry(inode)
+            entries.append({
+                'entryOut': entry
+                , 'dirent': {
+                    'ino': inode.ino
+                    , 'cookie': cookie
+                    , 'namelen': len(name)
+                    , 'type': inode.mode >> 12
+                    , 'name': name
+                    }
+                })
+        return 0, {'data': entries}
+    async def releasedir(self, header, parsed):
+        return await self.release(header, parsed)
+    async def statfs(self, header, parsed):
+        stats = self.stats()
+        blocks = self._capacity // BLOCK_SIZE
+        free = max(0, blocks - (stats['allocated'] + BLOCK_SIZE - 1) // BLOCK_SIZE)
+        return 0, {'st': {
+            'blocks': blocks
+            , 'bfree': free
+            , 'bavail': free
+            , 'files': stats['inodes'] + free
+            , 'ffree': free
+            , 'bsize': BLOCK_SIZE
+            , 'namelen': NAME_MAX
+            , 'frsize': BLOCK_SIZE
+            }}
+    def make(self):
+        return {
+            'FUSE_INIT': mk_dyn_negotiate(major=self._major, minor=self._minor, flags=self._flags)
+            , 'FUSE_LOOKUP': self.lookup
+            , 'FUSE_FORGET': self.forget
+            , 'FUSE_BATCH_FORGET': self.batch_forget
+            , 'FUSE_GETATTR': self.getattr
+            , 'FUSE_SETATTR': self.setattr
+            , 'FUSE_MKNOD': self.mknod
+            , 'FUSE_MKDIR': self.mkdir
+            , 'FUSE_SYMLINK': self.symlink
+            , 'FUSE_READLINK': self.readlink
+            , 'FUSE_LINK': self.link
+            , 'FUSE_CREATE': self.create
+            , 'FUSE_UNLINK': self.unlink
+            , 'FUSE_RMDIR': self.rmdir
+            , 'FUSE_RENAME': self.rename
+            , 'FUSE_RENAME2': self.rename2
+            , 'FUSE_OPEN': self.open
+            , 'FUSE_READ': self.read
+            , 'FUSE_WRITE': self.write
+            , 'FUSE_FALLOCATE': self.fallocate
+            , 'FUSE_FLUSH': dyn_nop
+            , 'FUSE_FSYNC': dyn_nop
+            , 'FUSE_RELEASE': self.release
+            , 'FUSE_OPENDIR': self.opendir
+            , 'FUSE_READDIR': self.readdir
+            , 'FUSE_READDIRPLUS': self.readdirplus
+            , 'FUSE_FSYNCDIR': dyn_nop
+            , 'FUSE_RELEASEDIR': self.releasedir
+            , 'FUSE_STATFS': self.statfs
+            , 'FUSE_ACCESS': dyn_nop
+            }
@@ -1,22 +1,43 @@
 
-from errno import ENOENT
+from asyncio import get_running_loop
+from errno import EBADF, EINVAL, ENODATA, ENOENT, EOPNOTSUPP, ERANGE
 from hashlib import blake2b
-from os import open as osopen, chmod, chown, utime, close as osclose, stat, scandir, fsencode, pread, pwrite, remove as osremove
-from os.path import join as pjoin
-from stat import S_IFDIR, S_IFREG
+from os import O_ACCMODE, O_APPEND, O_DIRECT, O_DIRECTORY, O_DSYNC, O_NOATIME, O_NOFOLLOW, O_PATH, O_SYNC, O_TRUNC, O_WRONLY, open as osopen, chmod, chown, utime, close as osclose, fsync, fdatasync, ftruncate, copy_file_range, posix_fallocate, lseek, strerror, stat, fstat, scandir, fsencode, dup, pread, pwrite, remove as osremove, rename as osrename, getxattr, listxattr, setxattr, removexattr
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_IMODE, S_ISGID, S_ISREG, S_ISUID, S_IXGRP
+from time import time_ns
 
-from ctypes import CDLL
+from ctypes import CDLL, c_char_p, c_int, c_int64, c_uint, get_errno
 from ctypes.util import find_library
 
-from pysinter import FUSEError, ROOT_INODE, BYTEORDER, ENCODING, MAX32, pad64, to32, to64
-from pysinter.helper import fuse_negotiate, mk_dyn_negotiate, dyn_nosend, dyn_nop
+from pysinter import FUSEError, FileSlice, ROOT_INODE, BYTEORDER, ENCODING, MAX32, pad64, to32, to64
+from pysinter.constants import (
+    FATTR_MODE, FATTR_UID, FATTR_GID, FATTR_SIZE, FATTR_ATIME, FATTR_MTIME, FATTR_FH
+    , FATTR_ATIME_NOW, FATTR_MTIME_NOW, FATTR_KILL_SUIDGID
+    , FUSE_FSYNC_FDATASYNC, FUSE_HANDLE_KILLPRIV, FUSE_HANDLE_KILLPRIV_V2, FUSE_OPEN_KILL_SUIDGID, FUSE_WRITE_KILL_SUIDGID
+    )
+from pysinter.examples.dirfds import DirFdPool, DEFAULT_MAXSIZE
+from pysinter.examples.fdpool import FdPool, Handle, HandleTable
+from pysinter.examples.inodeindex import InodeIndex
+from pysinter.examples.xattrcache import CAPABILITY, MISSING, XattrCache, DEFAULT_MAXSIZE as DEFAULT_XATTRS
+from pysinter.helper import accepts_spliced, fuse_negotiate, dyn_nosend, dyn_nop
 
 '''
 Work in progress - this passthrough FUSE client should become sufficiently
 featureful to meaningfully test dynamically loaded documentation.
 '''
 
-LIBC = CDLL(find_library('c'))
+LIBC = CDLL(find_library('c'), use_errno=True)
+LIBC.fallocate.argtypes = (c_int, c_int, c_int64, c_int64)
+RENAMEAT2 = getattr(LIBC, 'renameat2', None) # glibc 2.28 and later
+if RENAMEAT2 is not None:
+    RENAMEAT2.argtypes = (c_int, c_char_p, c_int, c_char_p, c_uint)
+
+RENAME_NOREPLACE = 1
+RENAME_EXCHANGE = 2
+NS = 1000000000
+
+#Opens with any of these get an fd of their own instead of a shared one
+UNSHARED_FLAGS = O_APPEND | O_DIRECT | O_DSYNC | O_SYNC | O_NOATIME
 
 def stat_to_attr(data, ino=0):
     return {
@@ -43,53 +64,328 @@ def mk_entry(attr):
         , 'attr': attr
         }
 
+def dirent_type(dirent):
+    '''
+    The file type bits of the mode, as READDIR wants them. Taken from d_type
+    where the filesystem provides it, without a stat.
+    '''
+    if dirent.is_dir(follow_symlinks=False):
+        return S_IFDIR >> 12
+    if dirent.is_file(follow_symlinks=False):
+        return S_IFREG >> 12
+    if dirent.is_symlink():
+        return S_IFLNK >> 12
+    return dirent.stat(follow_symlinks=False).st_mode >> 12
+
 class Passthrough():
-    def __init__(self, root, major=7, minor=31, flags=0):
+    def __init__(self, root, major=7, minor=31, flags=0, cache=None, writeback=None, pread=pread, splice=False, dirfds=DEFAULT_MAXSIZE, fdpool=None, prefetch=None, xattrs=DEFAULT_XATTRS, killpriv=True, index=None):
+        '''
+        Every inode looked up is kept as its parent's inode and its name
+        there, and reached with the *at calls relative to an O_PATH fd of
+        the parent. Up to dirfds of those are kept open. With index, a file
+        name, the inodes are kept in a pysinter.examples.inodeindex.InodeIndex
+        there instead of in memory, so that after a restart the nodeids the
+        kernel still holds resolve right away.
+        File handles are indices into a table of open handles. Their fds
+        come from fdpool, a pysinter.examples.fdpool.FdPool shared by opens
+        of an inode with the same access mode.
+        Reads go through cache if given, a
+        pysinter.examples.blockcache.BlockCache, writes through writeback if
+        given, a pysinter.examples.writeback.WriteBehind, whose on_write_out
+        is set to drop cached contents once buffered data reaches the file.
+        The pread function can be replaced for testing and benchmarking.
+        With splice, uncached reads are answered with FileSlice replies for
+        Sinter(splice=True) to splice. Spliced WRITE data is spliced into the
+        file regardless, unless it has to be buffered.
+        READDIR lists names and types without a stat. With prefetch, a
+        pysinter.examples.prefetch.StatPrefetch, the names listed are stat'ed
+        in the background for the LOOKUPs that usually follow.
+        Extended attributes of up to xattrs inodes are cached, absent ones
+        included. With killpriv, FUSE_HANDLE_KILLPRIV (FUSE_HANDLE_KILLPRIV_V2
+        from minor 33) is offered, so the kernel leaves clearing setuid and
+        setgid bits and removing security.capability on writes, truncation
+        and chown to us instead of asking for security.capability before
+        each write.
+        '''
         if isinstance(root, str):
             root = root.encode('utf-8')
         rootdata = stat(root)
         self._root_ino = rootdata.st_ino
         #Inode is taken from underlying filesystem
         #TODO: Make sure that ROOT_INODE is not accidentally reused
-        self._ino_to_path = {self._root_ino: root}
+        self._index = None if index is None else InodeIndex(index)
+        self._nodes = {} if self._index is None else self._index
+        self._nodes[self._root_ino] = (None, root)
+        self._dirfds = DirFdPool(self._open_dirfd, maxsize=dirfds)
+        self._fdpool = FdPool() if fdpool is None else fdpool
+        self._handles = HandleTable()
         self._major = major
         self._minor = minor
         self._flags = flags
+        self._cache = cache
+        self._writeback = writeback
+        if writeback is not None:
+            writeback.on_write_out = self._invalidate
+        self._pread = pread
+        self._splice = splice
+        self._prefetch = prefetch
+        self._xattrs = XattrCache(xattrs)
+        if killpriv:
+            self._flags = self._flags | (FUSE_HANDLE_KILLPRIV_V2 if minor >= 33 else FUSE_HANDLE_KILLPRIV)
+        self._killpriv = 0 #Negotiated with FUSE_INIT
+        return None
+    def _invalidate(self, ino):
+        if self._cache is not None:
+            self._cache.invalidate(ino)
+        if self._prefetch is not None:
+            self._prefetch.invalidate(ino)
+        self._xattrs.killpriv(ino)
+        return None
+    def _discard_name(self, parent, name):
+        if self._prefetch is not None:
+            self._prefetch.discard(parent, name)
+        return None
+    def _flush_ino(self, ino, offset=0, size=None):
+        if self._writeback is not None:
+            self._writeback.flush_ino(ino, offset, size)
+        return None
+    def _node(self, nodeid):
+        if nodeid == ROOT_INODE:
+            return self._root_ino
+        return nodeid
+    def _at(self, ino):
+        '''
+        The dir_fd and name to reach ino with. The root has no parent and
+        is reached by its path, with dir_fd None.
+        '''
+        try:
+            parent, name = self._nodes[ino]
+        except KeyError as e:
+            raise FUSEError(ENOENT) from e
+        if parent is None:
+            return None, name
+        return self._dirfds.get(parent), name
+    def _xattr_path(self, ino):
+        '''
+        The *xattr calls take no dir_fd, so files are reached through the
+        parent's fd in /proc.
+        '''
+        dir_fd, name = self._at(ino)
+        if dir_fd is None:
+            return name
+        return b'/proc/self/fd/%d/%s' % (dir_fd, name)
+    def _kill_suidgid(self, target):
+        '''
+        Clear the setuid bit and the setgid bit of group executable files,
+        as a write by an unprivileged process would. target is an fd or the
+        path of a regular file.
+        '''
+        mode = stat(target).st_mode
+        kill = mode & S_ISUID
+        if mode & S_IXGRP:
+            kill = kill | (mode & S_ISGID)
+        if kill:
+            chmod(target, S_IMODE(mode) & ~kill)
+        return None
+    def _kills_suidgid(self, flags, flag):
+        '''
+        Whether a request with these flags clears setuid and setgid: always
+        with FUSE_HANDLE_KILLPRIV, only when the kernel sets flag with
+        FUSE_HANDLE_KILLPRIV_V2.
+        '''
+        return not self._killpriv & FUSE_HANDLE_KILLPRIV_V2 or bool(flags & flag)
+    def _kill_priv(self, ino, target, suidgid):
+        '''
+        Remove the capabilities of ino, reached through target as in
+        _kill_suidgid, and with suidgid its setuid and setgid bits. A no-op
+        unless KILLPRIV was negotiated. Files the cache knows to have no
+        capabilities cost no syscall.
+        '''
+        if not self._killpriv:
+            return None
+        try:
+            if suidgid:
+                self._kill_suidgid(target)
+            if self._xattrs.get(ino, CAPABILITY) is None:
+                return None
+            removexattr(target, CAPABILITY)
+        except OSError as e:
+            if e.errno not in (ENODATA, EOPNOTSUPP):
+                raise FUSEError(e.errno) from e
+        else:
+            self._xattrs.invalidate(ino) #Listed names included
+        self._xattrs.put(ino, CAPABILITY, None)
+        return None
+    def _open_dirfd(self, ino):
+        dir_fd, name = self._at(ino)
+        flags = O_PATH | O_DIRECTORY
+        if dir_fd is not None:
+            flags = flags | O_NOFOLLOW
+        try:
+            return osopen(name, flags, dir_fd=dir_fd)
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+    def _open_handle(self, ino, flags, opener):
+        '''
+        Register an open of ino with the given flags, returning the file
+        handle. The fd comes from opener unless the pool has one to share.
+        '''
+        if flags & UNSHARED_FLAGS:
+            return self._handles.add(Handle(opener(), ino, None))
+        key = (ino, flags & O_ACCMODE)
+        return self._handles.add(Handle(self._fdpool.acquire(key, opener), ino, key))
+    def _handle(self, fh):
+        handle = self._handles.get(fh)
+        if handle is None:
+            raise FUSEError(EBADF)
+        return handle
+    def _fd(self, fh):
+        return self._handle(fh).fd
+    def _close_handle(self, fh):
+        handle = self._handles.remove(fh)
+        if handle is None:
+            raise FUSEError(EBADF)
+        if handle.key is None:
+            osclose(handle.fd)
+        else:
+            self._fdpool.release(handle.key)
+        return None
+    def register_gauges(self, metrics):
+        '''
+        Report open fds and handles in pysinter.metrics.Metrics snapshots.
+        '''
+        metrics.gauge('passthrough_handles', lambda: len(self._handles))
+        metrics.gauge('passthrough_fds_pooled', lambda: self._fdpool.stats()['open'])
+        metrics.gauge('passthrough_fds_idle', lambda: self._fdpool.stats()['idle'])
+        metrics.gauge('passthrough_dirfds', lambda: self._dirfds.stats()['open'])
+        for key in ('hits', 'negative_hits', 'misses'):
+            metrics.gauge(f'passthrough_xattr_{key}', lambda key=key: self._xattrs.stats()[key])
+        if self._prefetch is not None:
+            for key in ('hits', 'misses', 'wasted', 'size'):
+                metrics.gauge(f'passthrough_prefetch_{key}', lambda key=key: self._prefetch.stats()[key])
         return None
-    def _path(self, ino, name=None):
-        if name is not None:
-            self._ino_to_path[ino] = name
-        return self._ino_to_path.get(ino)
+    def memory_stats(self):
+        '''
+        Counts and estimated bytes of the inode table, handles and caches,
+        see pysinter.memory. An inode index is counted by its file size.
+        '''
+        from pysinter.memory import deep_size, usage
+        if self._index is None:
+            inodes = usage(len(self._nodes), deep_size(self._nodes))
+        else:
+            inodes = usage(len(self._index), self._index.stats()['file_bytes'])
+        res = {
+            'inodes': inodes
+            , 'handles': usage(len(self._handles), deep_size(self._handles))
+            , 'dirfds': usage(self._dirfds.stats()['open'], deep_size(self._dirfds))
+            , 'xattrs': usage(self._xattrs.stats()['inodes'], deep_size(self._xattrs._entries))
+            }
+        if self._prefetch is not None:
+            res['prefetch'] = usage(self._prefetch.stats()['size'], deep_size(self._prefetch._entries))
+        if self._cache is not None:
+            stats = self._cache.stats()
+            res['block_cache'] = usage(stats['blocks'], stats['bytes'])
+        if self._writeback is not None:
+            stats = self._writeback.stats()
+            res['writeback'] = usage(len(self._writeback._buffers), stats['buffered'])
+        return res
+    def export_state(self):
+        '''
+        The state a process taking over the FUSE connection needs to go on
+        where this one stops, see pysinter.handoff: the inode table, unless
+        kept in an index file both can open, the open handles, the
+        negotiated KILLPRIV mode and the xattr cache. Returns the state as
+        plain data and the fds it refers to, which the handles hold by
+        position. Buffered writes are written out first.
+        '''
+        if self._writeback is not None:
+            for fh in list(self._writeback._buffers):
+                self._writeback.flush(fh)
+        fds = []
+        positions = {}
+        handles = []
+        for fh, handle in self._handles.items():
+            position = positions.get(handle.fd)
+            if position is None:
+                position = positions[handle.fd] = len(fds)
+                fds.append(handle.fd)
+            handles.append((fh, handle.ino, None if handle.key is None else handle.key[1], position))
+        nodes = None
+        if self._index is None:
+            nodes = [(ino, parent, name) for ino, (parent, name) in self._nodes.items()]
+        return {
+            'root': self._root_ino
+            , 'killpriv': self._killpriv
+            , 'nodes': nodes
+            , 'handles': handles
+            , 'xattrs': self._xattrs.export()
+            }, fds
+    def import_state(self, state, fds):
+        '''
+        Take over the state from export_state of the previous process, with
+        the fds as received.
+        '''
+        if state['root'] != self._root_ino:
+            raise ValueError('Handed over state is for another root', state['root'], self._root_ino)
+        self._killpriv = state['killpriv']
+        if state['nodes'] is not None:
+            for ino, parent, name in state['nodes']:
+                self._nodes[ino] = (parent, name)
+        for fh, ino, accmode, position in state['handles']:
+            fd = fds[position]
+            if accmode is None:
+                handle = Handle(fd, ino, None)
+            else:
+                key = (ino, accmode)
+                handle = Handle(self._fdpool.acquire(key, lambda: fd), ino, key)
+            self._handles.insert(fh, handle)
+        self._xattrs.load(state['xattrs'])
+        return None
+    def close(self):
+        if self._index is not None:
+            self._index.close()
+        if self._prefetch is not None:
+            self._prefetch.close()
+        if self._cache is not None:
+            self._cache.close()
+        self._fdpool.close()
+        self._dirfds.close()
+        return None
+    async def init(self, header, parsed):
+        res = fuse_negotiate(parsed, major=self._major, minor=self._minor, flags=self._flags)
+        self._killpriv = res['flags'] & (FUSE_HANDLE_KILLPRIV | FUSE_HANDLE_KILLPRIV_V2)
+        return 0, res
     async def getattr(self, header, parsed):
         print('# GETTING ATTRIBUTE')
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
+        node = self._node(header.nodeid)
+        self._flush_ino(header.nodeid)
+        dir_fd, name = self._at(node)
         try:
-            data = stat(self._path(node))
+            data = stat(name, dir_fd=dir_fd, follow_symlinks=dir_fd is None)
         except FileNotFoundError as e:
-            print(f'# Attribute file not found, {node=} {self._path(node)=}')
+            print(f'# Attribute file not found, {node=} {name=}')
             raise FUSEError(ENOENT) from e
+        if data.st_ino != node: #Replaced since it was looked up, maybe in an earlier run
+            raise FUSEError(ENOENT)
         res = {'attr': stat_to_attr(data)}
         print(f'# Attribute {node=}', res)
         return 0, res
     async def lookup(self, header, parsed):
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
+        node = self._node(header.nodeid)
         name = parsed['name']
-        fullname = pjoin(self._path(node), name)
-        try:
-            data = stat(fullname, follow_symlinks=False)
-        except FileNotFoundError as e:
-            raise FUSEError(ENOENT) from e
+        data = None if self._prefetch is None else self._prefetch.take(node, name)
+        if data is None:
+            try:
+                data = stat(name, dir_fd=self._dirfds.get(node), follow_symlinks=False)
+            except FileNotFoundError as e:
+                raise FUSEError(ENOENT) from e
         ino = data.st_ino
         if ino == ROOT_INODE:
             raise NotImplementedError(
                 'Cannot cope with inode same as ROOT_INODE yet'
-                , fullname
+                , name
                 )
-        self._path(ino, name=fullname)
+        self._nodes[ino] = (node, name)
         attr = stat_to_attr(data, ino=ino)
         res = {'entry': [{
             'attr': attr
@@ -97,129 +393,381 @@ class Passthrough():
             }]}
         return 0, res
     async def opendir(self, header, parsed):
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        return 0, {
-            'fh': osopen(self._path(node), parsed['flags'])
-            }
+        dir_fd, name = self._at(self._node(header.nodeid))
+        flags = parsed['flags']
+        try:
+            fh = self._open_handle(header.nodeid, flags, lambda: osopen(name, flags, dir_fd=dir_fd))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        return 0, {'fh': fh}
     async def releasedir(self, header, parsed):
-        osclose(parsed['fh'])
+        self._close_handle(parsed['fh'])
         return 0, {}
     async def readdir(self, header, parsed):
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        dirname = self._path(node)
+        node = self._node(header.nodeid)
         cookie = parsed['cookie'].to_bytes(8, BYTEORDER)
+        fd = self._fd(parsed['fh'])
         entries = []
+        #Scanning the fd from OPENDIR yields str names, inodes and types come from getdents
         entries_raw = list(sorted(
-            (dirent_cookie, dirent, dirent.stat(follow_symlinks=False))
-            for dirent_cookie, dirent in (
-                (blake2b(dirent.name, digest_size=8).digest(), dirent)
-                for dirent in scandir(path=dirname)
+            (dirent_cookie, dirent_name, dirent)
+            for dirent_cookie, dirent_name, dirent in (
+                (blake2b(dirent_name, digest_size=8).digest(), dirent_name, dirent)
+                for dirent_name, dirent in (
+                    (fsencode(dirent.name), dirent)
+                    for dirent in scandir(fd)
+                    )
                 )
             if cookie < dirent_cookie #Assume we won't accidentally find the preimage of 0
             ))
-        for dirent_cookie, dirent, dirent_stat in entries_raw:
-            dirent_ino = dirent_stat.st_ino
-            dirent_name = dirent.name
-            fullname = pjoin(dirname, dirent_name)
-            self._path(dirent_ino, name=fullname)
+        for dirent_cookie, dirent_name, dirent in entries_raw:
+            dirent_ino = dirent.inode()
+            self._nodes[dirent_ino] = (node, dirent_name)
             entries.append({
                 'ino': dirent_ino
                 , 'cookie': dirent_cookie
                 , 'namelen': len(dirent_name)
-                , 'type': dirent_stat.st_mode
+                , 'type': dirent_type(dirent)
                 , 'name': dirent_name
                 })
+        if self._prefetch is not None and entries:
+            #The handle's fd may be closed before the batch is done
+            self._prefetch.submit(get_running_loop(), node, dup(fd), [entry['name'] for entry in entries])
         return 0, {'data': entries}
     async def open(self, header, parsed):
         #TODO: openFlags
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        return 0, {
-            'fh': osopen(self._path(node), parsed['flags'])
-            }
+        dir_fd, name = self._at(self._node(header.nodeid))
+        flags = parsed['flags']
+        if flags & O_TRUNC:
+            self._invalidate(header.nodeid)
+        try:
+            fh = self._open_handle(header.nodeid, flags, lambda: osopen(name, flags, dir_fd=dir_fd))
+            if flags & O_TRUNC:
+                fd = self._fd(fh)
+                self._kill_priv(header.nodeid, fd, self._kills_suidgid(parsed.get('openFlags', 0), FUSE_OPEN_KILL_SUIDGID))
+                ftruncate(fd, 0) #The shared fd may be older than this open
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        return 0, {'fh': fh}
     async def read(self, header, parsed):
         #TODO: Flags
         #TODO: Locks
+        fh = parsed['fh']
+        fd = self._fd(fh)
+        self._flush_ino(header.nodeid, parsed['offset'], parsed['size'])
+        if self._cache is None and self._splice:
+            return 0, FileSlice(fd, parsed['offset'], parsed['size'])
+        if self._cache is None:
+            return 0, {
+                'data': self._pread(fd, parsed['size'], parsed['offset'])
+                }
         return 0, {
-            'data': pread(parsed['fh'], parsed['size'], parsed['offset'])
+            'data': await self._cache.read(header.nodeid, fh, fd, parsed['offset'], parsed['size'])
             }
     async def release(self, header, parsed):
         #TODO: Flags
         #TODO: Locks
-        osclose(parsed['fh'])
+        fh = parsed['fh']
+        if self._cache is not None:
+            self._cache.release(fh)
+        try:
+            if self._writeback is not None:
+                self._writeback.release(fh)
+        finally:
+            self._close_handle(fh)
+        return 0, {}
+    async def flush(self, header, parsed):
+        if self._writeback is not None:
+            self._writeback.flush(parsed['fh'])
+        return 0, {}
+    async def fsync(self, header, parsed):
+        fh = parsed['fh']
+        if self._writeback is not None:
+            self._writeback.flush(fh)
+        try:
+            if parsed['fsyncFlags'] & FUSE_FSYNC_FDATASYNC:
+                fdatasync(self._fd(fh))
+            else:
+                fsync(self._fd(fh))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
         return 0, {}
     async def create(self, header, parsed):
         #TODO: Flags
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        dirpath = self._path(node)
-        fullpath = pjoin(dirpath, parsed['name'])
+        node = self._node(header.nodeid)
+        name = parsed['name']
         flags = parsed['flags']
-        fd = osopen(fullpath, flags, mode=(parsed['mode'] ^ parsed['umask']))
         try:
-            statres = stat(fullpath, follow_symlinks=False)
-        except FileNotFoundError as e:
-            raise FUSEError(ENOENT) from e
+            fd = osopen(name, flags, mode=(parsed['mode'] ^ parsed['umask']), dir_fd=self._dirfds.get(node))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        statres = fstat(fd)
         ino = statres.st_ino
-        self._path(ino, name=fullpath)
+        self._nodes[ino] = (node, name)
+        self._discard_name(node, name)
+        fh = self._open_handle(ino, flags, lambda: fd)
+        if self._fd(fh) != fd: #Already open elsewhere, share that fd
+            osclose(fd)
         attr = stat_to_attr(statres, ino=ino)
         return 0, {
             'entry': mk_entry(attr)
-            , 'fh': fd
+            , 'fh': fh
             , 'openFlags': flags
             }
     async def unlink(self, header, parsed):
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        dirpath = self._path(node)
-        fullpath = pjoin(dirpath, parsed['name'])
+        node = self._node(header.nodeid)
+        name = parsed['name']
+        dir_fd = self._dirfds.get(node)
         try:
-            osremove(fullpath)
+            ino = stat(name, dir_fd=dir_fd, follow_symlinks=False).st_ino
+            osremove(name, dir_fd=dir_fd)
         except FileNotFoundError as e:
             raise FUSEError(ENOENT) from e
+        if self._nodes.get(ino) == (node, name):
+            del self._nodes[ino]
+        self._discard_name(node, name)
+        self._xattrs.invalidate(ino)
+        self._fdpool.discard(ino)
+        self._invalidate(ino)
+        return 0, {}
+    def _rename(self, olddir, oldname, newdir, newname, flags):
+        '''
+        Renaming only touches the entries of the inodes involved. Fds of
+        moved directories stay valid, and so does everything below them.
+        '''
+        src_fd = self._dirfds.get(olddir)
+        dst_fd = self._dirfds.get(newdir)
+        try:
+            ino = stat(oldname, dir_fd=src_fd, follow_symlinks=False).st_ino
+            try:
+                replaced = stat(newname, dir_fd=dst_fd, follow_symlinks=False).st_ino
+            except FileNotFoundError:
+                replaced = None
+            if not flags:
+                osrename(oldname, newname, src_dir_fd=src_fd, dst_dir_fd=dst_fd)
+            elif RENAMEAT2 is None:
+                raise OSError(EINVAL, strerror(EINVAL))
+            elif RENAMEAT2(src_fd, oldname, dst_fd, newname, flags) != 0:
+                errno = get_errno()
+                raise OSError(errno, strerror(errno))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        self._discard_name(olddir, oldname)
+        self._discard_name(newdir, newname)
+        self._nodes[ino] = (newdir, newname)
+        if replaced is not None and replaced != ino:
+            if flags & RENAME_EXCHANGE:
+                self._nodes[replaced] = (olddir, oldname)
+            else:
+                self._nodes.pop(replaced, None)
+                self._dirfds.discard(replaced)
+                self._fdpool.discard(replaced)
+                self._xattrs.invalidate(replaced)
+                self._invalidate(replaced)
         return 0, {}
+    async def rename(self, header, parsed):
+        return self._rename(
+            self._node(header.nodeid), parsed['oldname']
+            , self._node(parsed['newdir']), parsed['newname']
+            , 0
+            )
+    async def rename2(self, header, parsed):
+        return self._rename(
+            self._node(header.nodeid), parsed['oldname']
+            , self._node(parsed['newdir']), parsed['newname']
+            , parsed['flags']
+            )
     async def forget(self, header, parsed):
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
-        self._ino_to_path.pop(node, None)
+        node = self._node(header.nodeid)
+        self._nodes.pop(node, None)
+        self._dirfds.discard(node)
         return 0, None
+    @accepts_spliced
     async def write(self, header, parsed):
         #TODO: Flags
         #TODO: Locks
-        data = parsed['data']
+        payload = header.splice
+        fd = self._fd(parsed['fh'])
+        if self._killpriv:
+            self._kill_priv(header.nodeid, fd, self._kills_suidgid(parsed['writeFlags'], FUSE_WRITE_KILL_SUIDGID))
+        if payload is not None and self._writeback is None:
+            count = payload.to_fd(fd, parsed['offset'])
+            self._invalidate(header.nodeid)
+            return 0, {'size': count}
+        data = parsed['data'] if payload is None else payload.read()
         assert len(data) == parsed['size']
-        count = pwrite(parsed['fh'], data, parsed['offset'])
+        if self._writeback is None:
+            count = pwrite(fd, data, parsed['offset'])
+        else:
+            count = self._writeback.write(header.nodeid, parsed['fh'], parsed['offset'], data, fd=fd)
+        self._invalidate(header.nodeid)
         return 0, {'size': count}
+    async def copy_file_range(self, header, parsed):
+        '''
+        Copy between files in the kernel, without the data passing through
+        this process.
+        '''
+        ino_out = parsed['nodeidOut']
+        self._flush_ino(header.nodeid, parsed['offIn'], parsed['len'])
+        self._flush_ino(ino_out)
+        try:
+            count = copy_file_range(
+                self._fd(parsed['fhIn'])
+                , self._fd(parsed['fhOut'])
+                , parsed['len']
+                , parsed['offIn']
+                , parsed['offOut']
+                )
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        finally:
+            self._invalidate(ino_out)
+        return 0, {'size': count}
+    async def fallocate(self, header, parsed):
+        '''
+        Preallocate or, depending on mode, punch holes or zero ranges.
+        '''
+        fd = self._fd(parsed['fh'])
+        mode = parsed['mode']
+        self._flush_ino(header.nodeid)
+        try:
+            if mode == 0:
+                posix_fallocate(fd, parsed['offset'], parsed['length'])
+            elif LIBC.fallocate(fd, mode, parsed['offset'], parsed['length']) != 0:
+                errno = get_errno()
+                raise OSError(errno, strerror(errno))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        finally:
+            self._invalidate(header.nodeid)
+        return 0, {}
+    async def lseek(self, header, parsed):
+        '''
+        Only SEEK_DATA and SEEK_HOLE reach the filesystem, to find the
+        data and holes of sparse files.
+        '''
+        self._flush_ino(header.nodeid)
+        try:
+            offset = lseek(self._fd(parsed['fh']), parsed['offset'], parsed['whence'])
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        return 0, {'offset': offset}
     async def setattr(self, header, parsed):
         #TODO: Flags
         #TODO: Locks
-        node = header.nodeid
-        if node == ROOT_INODE:
-            node = self._root_ino
+        ino = header.nodeid
+        valid = parsed['valid']
         time_mode = parsed['timeandmode']
-        fullpath = self._path(node)
-        print('@@@@', fullpath, time_mode)
-        chmod(fullpath, time_mode['mode'])
-        utime(fullpath, times=(time_mode['atime'], time_mode['mtime']))
-        attr = stat_to_attr(stat(fullpath))
+        dir_fd, name = self._at(self._node(ino))
+        self._flush_ino(ino)
+        self._invalidate(ino)
+        try:
+            if valid & FATTR_SIZE:
+                suidgid = self._kills_suidgid(valid, FATTR_KILL_SUIDGID)
+                if valid & FATTR_FH:
+                    fd = self._fd(parsed['fh'])
+                    self._kill_priv(ino, fd, suidgid)
+                    ftruncate(fd, parsed['size'])
+                else:
+                    fd = osopen(name, O_WRONLY | O_NOFOLLOW, dir_fd=dir_fd)
+                    try:
+                        self._kill_priv(ino, fd, suidgid)
+                        ftruncate(fd, parsed['size'])
+                    finally:
+                        osclose(fd)
+            if valid & (FATTR_UID | FATTR_GID):
+                uid = parsed['uid'] if valid & FATTR_UID else -1
+                gid = parsed['gid'] if valid & FATTR_GID else -1
+                chown(name, uid, gid, dir_fd=dir_fd, follow_symlinks=False)
+                if S_ISREG(stat(name, dir_fd=dir_fd, follow_symlinks=False).st_mode):
+                    self._kill_priv(ino, self._xattr_path(ino), True)
+            if valid & FATTR_MODE:
+                self._xattrs.invalidate(ino) #ACLs follow the mode
+                chmod(name, S_IMODE(time_mode['mode']), dir_fd=dir_fd)
+            if valid & (FATTR_ATIME | FATTR_MTIME | FATTR_ATIME_NOW | FATTR_MTIME_NOW):
+                current = stat(name, dir_fd=dir_fd, follow_symlinks=False)
+                now = time_ns()
+                atime = current.st_atime_ns
+                mtime = current.st_mtime_ns
+                if valid & FATTR_ATIME_NOW:
+                    atime = now
+                elif valid & FATTR_ATIME:
+                    atime = time_mode['atime'] * NS + time_mode['atimensec']
+                if valid & FATTR_MTIME_NOW:
+                    mtime = now
+                elif valid & FATTR_MTIME:
+                    mtime = time_mode['mtime'] * NS + time_mode['mtimensec']
+                utime(name, ns=(atime, mtime), dir_fd=dir_fd, follow_symlinks=False)
+            attr = stat_to_attr(stat(name, dir_fd=dir_fd, follow_symlinks=False))
+        except OSError as e:
+            raise FUSEError(e.errno) from e
         return 0, {'attr': attr}
+    async def getxattr(self, header, parsed):
+        name = parsed['name']
+        value = self._xattrs.get(header.nodeid, name)
+        if value is MISSING:
+            try:
+                value = getxattr(self._xattr_path(self._node(header.nodeid)), name, follow_symlinks=False)
+            except OSError as e:
+                if e.errno != ENODATA:
+                    raise FUSEError(e.errno) from e
+                value = None
+            self._xattrs.put(header.nodeid, name, value)
+        if value is None:
+            raise FUSEError(ENODATA)
+        return self._xattr_reply(parsed['size'], value)
+    def _xattr_reply(self, size, value):
+        '''
+        A size of 0 asks for the size only.
+        '''
+        if not size:
+            return 0, {'size': len(value)}
+        if len(value) > size:
+            raise FUSEError(ERANGE)
+        return 0, value
+    async def listxattr(self, header, parsed):
+        names = self._xattrs.get_names(header.nodeid)
+        if names is None:
+            try:
+                names = b''.join(
+                    fsencode(name) + b'\x00'
+                    for name in listxattr(self._xattr_path(self._node(header.nodeid)), follow_symlinks=False)
+                    )
+            except OSError as e:
+                raise FUSEError(e.errno) from e
+            self._xattrs.put_names(header.nodeid, names)
+        return self._xattr_reply(parsed['size'], names)
+    async def setxattr(self, header, parsed):
+        self._xattrs.invalidate(header.nodeid)
+        try:
+            setxattr(
+                self._xattr_path(self._node(header.nodeid))
+                , parsed['name']
+                , parsed['value'][:parsed['size']]
+                , parsed['flags']
+                , follow_symlinks=False
+                )
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        return 0, {}
+    async def removexattr(self, header, parsed):
+        self._xattrs.invalidate(header.nodeid)
+        try:
+            removexattr(self._xattr_path(self._node(header.nodeid)), parsed['name'], follow_symlinks=False)
+        except OSError as e:
+            raise FUSEError(e.errno) from e
+        return 0, {}
     def make(self):
         return {
-        'FUSE_INIT': mk_dyn_negotiate(major=self._major, minor=self._minor, flags=self._flags)
+        'FUSE_INIT': self.init
         , 'FUSE_GETATTR' : self.getattr
         , 'FUSE_OPENDIR': self.opendir
         , 'FUSE_RELEASEDIR': self.releasedir
         , 'FUSE_READDIR': self.readdir
         , 'FUSE_CREATE': self.create
         , 'FUSE_UNLINK': self.unlink
+        , 'FUSE_RENAME': self.rename
+        , 'FUSE_RENAME2': self.rename2
         , 'FUSE_LOOKUP': self.lookup
         , 'FUSE_OPEN': self.open
         , 'FUSE_READ': self.read
@@ -227,6 +775,14 @@ class Passthrough():
         , 'FUSE_FORGET': dyn_nosend
         , 'FUSE_WRITE': self.write
         , 'FUSE_SETATTR': self.setattr
-        , 'FUSE_FLUSH': dyn_nop
+        , 'FUSE_FLUSH': self.flush
+        , 'FUSE_FSYNC': self.fsync
+        , 'FUSE_COPY_FILE_RANGE': self.copy_file_range
+        , 'FUSE_FALLOCATE': self.fallocate
+        , 'FUSE_LSEEK': self.lseek
+        , 'FUSE_GETXATTR': self.getxattr
+        , 'FUSE_LISTXATTR': self.listxattr
+        , 'FUSE_SETXATTR': self.setxattr
+        , 'FUSE_REMOVEXATTR': self.removexattr
     }
             
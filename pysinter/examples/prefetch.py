@@ -0,0 +1,148 @@
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from os import close as osclose, stat
+from time import monotonic
+
+'''
+Speculative attribute prefetch for the passthrough example. After a READDIR
+the kernel usually looks up every name it got, so the entries are stat'ed on
+a thread pool right away and kept for a moment, for LOOKUP to take instead
+of a stat of its own.
+Results for names and inodes that changed while their batch was running
+are dropped, since they may describe names that are gone.
+'''
+
+DEFAULT_MAXSIZE = 4096
+DEFAULT_TTL = 1.0
+DEFAULT_WORKERS = 2
+
+def _stat_batch(dir_fd, names):
+    '''
+    Stat names relative to dir_fd, which is closed afterwards.
+    '''
+    res = []
+    try:
+        for name in names:
+            try:
+                res.append((name, stat(name, dir_fd=dir_fd, follow_symlinks=False)))
+            except OSError:
+                pass
+    finally:
+        osclose(dir_fd)
+    return res
+
+class _Batch():
+    __slots__ = ('parent', 'names', 'inos')
+    def __init__(self, parent):
+        self.parent = parent
+        self.names = set()
+        self.inos = set()
+        return None
+
+class StatPrefetch():
+    '''
+    Stat results by (parent inode, name), each taken at most once and only
+    within ttl seconds. Entries nobody took are counted as waste when they
+    expire or are evicted to stay within maxsize.
+    '''
+    def __init__(self, maxsize=DEFAULT_MAXSIZE, ttl=DEFAULT_TTL, workers=DEFAULT_WORKERS, clock=monotonic):
+        self._maxsize = maxsize
+        self._ttl = ttl
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._keys_by_ino = {}
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prefetch')
+        self._batches = set()
+        self.prefetched = 0
+        self.hits = 0
+        self.misses = 0
+        self.wasted = 0
+        return None
+    def _drop(self, key):
+        st, _ = self._entries.pop(key)
+        keys = self._keys_by_ino.get(st.st_ino)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._keys_by_ino[st.st_ino]
+        return None
+    def _trim(self):
+        now = self._clock()
+        entries = self._entries
+        while entries:
+            key, (_, expires) = next(iter(entries.items()))
+            if expires > now and len(entries) <= self._maxsize:
+                break
+            self._drop(key)
+            self.wasted = self.wasted + 1
+        return None
+    def put(self, parent, name, st):
+        key = (parent, name)
+        if key in self._entries:
+            self._drop(key)
+        self._entries[key] = (st, self._clock() + self._ttl)
+        self._keys_by_ino.setdefault(st.st_ino, set()).add(key)
+        self.prefetched = self.prefetched + 1
+        self._trim()
+        return None
+    def take(self, parent, name):
+        '''
+        The prefetched stat result for the name, or None.
+        '''
+        key = (parent, name)
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= self._clock():
+            self.misses = self.misses + 1
+            return None
+        self._drop(key)
+        self.hits = self.hits + 1
+        return entry[0]
+    def submit(self, loop, parent, dir_fd, names):
+        '''
+        Stat names in parent relative to dir_fd on the thread pool, taking
+        ownership of dir_fd.
+        '''
+        batch = _Batch(parent)
+        self._batches.add(batch)
+        def done(future):
+            self._batches.discard(batch)
+            if future.cancelled() or future.exception() is not None:
+                return None
+            for name, st in future.result():
+                if name in batch.names or st.st_ino in batch.inos:
+                    self.wasted = self.wasted + 1
+                else:
+                    self.put(parent, name, st)
+            return None
+        loop.run_in_executor(self._executor, _stat_batch, dir_fd, names).add_done_callback(done)
+        return None
+    def discard(self, parent, name):
+        '''
+        The name changed: drop it, also from batches in flight.
+        '''
+        for batch in self._batches:
+            if batch.parent == parent:
+                batch.names.add(name)
+        if (parent, name) in self._entries:
+            self._drop((parent, name))
+        return None
+    def invalidate(self, ino):
+        '''
+        The inode's attributes changed.
+        '''
+        for batch in self._batches:
+            batch.inos.add(ino)
+        for key in list(self._keys_by_ino.get(ino, ())):
+            self._drop(key)
+        return None
+    def stats(self):
+        return {
+            'prefetched': self.prefetched
+            , 'hits': self.hits
+            , 'misses': self.misses
+            , 'wasted': self.wasted
+            , 'size': len(self._entries)
+            }
+    def close(self):
+        self._executor.shutdown(wait=True)
+        return None
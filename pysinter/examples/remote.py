@@ -0,0 +1,357 @@
+from asyncio import (
+    Lock, Semaphore, create_task, get_running_loop, open_unix_connection, sleep
+    , start_unix_server, IncompleteReadError
+    )
+from errno import EIO, ENOENT, ENOSYS
+from json import dumps, loads
+from logging import getLogger
+from os import fsdecode, fsencode
+from struct import Struct
+from threading import Thread, Event
+
+from pysinter import FUSEError
+from pysinter.examples.backend import Backend, Stat
+
+'''
+A Backend reached over a Unix socket, and a stand-in server for it exposing
+any other Backend, with injectable latency.
+
+Frames are a header of request id, length of a JSON part and length of a
+data part, followed by both. Requests carry [method, arguments] as JSON and
+written data as the data part, replies [errno, result] and read data.
+Requests are pipelined: a connection carries many at once and the server
+answers them as they complete, in any order.
+The client keeps up to max_connections connections with up to pipeline
+requests each, opening another only while every connection is busy. STATs
+issued in the same event loop iteration go out as one stat_many request.
+'''
+
+LOGGER = getLogger(__name__)
+
+FRAME_HEADER = Struct('<III')
+DEFAULT_MAX_CONNECTIONS = 4
+DEFAULT_PIPELINE = 32
+DEFAULT_BATCH_SIZE = 256
+SERVER_TIMEOUT = 10
+
+#Argument kinds per method: path, paths, int or data (the data part)
+METHODS = {
+    'stat': ('path',)
+    , 'stat_many': ('paths',)
+    , 'listdir': ('path',)
+    , 'read': ('path', 'int', 'int')
+    , 'write': ('path', 'int', 'data')
+    , 'create': ('path', 'int')
+    , 'mkdir': ('path', 'int')
+    , 'unlink': ('path',)
+    , 'rmdir': ('path',)
+    , 'rename': ('path', 'path')
+    , 'truncate': ('path', 'int')
+    , 'chmod': ('path', 'int')
+    }
+#Result kinds, None for methods without one
+RESULTS = {
+    'stat': 'stat'
+    , 'stat_many': 'stats'
+    , 'listdir': 'dirents'
+    , 'read': 'data'
+    , 'write': 'int'
+    , 'create': 'stat'
+    , 'mkdir': 'stat'
+    }
+
+def _frame(request_id, obj, data=b''):
+    body = dumps(obj, separators=(',', ':')).encode('utf-8')
+    return FRAME_HEADER.pack(request_id, len(body), len(data)) + body + data
+
+async def _read_frame(reader):
+    request_id, bodylen, datalen = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+    body = await reader.readexactly(bodylen)
+    data = await reader.readexactly(datalen) if datalen else b''
+    return request_id, loads(body), data
+
+def _encode_args(method, args):
+    '''
+    JSON arguments and data part of a request. Paths go as str with
+    surrogate escapes, like os.fsdecode makes them.
+    '''
+    res = []
+    data = b''
+    for kind, arg in zip(METHODS[method], args):
+        if kind == 'path':
+            res.append(fsdecode(arg))
+        elif kind == 'paths':
+            res.append([fsdecode(path) for path in arg])
+        elif kind == 'data':
+            res.append(None)
+            data = bytes(arg)
+        else:
+            res.append(arg)
+    return res, data
+
+def _decode_args(method, args, data):
+    res = []
+    for kind, arg in zip(METHODS[method], args):
+        if kind == 'path':
+            res.append(fsencode(arg))
+        elif kind == 'paths':
+            res.append([fsencode(path) for path in arg])
+        elif kind == 'data':
+            res.append(data)
+        else:
+            res.append(int(arg))
+    return res
+
+def _encode_result(method, res):
+    kind = RESULTS.get(method)
+    if kind == 'stat':
+        return list(res), b''
+    if kind == 'stats':
+        return [None if data is None else list(data) for data in res], b''
+    if kind == 'dirents':
+        return [[fsdecode(name), ino, dtype] for name, ino, dtype in res], b''
+    if kind == 'data':
+        return None, bytes(res)
+    return res, b''
+
+def _decode_result(method, res, data):
+    kind = RESULTS.get(method)
+    if kind == 'stat':
+        return Stat(*res)
+    if kind == 'stats':
+        return [None if fields is None else Stat(*fields) for fields in res]
+    if kind == 'dirents':
+        return [(fsencode(name), ino, dtype) for name, ino, dtype in res]
+    if kind == 'data':
+        return data
+    return res
+
+class _Connection():
+    __slots__ = ('reader', 'writer', 'pending', 'task')
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.pending = {}
+        self.task = None
+        return None
+
+class RemoteBackend(Backend):
+    '''
+    A Backend served by BackendServer at the Unix socket path. Connections
+    belong to the event loop that first used them.
+    '''
+    def __init__(self, path, max_connections=DEFAULT_MAX_CONNECTIONS, pipeline=DEFAULT_PIPELINE, batch_size=DEFAULT_BATCH_SIZE):
+        self._path = path
+        self._max_connections = max_connections
+        self._batch_size = batch_size
+        self._slots = Semaphore(max_connections * pipeline)
+        self._connections = []
+        self._connect_lock = Lock()
+        self._request_id = 0
+        self._stat_queue = []
+        self._tasks = set() # The event loop keeps only weak references
+        self.requests = 0
+        self.stat_batches = 0
+        self.stats_batched = 0
+        return None
+    def _idle_connection(self):
+        '''
+        The least busy connection if it is idle or no more may be opened.
+        '''
+        conns = self._connections
+        best = min(conns, key=lambda conn: len(conn.pending), default=None)
+        if best is not None and (not best.pending or len(conns) >= self._max_connections):
+            return best
+        return None
+    async def _connection(self):
+        conn = self._idle_connection()
+        if conn is not None:
+            return conn
+        async with self._connect_lock:
+            conn = self._idle_connection()
+            if conn is not None: # Opened while waiting for the lock
+                return conn
+            reader, writer = await open_unix_connection(self._path)
+            conn = _Connection(reader, writer)
+            conn.task = create_task(self._receive(conn))
+            self._connections.append(conn)
+        return conn
+    async def _receive(self, conn):
+        try:
+            while True:
+                request_id, res, data = await _read_frame(conn.reader)
+                future = conn.pending.pop(request_id, None)
+                if future is not None and not future.done():
+                    future.set_result((res, data))
+        except (IncompleteReadError, ConnectionError) as e:
+            LOGGER.debug('Backend connection lost: %s', e)
+        finally:
+            self._connections.remove(conn)
+            for future in conn.pending.values():
+                if not future.done():
+                    future.set_exception(FUSEError(EIO, 'Backend connection lost'))
+            conn.pending.clear()
+            conn.writer.close()
+        return None
+    async def _call(self, method, *args):
+        body, data = _encode_args(method, args)
+        async with self._slots:
+            conn = await self._connection()
+            self._request_id = (self._request_id + 1) & 0xffffffff
+            future = get_running_loop().create_future()
+            conn.pending[self._request_id] = future
+            conn.writer.write(_frame(self._request_id, [method, body], data))
+            self.requests = self.requests + 1
+            await conn.writer.drain()
+            (errno, res), data = await future
+        if errno:
+            raise FUSEError(errno)
+        return _decode_result(method, res, data)
+    def _flush_stats(self):
+        queue = self._stat_queue
+        self._stat_queue = []
+        for start in range(0, len(queue), self._batch_size):
+            task = create_task(self._stat_batch(queue[start:start + self._batch_size]))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+    async def _stat_batch(self, batch):
+        self.stat_batches = self.stat_batches + 1
+        self.stats_batched = self.stats_batched + len(batch)
+        try:
+            res = await self._call('stat_many', [path for path, _ in batch])
+        except FUSEError as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(FUSEError(e.errno))
+            return None
+        for (_, future), data in zip(batch, res):
+            if future.done():
+                continue
+            if data is None:
+                future.set_exception(FUSEError(ENOENT))
+            else:
+                future.set_result(data)
+        return None
+    async def stat(self, path):
+        loop = get_running_loop()
+        if not self._stat_queue:
+            loop.call_soon(self._flush_stats)
+        future = loop.create_future()
+        self._stat_queue.append((path, future))
+        return await future
+    async def stat_many(self, paths):
+        return await self._call('stat_many', paths)
+    async def listdir(self, path):
+        return await self._call('listdir', path)
+    async def read(self, path, offset, size):
+        return await self._call('read', path, offset, size)
+    async def write(self, path, offset, data):
+        return await self._call('write', path, offset, data)
+    async def create(self, path, mode):
+        return await self._call('create', path, mode)
+    async def mkdir(self, path, mode):
+        return await self._call('mkdir', path, mode)
+    async def unlink(self, path):
+        return await self._call('unlink', path)
+    async def rmdir(self, path):
+        return await self._call('rmdir', path)
+    async def rename(self, old, new):
+        return await self._call('rename', old, new)
+    async def truncate(self, path, size):
+        return await self._call('truncate', path, size)
+    async def chmod(self, path, mode):
+        return await self._call('chmod', path, mode)
+    def stats(self):
+        return {
+            'requests': self.requests
+            , 'connections': len(self._connections)
+            , 'stat_batches': self.stat_batches
+            , 'stats_batched': self.stats_batched
+            }
+    async def close(self):
+        for conn in list(self._connections):
+            conn.writer.close()
+            conn.task.cancel()
+        return None
+
+class BackendServer():
+    '''
+    Serve a Backend at a Unix socket path from a background thread, every
+    request delayed by latency seconds.
+    '''
+    def __init__(self, backend, path, latency=0.0):
+        self._backend = backend
+        self._path = path
+        self.latency = latency
+        self._loop = None
+        self._stop = None
+        self._started = None
+        self._thread = None
+        self._writers = set()
+        self.requests = 0
+        return None
+    async def _handle(self, writer, request_id, method, args, data):
+        try:
+            if method not in METHODS:
+                raise FUSEError(ENOSYS, 'Unknown backend method', method)
+            if self.latency:
+                await sleep(self.latency)
+            res = await getattr(self._backend, method)(*_decode_args(method, args, data))
+            res, data = _encode_result(method, res)
+            reply = _frame(request_id, [0, res], data)
+        except FUSEError as e:
+            reply = _frame(request_id, [e.errno, None])
+        except Exception:
+            LOGGER.exception('Backend request failed: %s %s', method, args)
+            reply = _frame(request_id, [EIO, None])
+        if not writer.is_closing():
+            writer.write(reply)
+            await writer.drain()
+        return None
+    async def _client(self, reader, writer):
+        tasks = set()
+        self._writers.add(writer)
+        try:
+            while True:
+                request_id, (method, args), data = await _read_frame(reader)
+                self.requests = self.requests + 1
+                task = create_task(self._handle(writer, request_id, method, args, data))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            for task in tasks:
+                task.cancel()
+            self._writers.discard(writer)
+            writer.close()
+        return None
+    async def _serve(self):
+        from asyncio import Event as AsyncEvent
+        self._loop = get_running_loop()
+        self._stop = AsyncEvent()
+        server = await start_unix_server(self._client, self._path)
+        self._started.set()
+        async with server:
+            await self._stop.wait()
+            for writer in list(self._writers):
+                writer.close()
+        return None
+    def start(self):
+        from asyncio import run
+        self._started = Event()
+        self._thread = Thread(target=run, args=(self._serve(),), daemon=True)
+        self._thread.start()
+        if not self._started.wait(SERVER_TIMEOUT):
+            raise RuntimeError('Backend server did not start')
+        return self
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(SERVER_TIMEOUT)
+        return None
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
+        return None
@@ -0,0 +1,150 @@
+from asyncio import get_running_loop
+from os import pwrite as ospwrite
+
+from pysinter import FUSEError
+
+'''
+Write-behind buffering for the passthrough example: adjacent writes on a
+file handle are collected and written with one pwrite once the buffer is
+large or old enough, or when the data has to be visible, e.g. for FLUSH,
+FSYNC, RELEASE or a read overlapping the buffered range.
+Errors of writes that happen in the background are kept and reported by the
+next flush of the file handle, as the kernel does for its page cache.
+Buffers of other handles of the inode that overlap a write are written out
+before it is buffered, so that the later write wins.
+'''
+
+DEFAULT_MAX_BYTES = 1 << 20
+DEFAULT_MAX_DELAY = 0.05
+
+class WriteBuffer():
+    '''
+    Pending data of one file handle: len(data) bytes starting at offset.
+    '''
+    __slots__ = ('ino', 'fd', 'offset', 'data', 'error', 'timer')
+    def __init__(self, ino, fd):
+        self.ino = ino
+        self.fd = fd
+        self.offset = 0
+        self.data = bytearray()
+        self.error = None
+        self.timer = None
+        return None
+    def overlaps(self, offset, size):
+        return self.data and offset < self.offset + len(self.data) and self.offset < offset + size
+
+class WriteBehind():
+    '''
+    Write-behind buffers keyed by file handle. The pwrite function can be
+    replaced for testing. on_write_out, if set, is called with the inode
+    after buffered data was written to the file, for caches of the file's
+    contents to drop it.
+    '''
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, max_delay=DEFAULT_MAX_DELAY, pwrite=ospwrite, on_write_out=None):
+        self._max_bytes = max_bytes
+        self._max_delay = max_delay
+        self._pwrite = pwrite
+        self.on_write_out = on_write_out
+        self._buffers = {}
+        self._fhs_by_ino = {}
+        self.writes = 0
+        self.pwrites = 0
+        return None
+    def _write_out(self, buf):
+        '''
+        Write the buffered data, keeping an error for the next flush.
+        '''
+        if buf.timer is not None:
+            buf.timer.cancel()
+            buf.timer = None
+        data = buf.data
+        if not data:
+            return None
+        view = memoryview(data)
+        offset = buf.offset
+        try:
+            while view:
+                count = self._pwrite(buf.fd, view, offset)
+                self.pwrites = self.pwrites + 1
+                view = view[count:]
+                offset = offset + count
+        except OSError as e:
+            if buf.error is None:
+                buf.error = e.errno
+        finally:
+            view.release()
+            buf.data = bytearray()
+            if self.on_write_out is not None:
+                self.on_write_out(buf.ino)
+        return None
+    def write(self, ino, fh, offset, data, fd=None):
+        '''
+        Buffer a write, returning the number of bytes accepted. Fails right
+        away if an earlier background write on this handle failed. The data
+        goes to fd, or to fh itself if that is the OS fd.
+        '''
+        buf = self._buffers.get(fh)
+        if buf is None:
+            buf = self._buffers[fh] = WriteBuffer(ino, fh if fd is None else fd)
+            self._fhs_by_ino.setdefault(ino, set()).add(fh)
+        if buf.error is not None:
+            raise FUSEError(buf.error)
+        self.writes = self.writes + 1
+        for other in self._fhs_by_ino[ino]:
+            if other != fh and self._buffers[other].overlaps(offset, len(data)):
+                self._write_out(self._buffers[other])
+        if buf.data and offset != buf.offset + len(buf.data):
+            self._write_out(buf)
+        if not buf.data:
+            buf.offset = offset
+        buf.data += data
+        if len(buf.data) >= self._max_bytes:
+            self._write_out(buf)
+        elif buf.timer is None:
+            buf.timer = get_running_loop().call_later(self._max_delay, self._write_out, buf)
+        return len(data)
+    def flush(self, fh):
+        '''
+        Write out the handle's buffer, raising FUSEError for an error of this
+        or an earlier background write. The error is reported once.
+        '''
+        buf = self._buffers.get(fh)
+        if buf is None:
+            return None
+        self._write_out(buf)
+        error = buf.error
+        if error is not None:
+            buf.error = None
+            raise FUSEError(error)
+        return None
+    def flush_ino(self, ino, offset=0, size=None):
+        '''
+        Write out the buffers of all handles of the inode, or only those
+        overlapping a range if given. Errors are kept for the handles' next
+        flush.
+        '''
+        for fh in self._fhs_by_ino.get(ino, ()):
+            buf = self._buffers[fh]
+            if size is None or buf.overlaps(offset, size):
+                self._write_out(buf)
+        return None
+    def release(self, fh):
+        '''
+        Flush and forget the handle's buffer.
+        '''
+        try:
+            self.flush(fh)
+        finally:
+            buf = self._buffers.pop(fh, None)
+            if buf is not None:
+                fhs = self._fhs_by_ino[buf.ino]
+                fhs.discard(fh)
+                if not fhs:
+                    del self._fhs_by_ino[buf.ino]
+        return None
+    def stats(self):
+        return {
+            'writes': self.writes
+            , 'pwrites': self.pwrites
+            , 'buffered': sum(len(buf.data) for buf in self._buffers.values())
+            }
@@ -0,0 +1,106 @@
+from collections import OrderedDict
+
+'''
+Extended attributes by inode for the passthrough example. Absent attributes
+are cached as None, since most lookups are for attributes a file does not
+have: without FUSE_HANDLE_KILLPRIV the kernel asks for security.capability
+before every write.
+'''
+
+DEFAULT_MAXSIZE = 4096
+CAPABILITY = b'security.capability'
+MISSING = object()
+
+class _Entry():
+    __slots__ = ('values', 'names')
+    def __init__(self):
+        self.values = {}
+        self.names = None
+        return None
+
+class XattrCache():
+    '''
+    Attribute values and name lists for up to maxsize inodes, least recently
+    used inodes dropped first. A maxsize of 0 caches nothing.
+    '''
+    def __init__(self, maxsize=DEFAULT_MAXSIZE):
+        self._maxsize = maxsize
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        return None
+    def _entry(self, ino):
+        entry = self._entries.get(ino)
+        if entry is None:
+            entry = self._entries[ino] = _Entry()
+            while len(self._entries) > self._maxsize:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(ino)
+        return entry
+    def get(self, ino, name):
+        '''
+        The value, None if the attribute is known to be absent, MISSING if
+        nothing is known.
+        '''
+        entry = self._entries.get(ino)
+        value = MISSING if entry is None else entry.values.get(name, MISSING)
+        if value is MISSING:
+            self.misses = self.misses + 1
+        elif value is None:
+            self.negative_hits = self.negative_hits + 1
+        else:
+            self.hits = self.hits + 1
+        return value
+    def put(self, ino, name, value):
+        if self._maxsize:
+            self._entry(ino).values[name] = value
+        return None
+    def get_names(self, ino):
+        '''
+        The list of attribute names as LISTXATTR returns it, or None.
+        '''
+        entry = self._entries.get(ino)
+        names = None if entry is None else entry.names
+        if names is None:
+            self.misses = self.misses + 1
+        else:
+            self.hits = self.hits + 1
+        return names
+    def put_names(self, ino, names):
+        if self._maxsize:
+            self._entry(ino).names = names
+        return None
+    def killpriv(self, ino):
+        '''
+        The file was written to, which removes its capabilities.
+        '''
+        entry = self._entries.get(ino)
+        if entry is not None and entry.values.get(CAPABILITY) is not None:
+            del entry.values[CAPABILITY]
+            entry.names = None
+        return None
+    def invalidate(self, ino):
+        self._entries.pop(ino, None)
+        return None
+    def export(self):
+        '''
+        The cached entries as plain data for load(), least recently used
+        first.
+        '''
+        return [(ino, dict(entry.values), entry.names) for ino, entry in self._entries.items()]
+    def load(self, entries):
+        for ino, values, names in entries:
+            for name, value in values.items():
+                self.put(ino, name, value)
+            if names is not None:
+                self.put_names(ino, names)
+        return None
+    def stats(self):
+        return {
+            'hits': self.hits
+            , 'negative_hits': self.negative_hits
+            , 'misses': self.misses
+            , 'inodes': len(self._entries)
+            }
@@ -0,0 +1,153 @@
+'''
+Fair queueing of requests between the processes or users issuing them, for
+Operations(dispatcher=FairQueue(...)).
+
+Without a dispatcher every request gets its handler task right away, so a
+client flooding the filesystem gets all the handler capacity. FairQueue
+caps the requests being handled at once and picks the next one by deficit
+round robin over per-client queues: each client with queued requests gets
+quantum credit per round and may start requests as long as its credit covers
+their cost. Clients at their own in-flight cap are passed over.
+Clients are told apart by the uid, gid or pid of the request header, or a
+function of the header. Clients with nothing queued or in flight keep their
+statistics, but only the history most recently idle ones are kept, so that
+per-pid keys do not pile up.
+'''
+
+from asyncio import create_task
+from collections import OrderedDict, deque
+from time import perf_counter_ns
+
+from pysinter.metrics import Histogram
+
+DEFAULT_MAX_INFLIGHT = 64
+DEFAULT_CLIENT_INFLIGHT = 16
+DEFAULT_HISTORY = 256
+
+class _Client():
+    __slots__ = ('queue', 'deficit', 'inflight', 'requests', 'wait')
+    def __init__(self):
+        self.queue = deque()
+        self.deficit = 0
+        self.inflight = 0
+        self.requests = 0
+        self.wait = Histogram()
+        return None
+
+class FairQueue():
+    '''
+    Deficit round robin dispatcher. Requests cost 1 each unless cost, a
+    function (header, msg), says otherwise. Wait times from submission to
+    the start of the handler are kept per client, in nanoseconds, and for
+    up to history idle clients.
+    '''
+    def __init__(self, key='uid', max_inflight=DEFAULT_MAX_INFLIGHT, client_inflight=DEFAULT_CLIENT_INFLIGHT, quantum=1, cost=None, history=DEFAULT_HISTORY):
+        if isinstance(key, str):
+            attrname = key
+            key = lambda header: getattr(header, attrname)
+        self._key = key
+        self._max_inflight = max_inflight
+        self._client_inflight = client_inflight
+        self._quantum = quantum
+        self._cost = cost
+        self._clients = {}
+        self._idle = OrderedDict() # Idle clients, least recently idle first
+        self._history = history
+        self._active = deque()
+        self._fresh = True # The client in front has not had its quantum yet
+        self._tasks = set()
+        self.inflight = 0
+        self.queued = 0
+        return None
+    def submit(self, run, header, msg):
+        '''
+        Queue a request, to be handled by the coroutine run(header, msg).
+        '''
+        key = self._key(header)
+        client = self._clients.get(key)
+        if client is None:
+            client = self._idle.pop(key, None)
+            if client is None:
+                client = _Client()
+            self._clients[key] = client
+        if not client.queue:
+            self._active.append(key)
+        cost = 1 if self._cost is None else self._cost(header, msg)
+        client.queue.append((run, header, msg, cost, perf_counter_ns()))
+        self.queued = self.queued + 1
+        self._schedule()
+        return None
+    def _schedule(self):
+        active = self._active
+        passed = 0
+        while active and self.inflight < self._max_inflight and passed < len(active):
+            key = active[0]
+            client = self._clients[key]
+            if client.inflight >= self._client_inflight:
+                active.rotate(-1)
+                self._fresh = True
+                passed = passed + 1
+                continue
+            if self._fresh:
+                client.deficit = client.deficit + self._quantum
+                self._fresh = False
+            run, header, msg, cost, queued_at = client.queue[0]
+            if client.deficit < cost:
+                active.rotate(-1)
+                self._fresh = True
+                continue
+            client.queue.popleft()
+            client.deficit = client.deficit - cost
+            self.queued = self.queued - 1
+            if not client.queue:
+                active.popleft()
+                client.deficit = 0
+                self._fresh = True
+            passed = 0
+            self._start(key, client, run, header, msg, queued_at)
+        return None
+    def _start(self, key, client, run, header, msg, queued_at):
+        client.wait.record(perf_counter_ns() - queued_at)
+        client.requests = client.requests + 1
+        client.inflight = client.inflight + 1
+        self.inflight = self.inflight + 1
+        task = create_task(run(header, msg))
+        self._tasks.add(task)
+        task.add_done_callback(lambda task: self._done(key, client, task))
+        return None
+    def _done(self, key, client, task):
+        self._tasks.discard(task)
+        client.inflight = client.inflight - 1
+        self.inflight = self.inflight - 1
+        if not client.inflight and not client.queue and self._clients.get(key) is client:
+            del self._clients[key]
+            self._idle[key] = client
+            while len(self._idle) > self._history:
+                self._idle.popitem(last=False)
+        self._schedule()
+        return None
+    def stats(self):
+        '''
+        Per client with requests queued or in flight and per remembered
+        idle client: requests started, queued and in flight, and wait time
+        percentiles.
+        '''
+        return {
+            key: {
+                'requests': client.requests
+                , 'queued': len(client.queue)
+                , 'inflight': client.inflight
+                , 'wait': client.wait.snapshot()
+                }
+            for clients in (self._idle, self._clients)
+            for key, client in list(clients.items())
+            }
+    def register_gauges(self, metrics):
+        '''
+        Report queued and running requests in pysinter.metrics.Metrics
+        snapshots.
+        '''
+        metrics.gauge('fairqueue_queued', lambda: self.queued)
+        metrics.gauge('fairqueue_inflight', lambda: self.inflight)
+        metrics.gauge('fairqueue_clients_waiting', lambda: len(self._active))
+        return None
@@ -0,0 +1,154 @@
+'''
+Handing a live FUSE connection over to a new server process, to upgrade or
+restart a server without unmounting.
+
+The running server waits on a Unix socket with HandoffListener; the new
+process connects with receive_handoff(). The old one then stops reading
+requests, waits until the requests it has read are answered, and sends the
+FUSE fd and the fds its filesystem holds with SCM_RIGHTS, followed by a
+snapshot of the filesystem's state. Requests the kernel queues meanwhile
+wait for the new process. The kernel keeps its page, dentry and attribute
+caches throughout, only the server's own state has to move.
+
+FUSE_INIT is not sent again, so whatever the new process needs to know of
+the negotiation travels in the snapshot. The old process must neither
+unmount nor close the connection, it just exits once the handoff is done.
+
+The snapshot is plain data as marshal handles it, compressed. Both ends
+have to trust each other; the socket is only accessible to its owner.
+'''
+
+from asyncio import get_running_loop, sleep, wait_for
+from marshal import dumps, loads
+from os import chmod, unlink
+from socket import socket, AF_UNIX, SOCK_STREAM, send_fds, recv_fds
+from struct import Struct
+from time import monotonic
+from zlib import compress, decompress
+
+HANDOFF_MAGIC = b'PYSHOFF1'
+HANDOFF_HEADER = Struct('<8sIQ') # magic, fd count, snapshot size
+MAX_FDS_PER_MESSAGE = 250 # The kernel takes at most 253 per message
+DEFAULT_DRAIN_TIMEOUT = 10.0
+DRAIN_INTERVAL = 0.001
+
+def encode_state(state):
+    return compress(dumps(state))
+
+def decode_state(data):
+    return loads(decompress(data))
+
+def _recv_exactly(sock, size):
+    chunks = []
+    remaining = size
+    while remaining:
+        chunk = sock.recv(min(remaining, 1 << 20))
+        if not chunk:
+            raise ConnectionError('Handoff connection closed early')
+        chunks.append(chunk)
+        remaining = remaining - len(chunk)
+    return b''.join(chunks)
+
+def send_handoff(sock, fds, state):
+    '''
+    Send the fds and the state over a connected blocking socket.
+    '''
+    data = encode_state(state)
+    sock.sendall(HANDOFF_HEADER.pack(HANDOFF_MAGIC, len(fds), len(data)))
+    for start in range(0, len(fds), MAX_FDS_PER_MESSAGE):
+        send_fds(sock, [b'\0'], fds[start:start + MAX_FDS_PER_MESSAGE])
+    sock.sendall(data)
+    return None
+
+def recv_handoff(sock):
+    '''
+    The fds and the state sent with send_handoff.
+    '''
+    magic, count, size = HANDOFF_HEADER.unpack(_recv_exactly(sock, HANDOFF_HEADER.size))
+    if magic != HANDOFF_MAGIC:
+        raise ValueError('Not a handoff', magic)
+    fds = []
+    while len(fds) < count:
+        _, received, _, _ = recv_fds(sock, 1, min(MAX_FDS_PER_MESSAGE, count - len(fds)))
+        if not received:
+            raise ConnectionError('Handoff connection closed early')
+        fds.extend(received)
+    return fds, decode_state(_recv_exactly(sock, size))
+
+def receive_handoff(path, timeout=None):
+    '''
+    Take over the FUSE connection of the server listening at path. Returns
+    the FUSE fd for a new Sinter, the filesystem's state and the fds the
+    state refers to, as export_state returned them.
+    '''
+    with socket(AF_UNIX, SOCK_STREAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect(path)
+        fds, state = recv_handoff(sock)
+    return fds[0], state['fs'], fds[1:]
+
+def _idle(sinter, operations):
+    dispatcher = operations._dispatcher
+    return (
+        sinter.recv_stopped.is_set()
+        and not sinter.rx_sync.qsize()
+        and not operations.inflight
+        and (dispatcher is None or not dispatcher.queued)
+        )
+
+async def drain(sinter, operations, timeout=DEFAULT_DRAIN_TIMEOUT):
+    '''
+    Stop reading requests and wait until all that were read are answered
+    and the replies written. Raises TimeoutError otherwise; the Sinter has
+    stopped receiving either way.
+    Only an interruptible Sinter stops without another request coming in.
+    '''
+    sinter.stop_receiving()
+    deadline = monotonic() + timeout
+    idle = 0
+    while idle < 2: # Twice, so requests just taken off the queue have started
+        if monotonic() > deadline:
+            raise TimeoutError('Requests still in flight', operations.inflight)
+        await sleep(DRAIN_INTERVAL)
+        idle = idle + 1 if _idle(sinter, operations) else 0
+    await wait_for(sinter.tx_async.join(), max(0.0, deadline - monotonic()))
+    return None
+
+class HandoffListener():
+    '''
+    Wait at path for a process to take over the connection of sinter,
+    served by operations. export returns the filesystem's state and the fds
+    it refers to, like Passthrough.export_state; without it only the FUSE
+    fd is handed over.
+    '''
+    def __init__(self, path, sinter, operations, export=None, drain_timeout=DEFAULT_DRAIN_TIMEOUT):
+        self._path = path
+        self._sinter = sinter
+        self._operations = operations
+        self._export = export
+        self._drain_timeout = drain_timeout
+        self.handed_off = False
+        return None
+    async def serve(self):
+        '''
+        Return once a process has connected and taken over. The caller
+        should stop serving then, without unmounting.
+        '''
+        loop = get_running_loop()
+        listener = socket(AF_UNIX, SOCK_STREAM)
+        try:
+            listener.bind(self._path)
+            chmod(self._path, 0o600)
+            listener.listen(1)
+            listener.setblocking(False)
+            conn, _ = await loop.sock_accept(listener)
+        finally:
+            listener.close()
+            unlink(self._path)
+        with conn:
+            await drain(self._sinter, self._operations, timeout=self._drain_timeout)
+            state, fds = (None, []) if self._export is None else self._export()
+            conn.setblocking(True)
+            await loop.run_in_executor(None, send_handoff, conn, [self._sinter.fd] + list(fds), {'fs': state})
+        self.handed_off = True
+        return None
@@ -1,5 +1,8 @@
 
 
+from importlib import import_module
+from json import loads
+from pkgutil import get_data
 from stat import S_IFDIR, S_IFREG
 from pysinter import FUSEError, ROOT_INODE, MAX32, pad64, to32, to64, ENCODING, BYTEORDER
 
@@ -12,6 +15,35 @@ DEFAULT_NEGOTIATE_OPTIONS = {
     'maxPages': 16
     }
 
+def load_protocol(path=None, version=None):
+    '''
+    Load a protocol description, by default the one shipped with pysinter.
+    Files holding several versions, keyed like 'v7.31', need the version.
+    '''
+    if path is None:
+        res = loads(get_data('pysinter', 'protocol/protocol-latest.json'))
+    else:
+        with open(path, 'rb') as handle:
+            res = loads(handle.read())
+    if version is not None:
+        res = res[version]
+    return res
+
+def import_handlers(spec):
+    '''
+    Resolve a handler set given as 'module:attribute', for command line use.
+    Callable attributes are taken as factories and called without arguments.
+    '''
+    modname, _, attrname = spec.partition(':')
+    if not attrname:
+        raise ValueError('Handler sets are given as module:attribute', spec)
+    res = import_module(modname)
+    for name in attrname.split('.'):
+        res = getattr(res, name)
+    if callable(res):
+        res = res()
+    return res
+
 def fuse_negotiate(inpt, major=7, minor=31, flags=0, options=None):
     if options is None:
         opts = dict(DEFAULT_NEGOTIATE_OPTIONS)
@@ -28,10 +60,10 @@ def mk_dyn_negotiate(major=7, minor=31, flags=0, options=None):
     async def dyn_negotiate(_, inpt):
         return 0, fuse_negotiate(
             inpt
-            , major=7
-            , minor=31
-            , flags=0
-            , options=None
+            , major=major
+            , minor=minor
+            , flags=flags
+            , options=options
             )
     return dyn_negotiate
 
@@ -46,3 +78,10 @@ async def dyn_nosend(header, parsed):
     '''
     return 0, None
 
+def accepts_spliced(handler):
+    '''
+    Mark a WRITE handler as taking the data from header.splice when the
+    request was spliced. Other handlers get it in the data field as usual.
+    '''
+    handler.accepts_spliced = True
+    return handler
@@ -0,0 +1,419 @@
+'''
+An in-process stand-in for the kernel side of /dev/fuse.
+
+FakeKernel owns one end of an AF_UNIX SOCK_SEQPACKET socket pair and hands the
+other end to a Sinter. Sequenced packets keep the /dev/fuse framing: every
+read returns exactly one request and every write carries exactly one reply.
+Requests are encoded from the protocol schema, so a Sinter + Operations +
+handler set can be driven and measured without mounting anything.
+'''
+
+from errno import ENOENT
+from logging import getLogger
+from random import Random
+from socket import socketpair, AF_UNIX, SOCK_SEQPACKET
+from stat import S_IFDIR, S_IFREG
+from threading import Thread
+from time import perf_counter, perf_counter_ns
+
+from pysinter import (
+    Header, Sinter, FUSEError, FUSEUnmountError, ROOT_INODE
+    , HEADER_SIZE_SEND, BYTEORDER, format_header_req
+    )
+from pysinter.dynamic import Operations, FrozenReply
+from pysinter.helper import mk_dyn_negotiate, dyn_nop
+
+LOGGER = getLogger(__name__)
+
+LOOPBACK_BUFFER_SIZE = 1 << 17
+LOOPBACK_TIMEOUT = 10
+
+class FakeKernel():
+    '''
+    The kernel end of a loopback FUSE connection. Pass the fd attribute to
+    Sinter.
+    '''
+    def __init__(self, protocol, bufsize=LOOPBACK_BUFFER_SIZE, timeout=LOOPBACK_TIMEOUT):
+        self._kernel, self._server = socketpair(AF_UNIX, SOCK_SEQPACKET)
+        self._kernel.settimeout(timeout)
+        self._codec = Operations(LOGGER, protocol, {})
+        self._opcodes = protocol['opcodes']
+        self._bufsize = bufsize
+        self._unique = 0
+        self.fd = self._server.fileno()
+        return None
+    def encode(self, opcode_name, fields, nodeid=ROOT_INODE, uid=0, gid=0, pid=0):
+        '''
+        Build a request frame, returning its unique value and the frame.
+        '''
+        opcode = self._opcodes[opcode_name]
+        body = self._codec.format_input(opcode, fields)
+        self._unique = self._unique + 1
+        header = Header(opcode, self._unique, nodeid, uid, gid, pid)
+        frame = format_header_req(header, len(body)) + body
+        if len(frame) > self._bufsize:
+            raise ValueError(
+                f'Request of {len(frame)} bytes exceeds the buffer size {self._bufsize}'
+                )
+        return self._unique, frame
+    def send(self, frame):
+        '''
+        Deliver a request frame to the server.
+        '''
+        self._kernel.send(frame)
+        return None
+    def request(self, opcode_name, fields, **kwargs):
+        '''
+        Encode and deliver a request, returning its unique value.
+        '''
+        unique, frame = self.encode(opcode_name, fields, **kwargs)
+        self.send(frame)
+        return unique
+    def recv(self):
+        '''
+        Wait for a reply, returning unique value, errno and body. Replies
+        spliced into the socket can arrive in several packets, which are
+        joined up to the length given in the reply header; the server sends
+        one reply at a time.
+        '''
+        recvsize = self._bufsize + HEADER_SIZE_SEND # READ replies of bufsize bytes
+        reply = self._kernel.recv(recvsize)
+        if len(reply) < HEADER_SIZE_SEND:
+            raise RuntimeError(f'Short reply of {len(reply)} bytes', reply)
+        total = int.from_bytes(reply[:4], BYTEORDER)
+        while len(reply) < total:
+            reply = reply + self._kernel.recv(recvsize)
+        errno = -int.from_bytes(reply[4:8], BYTEORDER, signed=True)
+        unique = int.from_bytes(reply[8:16], BYTEORDER)
+        return unique, errno, reply[HEADER_SIZE_SEND:]
+    def parse_reply(self, opcode_name, body):
+        '''
+        Decode a reply body for inspection.
+        '''
+        return self._codec.parse_output(self._opcodes[opcode_name], body)
+    def close(self):
+        '''
+        Hang up, which the server's receive loop sees as an unmount.
+        '''
+        self._kernel.close()
+        return None
+    def close_server(self):
+        self._server.close()
+        return None
+
+def _run_quietly(loop_function):
+    try:
+        loop_function()
+    except FUSEUnmountError:
+        pass
+    return None
+
+class LoopbackServer():
+    '''
+    A Sinter and an Operations instance serving a FakeKernel from a
+    background thread, laid out like pysinter.__main__ but with the receive
+    and send loops on their own threads.
+    '''
+    def __init__(self, kernel, protocol, handlers, bufsize=LOOPBACK_BUFFER_SIZE, logger=LOGGER, trace=None, metrics=None, splice=False, interruptible=False, **kwargs):
+        self._kernel = kernel
+        self._splice = splice
+        self._interruptible = interruptible
+        self._trace = trace
+        self._metrics = metrics
+        self._protocol = protocol
+        self._handlers = handlers
+        self._bufsize = bufsize
+        self._logger = logger
+        self._kwargs = kwargs
+        self._started = None
+        self._stop = None
+        self._loop = None
+        self.operations = None
+        self.sinter = None
+        self._thread = None
+        return None
+    async def _serve(self):
+        from asyncio import Event, create_task, get_running_loop
+        self._loop = get_running_loop()
+        self._stop = Event()
+        s = Sinter(
+            fd=self._kernel.fd
+            , bufsize=self._bufsize
+            , trace=self._trace
+            , metrics=self._metrics
+            , splice=self._splice
+            , interruptible=self._interruptible
+            )
+        ops = Operations(self._logger, self._protocol, self._handlers, metrics=self._metrics, **self._kwargs)
+        self.sinter = s
+        self.operations = ops
+        threads = (
+            Thread(target=_run_quietly, args=(s.recv_loop,), daemon=True)
+            , Thread(target=_run_quietly, args=(s.send_loop,), daemon=True)
+            )
+        for thread in threads:
+            thread.start()
+        task = create_task(ops.operate(s.rx_async, s.tx_async))
+        self._started.set()
+        await self._stop.wait()
+        ops.active = False
+        task.cancel()
+        s.receiving = False
+        s.sending = False
+        await s.tx_async.put((None, 0, None))
+        return None
+    def start(self):
+        from asyncio import run
+        from threading import Event
+        self._started = Event()
+        self._thread = Thread(target=run, args=(self._serve(),), daemon=True)
+        self._thread.start()
+        if not self._started.wait(LOOPBACK_TIMEOUT):
+            raise RuntimeError('Loopback server did not start')
+        return self
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join(LOOPBACK_TIMEOUT)
+        self._kernel.close()
+        return None
+    def __enter__(self):
+        return self.start()
+    def __exit__(self, *exc):
+        self.stop()
+        return None
+
+BENCH_FILE_SIZE = 1 << 24
+BENCH_DIR_ENTRIES = 100000
+BENCH_INODE_DIR = ROOT_INODE
+BENCH_INODE_FILE = ROOT_INODE + 1
+BENCH_ATTR_FILE = FrozenReply({'attr': {
+    'ino': BENCH_INODE_FILE
+    , 'size': BENCH_FILE_SIZE
+    , 'timeandmode': {'mode': S_IFREG | 0o644}
+    , 'blksize': 4096
+    , 'nlink': 1
+    }})
+BENCH_ATTR_DIR = FrozenReply({'attr': {
+    'ino': BENCH_INODE_DIR
+    , 'timeandmode': {'mode': S_IFDIR | 0o755}
+    , 'blksize': 4096
+    , 'nlink': 2
+    }})
+DIRENT_SIZE = 24
+
+def mk_bench_handlers(filesize=BENCH_FILE_SIZE, direntries=BENCH_DIR_ENTRIES):
+    '''
+    Synthetic handlers doing as little work as possible, so that the framework
+    dominates the measurements: one directory with many files that all share
+    one inode, backed by one preallocated buffer.
+    '''
+    content = memoryview(bytes(filesize))
+    names = [f'file{num:08d}'.encode() for num in range(direntries)]
+    async def bench_lookup(header, parsed):
+        if header.nodeid != BENCH_INODE_DIR:
+            raise FUSEError(ENOENT)
+        return 0, {'entry': [{**BENCH_ATTR_FILE, 'nodeId': BENCH_INODE_FILE}]}
+    async def bench_getattr(header, parsed):
+        if header.nodeid == BENCH_INODE_DIR:
+            return 0, BENCH_ATTR_DIR
+        return 0, BENCH_ATTR_FILE
+    async def bench_open(header, parsed):
+        return 0, {'fh': 1}
+    async def bench_read(header, parsed):
+        offset = parsed['offset']
+        return 0, {'data': content[offset:offset + parsed['size']]}
+    async def bench_write(header, parsed):
+        return 0, {'size': len(parsed['data'])}
+    async def bench_readdir(header, parsed):
+        cookie = parsed['cookie']
+        remaining = parsed['size']
+        entries = []
+        for num in range(cookie, len(names)):
+            name = names[num]
+            entsize = (DIRENT_SIZE + len(name) + 7) & ~7
+            if entsize > remaining:
+                break
+            remaining = remaining - entsize
+            entries.append({
+                'ino': BENCH_INODE_FILE
+                , 'cookie': num + 1
+                , 'namelen': len(name)
+                , 'type': S_IFREG >> 12
+                , 'name': name
+                })
+        return 0, {'data': entries}
+    return {
+        'FUSE_INIT': mk_dyn_negotiate()
+        , 'FUSE_LOOKUP': bench_lookup
+        , 'FUSE_GETATTR': bench_getattr
+        , 'FUSE_OPEN': bench_open
+        , 'FUSE_OPENDIR': bench_open
+        , 'FUSE_READ': bench_read
+        , 'FUSE_WRITE': bench_write
+        , 'FUSE_READDIR': bench_readdir
+        , 'FUSE_RELEASE': dyn_nop
+        , 'FUSE_RELEASEDIR': dyn_nop
+        , 'FUSE_FLUSH': dyn_nop
+        }
+
+def _lookup_request(seq, rand, state):
+    return BENCH_INODE_DIR, {'name': b'file%08d' % rand.randrange(state.get('direntries', BENCH_DIR_ENTRIES))}
+def _getattr_request(seq, rand, state):
+    return BENCH_INODE_FILE, {}
+def _read_request(seq, rand, state):
+    size = state.get('iosize', 1 << 17)
+    offset = state.get('read_offset', 0)
+    if offset + size > state.get('filesize', BENCH_FILE_SIZE):
+        offset = 0
+    state['read_offset'] = offset + size
+    return BENCH_INODE_FILE, {'fh': 1, 'offset': offset, 'size': size}
+def _write_request(seq, rand, state):
+    size = state.get('writesize', 4096)
+    offset = state.get('write_offset', 0)
+    state['write_offset'] = offset + size
+    data = state.get('write_data')
+    if data is None or len(data) != size:
+        data = state['write_data'] = bytes(size)
+    return BENCH_INODE_FILE, {
+        'fh': 1
+        , 'offset': offset
+        , 'size': size
+        , 'data': data
+        }
+def _readdir_request(seq, rand, state):
+    cookie = state.get('cookie', 0)
+    size = state.get('readdirsize', 1 << 15)
+    # Each entry takes 40 bytes with the bench names, skip ahead accordingly
+    nextcookie = cookie + size // 40
+    state['cookie'] = 0 if nextcookie >= state.get('direntries', BENCH_DIR_ENTRIES) else nextcookie
+    return BENCH_INODE_DIR, {'fh': 1, 'cookie': cookie, 'size': size}
+
+REQUEST_FACTORIES = {
+    'FUSE_LOOKUP': _lookup_request
+    , 'FUSE_GETATTR': _getattr_request
+    , 'FUSE_READ': _read_request
+    , 'FUSE_WRITE': _write_request
+    , 'FUSE_READDIR': _readdir_request
+    }
+
+WORKLOADS = {
+    'metadata': {'FUSE_LOOKUP': 1, 'FUSE_GETATTR': 2}
+    , 'sequential_read': {'FUSE_READ': 1}
+    , 'small_writes': {'FUSE_WRITE': 1}
+    , 'readdir': {'FUSE_READDIR': 1}
+    }
+
+def parse_mix(spec):
+    '''
+    A workload name or a mix given as OPCODE=weight,OPCODE=weight.
+    '''
+    if spec in WORKLOADS:
+        return dict(WORKLOADS[spec])
+    res = {}
+    for item in spec.split(','):
+        name, _, weight = item.partition('=')
+        name = name.strip()
+        if not name.startswith('FUSE_'):
+            name = 'FUSE_' + name.upper()
+        if name not in REQUEST_FACTORIES:
+            raise ValueError('No request generator for opcode', name)
+        res[name] = float(weight) if weight else 1.0
+    return res
+
+def generate_requests(mix, count, seed=0, state=None):
+    '''
+    Yield (opcode name, nodeid, fields) following the weighted opcode mix.
+    '''
+    rand = Random(seed)
+    state = {} if state is None else state
+    names = tuple(mix)
+    weights = tuple(mix[name] for name in names)
+    for seq, name in enumerate(rand.choices(names, weights=weights, k=count)):
+        nodeid, fields = REQUEST_FACTORIES[name](seq, rand, state)
+        yield name, nodeid, fields
+
+def percentile(ordered, fraction):
+    '''
+    Nearest-rank percentile of a sorted sequence.
+    '''
+    if not ordered:
+        return 0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered))) - 1))
+    return ordered[index]
+
+def drive(kernel, requests, depth=16):
+    '''
+    Keep up to depth requests outstanding until all requests are answered.
+    Returns the elapsed time, per-request latencies in nanoseconds by opcode
+    and error counts by errno.
+    '''
+    frames = [
+        (name, kernel.encode(name, fields, nodeid=nodeid))
+        for name, nodeid, fields in requests
+        ]
+    pending = {}
+    latencies = {}
+    errors = {}
+    position = 0
+    t_start = perf_counter()
+    while position < len(frames) or pending:
+        while position < len(frames) and len(pending) < depth:
+            name, (unique, frame) = frames[position]
+            position = position + 1
+            pending[unique] = (name, perf_counter_ns())
+            kernel.send(frame)
+        unique, errno, _ = kernel.recv()
+        t_reply = perf_counter_ns()
+        name, t_sent = pending.pop(unique)
+        latencies.setdefault(name, []).append(t_reply - t_sent)
+        if errno:
+            errors[errno] = errors.get(errno, 0) + 1
+    return perf_counter() - t_start, latencies, errors
+
+def summarize(elapsed, latencies, errors):
+    '''
+    Throughput and latency percentiles (in microseconds), overall and per
+    opcode.
+    '''
+    def stats(values):
+        ordered = sorted(values)
+        return {
+            'count': len(ordered)
+            , 'p50_us': percentile(ordered, 0.5) / 1000
+            , 'p90_us': percentile(ordered, 0.9) / 1000
+            , 'p99_us': percentile(ordered, 0.99) / 1000
+            , 'p999_us': percentile(ordered, 0.999) / 1000
+            , 'max_us': (ordered[-1] / 1000) if ordered else 0
+            }
+    total = [value for values in latencies.values() for value in values]
+    res = stats(total)
+    res['seconds'] = elapsed
+    res['ops_per_sec'] = (len(total) / elapsed) if elapsed else 0
+    res['errors'] = dict(errors)
+    res['opcodes'] = {name: stats(values) for name, values in latencies.items()}
+    return res
+
+def run_workload(protocol, mix, handlers=None, count=10000, depth=16, seed=0, bufsize=LOOPBACK_BUFFER_SIZE, state=None, direntries=BENCH_DIR_ENTRIES, **kwargs):
+    '''
+    Serve handlers (by default the synthetic benchmark handlers) over a fake
+    kernel, negotiate with FUSE_INIT, run count requests of the given mix and
+    summarize the results. Lookups and directory reads stay within the first
+    direntries names, as the handlers were built with. Further keyword
+    arguments go to LoopbackServer and from there to Operations.
+    '''
+    if handlers is None:
+        handlers = mk_bench_handlers(direntries=direntries)
+    state = {} if state is None else state
+    state.setdefault('direntries', direntries)
+    if isinstance(mix, str):
+        mix = parse_mix(mix)
+    kernel = FakeKernel(protocol, bufsize=bufsize)
+    with LoopbackServer(kernel, protocol, handlers, bufsize=bufsize, **kwargs):
+        kernel.request('FUSE_INIT', {'major': 7, 'minor': 31})
+        _, errno, _ = kernel.recv()
+        if errno:
+            raise FUSEError(errno, 'FUSE_INIT failed over loopback')
+        requests = generate_requests(mix, count, seed=seed, state=state)
+        res = summarize(*drive(kernel, requests, depth=depth))
+    kernel.close_server()
+    return res
@@ -0,0 +1,281 @@
+'''
+Memory accounting for long running servers: live counts and estimated sizes
+of the framework's own structures, and allocations attributed to opcode
+handlers with tracemalloc.
+
+Components report their structures with a memory_stats() method returning
+{structure: {'count': ..., 'bytes': ...}}; Operations, Sinter and the
+passthrough example do. MemoryAccounting collects them under a name each,
+next to the process's resident size, and can be queried at any time, by
+signal or through pysinter.metrics gauges.
+
+Sizes are estimates: containers are measured from a sample of their items,
+and loggers, classes, functions and modules are counted by their own size
+only, as they are shared.
+
+AllocationTracker attributes traced allocations to the opcode whose handler
+is the closest frame to the allocation, in the handler's own code or code
+nested in it. Diffs between snapshots show what the handlers allocated and
+kept since the last one; allocations nowhere near a handler count as other.
+'''
+
+from collections import deque
+from dis import findlinestarts
+from inspect import unwrap
+from json import dumps
+from logging import Logger, getLogger
+from os import getpid, replace, sysconf
+from sys import getsizeof
+from types import BuiltinFunctionType, FunctionType, MethodType, ModuleType
+import tracemalloc
+
+DEFAULT_SAMPLE = 64
+DEFAULT_DEPTH = 4
+DEFAULT_FRAMES = 16
+DEFAULT_TOP = 5
+OTHER = 'other'
+_SCALARS = (str, bytes, bytearray, memoryview, int, float, bool, type(None))
+_OPAQUE = (Logger, type, ModuleType, FunctionType, MethodType, BuiltinFunctionType)
+
+def deep_size(obj, sample=DEFAULT_SAMPLE, depth=DEFAULT_DEPTH, seen=None):
+    '''
+    Estimated bytes of obj and the objects it references, down to depth
+    levels. Containers of more than sample items are measured from their
+    first sample items and extrapolated. Objects whose ids are in seen are
+    not counted again; pass one set to several calls to count shared
+    objects once.
+    '''
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = getsizeof(obj)
+    if depth <= 0 or isinstance(obj, _SCALARS) or isinstance(obj, _OPAQUE):
+        return size
+    if isinstance(obj, dict):
+        items = obj.items()
+    elif isinstance(obj, (list, tuple, set, frozenset, deque)):
+        items = obj
+    elif hasattr(obj, '__dict__'):
+        return size + deep_size(vars(obj), sample, depth - 1, seen)
+    else:
+        slots = getattr(type(obj), '__slots__', ())
+        return size + sum(
+            deep_size(getattr(obj, name, None), sample, depth - 1, seen)
+            for name in ((slots,) if isinstance(slots, str) else slots)
+            )
+    total = len(obj)
+    measured = 0
+    num = 0
+    for item in items:
+        if num == sample:
+            break
+        measured = measured + deep_size(item, sample, depth - 1, seen)
+        num = num + 1
+    if num:
+        size = size + measured * total // num
+    return size
+
+def usage(count, nbytes):
+    return {'count': count, 'bytes': nbytes}
+
+def process_memory():
+    '''
+    Resident and virtual size of this process, and what tracemalloc traces.
+    '''
+    res = {}
+    try:
+        with open('/proc/self/statm') as handle:
+            virtual, resident = handle.read().split()[:2]
+        pagesize = sysconf('SC_PAGE_SIZE')
+        res['rss_bytes'] = int(resident) * pagesize
+        res['vms_bytes'] = int(virtual) * pagesize
+    except OSError:
+        from resource import getrusage, RUSAGE_SELF
+        res['max_rss_bytes'] = getrusage(RUSAGE_SELF).ru_maxrss * 1024
+    if tracemalloc.is_tracing():
+        res['traced_bytes'], res['traced_peak_bytes'] = tracemalloc.get_traced_memory()
+    return res
+
+def logger_stats(logger):
+    '''
+    The loggers below logger, as created for every formatter.
+    '''
+    prefix = logger.name + '.'
+    children = [
+        child for name, child in list(logger.manager.loggerDict.items())
+        if name.startswith(prefix) and isinstance(child, Logger)
+        ]
+    return usage(
+        len(children)
+        , sum(getsizeof(child) + getsizeof(vars(child)) for child in children)
+        )
+
+class MemoryAccounting():
+    '''
+    Memory stats of named sources: objects with a memory_stats() method or
+    callables returning the same.
+    '''
+    def __init__(self, **sources):
+        self._sources = dict(sources)
+        return None
+    def add(self, name, source):
+        self._sources[name] = source
+        return None
+    def snapshot(self):
+        res = {'process': process_memory()}
+        for name, source in self._sources.items():
+            stats = source.memory_stats() if hasattr(source, 'memory_stats') else source()
+            res[name] = stats
+        return res
+    def totals(self):
+        '''
+        Estimated bytes per source.
+        '''
+        snapshot = self.snapshot()
+        del snapshot['process']
+        return {
+            name: sum(stats['bytes'] for stats in structures.values())
+            for name, structures in snapshot.items()
+            }
+    def register_gauges(self, metrics):
+        '''
+        Report the resident size and the estimated bytes per source in
+        pysinter.metrics.Metrics snapshots. Every snapshot measures anew.
+        '''
+        metrics.gauge('memory_rss_bytes', lambda: process_memory().get('rss_bytes', 0))
+        for name in self._sources:
+            metrics.gauge(f'memory_{name}_bytes', lambda name=name: self.totals()[name])
+        return None
+
+def _handler_code(handler):
+    function = unwrap(getattr(handler, '__func__', handler))
+    function = getattr(function, '__func__', function)
+    return getattr(function, '__code__', None)
+
+class AllocationTracker():
+    '''
+    Attribute tracemalloc traces to the handlers of an Operations instance.
+    Tracing costs time and memory for every allocation, so it only runs
+    between start() and stop().
+    '''
+    def __init__(self, operations, frames=DEFAULT_FRAMES):
+        self._frames = frames
+        self._started = False # Whether tracemalloc was started here
+        self._active = False
+        self._last = None
+        names_by_code = {}
+        for opcode, handler in operations._action_by_opcode.items():
+            code = None if handler is None else _handler_code(handler)
+            if code is not None:
+                names_by_code.setdefault(code, []).append(operations._opcode_value_to_name.get(opcode, str(opcode)))
+        self._ranges = {} # filename -> [(first line, last line, name)]
+        for code, names in names_by_code.items():
+            lines = [line for _, line in findlinestarts(code) if line is not None] # co_lines() needs 3.10
+            last = max(lines, default=code.co_firstlineno)
+            self._ranges.setdefault(code.co_filename, []).append((code.co_firstlineno, last, '|'.join(sorted(names))))
+        return None
+    @property
+    def tracing(self):
+        return self._active
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self._frames)
+            self._started = True
+        self._active = True
+        self._last = self._take()
+        return None
+    def stop(self):
+        if self._started:
+            tracemalloc.stop()
+            self._started = False
+        self._active = False
+        self._last = None
+        return None
+    def _take(self):
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__)
+            , tracemalloc.Filter(False, __file__)
+            ))
+    def _name(self, traceback):
+        for frame in reversed(traceback): # Most recent first
+            for first, last, name in self._ranges.get(frame.filename, ()):
+                if first <= frame.lineno <= last:
+                    return name
+        return OTHER
+    def _attribute(self, statistics, top):
+        res = {}
+        for stat in statistics:
+            size = getattr(stat, 'size_diff', stat.size)
+            count = getattr(stat, 'count_diff', stat.count)
+            if not size and not count:
+                continue
+            name = self._name(stat.traceback)
+            entry = res.get(name)
+            if entry is None:
+                entry = res[name] = {'bytes': 0, 'count': 0, 'sites': {}}
+            entry['bytes'] = entry['bytes'] + size
+            entry['count'] = entry['count'] + count
+            frame = stat.traceback[-1]
+            site = f'{frame.filename}:{frame.lineno}'
+            entry['sites'][site] = entry['sites'].get(site, 0) + size
+        for entry in res.values():
+            sites = sorted(entry['sites'].items(), key=lambda item: -abs(item[1]))
+            entry['sites'] = dict(sites[:top])
+        return dict(sorted(res.items(), key=lambda item: -abs(item[1]['bytes'])))
+    def snapshot(self, top=DEFAULT_TOP):
+        '''
+        Bytes and blocks currently traced per opcode, with the top
+        allocation sites, largest first. Becomes the base of the next diff.
+        '''
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('Allocation tracking is not started')
+        self._last = self._take()
+        return self._attribute(self._last.statistics('traceback'), top)
+    def diff(self, top=DEFAULT_TOP):
+        '''
+        Growth in bytes and blocks per opcode since the last snapshot or
+        diff, largest changes first.
+        '''
+        if not tracemalloc.is_tracing():
+            raise RuntimeError('Allocation tracking is not started')
+        current = self._take()
+        previous = self._last
+        self._last = current
+        if previous is None:
+            return self._attribute(current.statistics('traceback'), top)
+        return self._attribute(current.compare_to(previous, 'traceback'), top)
+
+def write_memory_report(accounting, path, tracker=None):
+    '''
+    Write the accounting snapshot and, if tracking, the allocation diff as
+    JSON, replacing the file atomically.
+    '''
+    report = accounting.snapshot()
+    if tracker is not None and tracker.tracing:
+        report['allocations'] = tracker.diff()
+    tmppath = f'{path}.{getpid()}.tmp'
+    with open(tmppath, 'w') as handle:
+        handle.write(dumps(report, indent=1, default=str))
+    replace(tmppath, path)
+    return None
+
+def install_memory_signal(accounting, signum, path, tracker=None):
+    '''
+    Write a memory report to path on every delivery of the signal. With a
+    tracker, the first delivery starts allocation tracking and later ones
+    report the growth since the one before.
+    Must be called from within the running event loop.
+    '''
+    from asyncio import get_running_loop
+    def report():
+        if tracker is not None and not tracker.tracing:
+            tracker.start()
+        try:
+            write_memory_report(accounting, path, tracker=tracker)
+        except OSError:
+            getLogger(__name__).exception('Writing the memory report to %s failed', path)
+        return None
+    get_running_loop().add_signal_handler(signum, report)
+    return None
@@ -0,0 +1,259 @@
+'''
+Request metrics for Sinter and Operations: per-opcode counters, latency
+histograms per phase, in-flight gauges and error counts by errno.
+
+Phases, all in nanoseconds:
+- queue: from Sinter reading the request to Operations picking it up
+- handler: the handler call, including any time it spends awaiting
+- format: encoding the reply
+- write: writing the reply to the FUSE fd
+
+Each histogram is only written from one thread (the event loop thread, or
+Sinter's sending thread for the write phase), so no locking is done.
+'''
+
+from errno import errorcode
+from os import replace, getpid
+from threading import Thread, Event
+from time import perf_counter_ns
+
+HISTOGRAM_SUB_BITS = 5
+HISTOGRAM_LINEAR = 1 << HISTOGRAM_SUB_BITS
+HISTOGRAM_HALF = HISTOGRAM_LINEAR >> 1
+SNAPSHOT_QUANTILES = (0.5, 0.9, 0.99, 0.999)
+PHASES = ('queue', 'handler', 'format', 'write')
+
+def _bucket_index(value):
+    if value < HISTOGRAM_LINEAR:
+        return value if value > 0 else 0
+    exponent = value.bit_length() - HISTOGRAM_SUB_BITS
+    mantissa = value >> exponent
+    return HISTOGRAM_LINEAR + (exponent - 1) * HISTOGRAM_HALF + mantissa - HISTOGRAM_HALF
+
+def _bucket_bounds(index):
+    if index < HISTOGRAM_LINEAR:
+        return index, index
+    exponent, mantissa = divmod(index - HISTOGRAM_LINEAR, HISTOGRAM_HALF)
+    exponent = exponent + 1
+    mantissa = mantissa + HISTOGRAM_HALF
+    return mantissa << exponent, ((mantissa + 1) << exponent) - 1
+
+class Histogram():
+    '''
+    A log-linear histogram in the manner of HdrHistogram: exact below 32,
+    then 16 buckets per power of two, for a relative error below 7%.
+    '''
+    __slots__ = ('_counts', 'count', 'total', 'max')
+    def __init__(self):
+        self._counts = []
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        return None
+    def record(self, value):
+        index = _bucket_index(value)
+        counts = self._counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] = counts[index] + 1
+        self.count = self.count + 1
+        self.total = self.total + value
+        if value > self.max:
+            self.max = value
+        return None
+    def quantile(self, fraction):
+        '''
+        Approximate value below which the given fraction of samples lies.
+        '''
+        if not self.count:
+            return 0
+        threshold = fraction * self.count
+        seen = 0
+        for index, num in enumerate(self._counts):
+            seen = seen + num
+            if num and seen >= threshold:
+                low, high = _bucket_bounds(index)
+                return min((low + high) // 2, self.max)
+        return self.max
+    def snapshot(self):
+        res = {
+            'count': self.count
+            , 'sum': self.total
+            , 'max': self.max
+            }
+        for fraction in SNAPSHOT_QUANTILES:
+            res[f'p{fraction * 100:g}'] = self.quantile(fraction)
+        return res
+
+class _OpcodeMetrics():
+    __slots__ = ('requests', 'errors', 'phases')
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.phases = {phase: Histogram() for phase in PHASES}
+        return None
+
+class Metrics():
+    '''
+    Collects request metrics. Pass the same instance to Sinter and Operations
+    to get all phases.
+    '''
+    def __init__(self):
+        self._opcodes = {}
+        self._errors = {}
+        self._names = {}
+        self._gauges = {}
+        self.inflight = 0
+        self.inflight_max = 0
+        return None
+    def _opcode(self, opcode):
+        res = self._opcodes.get(opcode)
+        if res is None:
+            res = self._opcodes[opcode] = _OpcodeMetrics()
+        return res
+    def set_names(self, names):
+        '''
+        Opcode value to name mapping for reports.
+        '''
+        self._names.update(names)
+        return None
+    def gauge(self, name, function):
+        '''
+        Register a callable sampled on every snapshot.
+        '''
+        self._gauges[name] = function
+        return None
+    def begin(self, header):
+        '''
+        A request is picked up for processing. Returns the start timestamp.
+        '''
+        now = perf_counter_ns()
+        opmetrics = self._opcode(header.opcode)
+        opmetrics.requests = opmetrics.requests + 1
+        received = header.received
+        if received:
+            opmetrics.phases['queue'].record(now - received)
+        inflight = self.inflight = self.inflight + 1
+        if inflight > self.inflight_max:
+            self.inflight_max = inflight
+        return now
+    def observe(self, opcode, phase, duration):
+        self._opcode(opcode).phases[phase].record(duration)
+        return None
+    def end(self, opcode, errno):
+        '''
+        A request is done, successfully if errno is 0.
+        '''
+        self.inflight = self.inflight - 1
+        if errno:
+            self._opcode(opcode).errors = self._opcode(opcode).errors + 1
+            self._errors[errno] = self._errors.get(errno, 0) + 1
+        return None
+    def snapshot(self):
+        '''
+        A plain dictionary of all current values, latencies in nanoseconds.
+        '''
+        return {
+            'opcodes': {
+                self._names.get(opcode, opcode): {
+                    'requests': opmetrics.requests
+                    , 'errors': opmetrics.errors
+                    , 'phases': {
+                        phase: hist.snapshot()
+                        for phase, hist in opmetrics.phases.items()
+                        if hist.count
+                        }
+                    }
+                for opcode, opmetrics in list(self._opcodes.items())
+                }
+            , 'errors': {
+                errorcode.get(errno, str(errno)): num
+                for errno, num in list(self._errors.items())
+                }
+            , 'inflight': self.inflight
+            , 'inflight_max': self.inflight_max
+            , 'gauges': {
+                name: function()
+                for name, function in list(self._gauges.items())
+                }
+            }
+
+def _labels(**labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels.items())
+
+def format_prometheus(snapshot, prefix='pysinter'):
+    '''
+    Render a Metrics snapshot in the Prometheus text exposition format.
+    Latencies become summaries in seconds.
+    '''
+    lines = [
+        f'# HELP {prefix}_requests_total Requests processed, by opcode.'
+        , f'# TYPE {prefix}_requests_total counter'
+        ]
+    opcodes = snapshot['opcodes']
+    for name, opmetrics in opcodes.items():
+        lines.append(f'{prefix}_requests_total{{{_labels(opcode=name)}}} {opmetrics["requests"]}')
+    lines.append(f'# HELP {prefix}_request_errors_total Requests answered with an error, by opcode.')
+    lines.append(f'# TYPE {prefix}_request_errors_total counter')
+    for name, opmetrics in opcodes.items():
+        lines.append(f'{prefix}_request_errors_total{{{_labels(opcode=name)}}} {opmetrics["errors"]}')
+    lines.append(f'# HELP {prefix}_phase_seconds Request latency by opcode and phase.')
+    lines.append(f'# TYPE {prefix}_phase_seconds summary')
+    for name, opmetrics in opcodes.items():
+        for phase, hist in opmetrics['phases'].items():
+            for fraction in SNAPSHOT_QUANTILES:
+                value = hist[f'p{fraction * 100:g}'] / 1e9
+                labels = _labels(opcode=name, phase=phase, quantile=fraction)
+                lines.append(f'{prefix}_phase_seconds{{{labels}}} {value:.9f}')
+            labels = _labels(opcode=name, phase=phase)
+            lines.append(f'{prefix}_phase_seconds_sum{{{labels}}} {hist["sum"] / 1e9:.9f}')
+            lines.append(f'{prefix}_phase_seconds_count{{{labels}}} {hist["count"]}')
+    lines.append(f'# HELP {prefix}_errors_total Error replies by errno.')
+    lines.append(f'# TYPE {prefix}_errors_total counter')
+    for errname, num in snapshot['errors'].items():
+        lines.append(f'{prefix}_errors_total{{{_labels(errno=errname)}}} {num}')
+    lines.append(f'# TYPE {prefix}_inflight gauge')
+    lines.append(f'{prefix}_inflight {snapshot["inflight"]}')
+    lines.append(f'# TYPE {prefix}_inflight_max gauge')
+    lines.append(f'{prefix}_inflight_max {snapshot["inflight_max"]}')
+    for gname, value in snapshot['gauges'].items():
+        lines.append(f'# TYPE {prefix}_{gname} gauge')
+        lines.append(f'{prefix}_{gname} {value}')
+    return '\n'.join(lines) + '\n'
+
+def write_prometheus(metrics, path, prefix='pysinter'):
+    '''
+    Write a snapshot for the node exporter's text file collector, replacing
+    the file atomically.
+    '''
+    tmppath = f'{path}.{getpid()}.tmp'
+    with open(tmppath, 'w') as handle:
+        handle.write(format_prometheus(metrics.snapshot(), prefix=prefix))
+    replace(tmppath, path)
+    return None
+
+class PrometheusExporter():
+    '''
+    Rewrite a Prometheus text file from a background thread at a fixed
+    interval.
+    '''
+    def __init__(self, metrics, path, interval=15, prefix='pysinter'):
+        self._metrics = metrics
+        self._path = path
+        self._interval = interval
+        self._prefix = prefix
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, daemon=True)
+        return None
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            write_prometheus(self._metrics, self._path, prefix=self._prefix)
+        return None
+    def start(self):
+        self._thread.start()
+        return self
+    def stop(self):
+        self._stopped.set()
+        self._thread.join()
+        write_prometheus(self._metrics, self._path, prefix=self._prefix)
+        return None
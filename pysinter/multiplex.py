@@ -0,0 +1,235 @@
+'''
+Serving many FUSE mounts from one process and one event loop.
+
+A Sinter per mount brings a receive and a send thread, and an Operations
+instance per mount its own formatters and struct plans. Multiplexer instead
+polls all FUSE fds from the event loop with add_reader and writes replies
+straight from it, reading into one shared buffer. Every mount has its own
+handler set and pysinter.metrics.Metrics, while formatters, struct plans and
+the reply cache are compiled once for the protocol and shared by all mounts.
+Handlers that block should go to an executor, as with a single mount.
+
+Requests have to fit into the buffer in one read, which /dev/fuse ensures
+for buffers of at least max_write plus a page. Tracing and splicing are not
+supported here.
+'''
+
+from asyncio import Event as AsyncEvent, create_task, get_running_loop
+from errno import EAGAIN, ENODEV, ENOENT
+from os import get_blocking, set_blocking, readv, writev
+from threading import Event
+from time import perf_counter_ns
+
+from pysinter import (
+    FileSlice, parse_header_req, frombytes
+    , HEADER_SIZE_RECV, HEADER_SIZE_SEND, HEADER_STRUCT_SEND, MINIMUM_BUFFER_SIZE
+    )
+from pysinter.dynamic import Operations
+from pysinter.metrics import Metrics
+
+DEFAULT_BUFFER_SIZE = 1 << 17
+READ_BATCH = 32 # Requests read from one mount before the others get a turn
+START_TIMEOUT = 10
+
+class _Mount():
+    '''
+    One FUSE fd, its handlers and the replies waiting for it to become
+    writable. Operations calls put() with each reply like on a Sinter's TX
+    queue.
+    '''
+    __slots__ = ('name', 'fd', 'operations', 'metrics', 'backlog', 'closed', 'requests', 'blocking', '_mux', '_sendbuf')
+    def __init__(self, mux, name, fd, operations, metrics):
+        self._mux = mux
+        self.name = name
+        self.fd = fd
+        self.operations = operations
+        self.metrics = metrics
+        self.backlog = []
+        self.closed = False
+        self.requests = 0
+        self.blocking = get_blocking(fd)
+        self._sendbuf = bytearray(HEADER_SIZE_SEND)
+        return None
+    async def put(self, reply):
+        header, errno, msg = reply
+        if msg is None or self.closed:
+            return None
+        if isinstance(msg, FileSlice):
+            msg = msg.read()
+        if self.backlog:
+            self.backlog.append((header.unique, errno, msg))
+            return None
+        metrics = self.metrics
+        if metrics is not None:
+            t_start = perf_counter_ns()
+        if not self._write(header.unique, errno, msg):
+            self.backlog.append((header.unique, errno, msg))
+            self._mux._loop.add_writer(self.fd, self.flush)
+            return None
+        if metrics is not None:
+            metrics.observe(header.opcode, 'write', perf_counter_ns() - t_start)
+        return None
+    def _write(self, unique, errno, msg):
+        '''
+        Whether the reply was written, False if the fd would block. ENOENT
+        means the request was interrupted meanwhile and the reply dropped.
+        '''
+        sendbuf = self._sendbuf
+        HEADER_STRUCT_SEND.pack_into(sendbuf, 0, HEADER_SIZE_SEND + len(msg), -errno, unique)
+        try:
+            writev(self.fd, (sendbuf, msg))
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            if e.errno != ENOENT:
+                self._mux._gone(self, e)
+        return True
+    def flush(self):
+        '''
+        Write the backlog while the fd takes it.
+        '''
+        backlog = self.backlog
+        while backlog and not self.closed:
+            if not self._write(*backlog[0]):
+                return None
+            backlog.pop(0)
+        backlog.clear()
+        self._mux._loop.remove_writer(self.fd)
+        return None
+
+class Multiplexer():
+    '''
+    Serves FUSE fds added with add() from the event loop running serve().
+    Further keyword arguments go to every mount's Operations, e.g. a
+    single_flight map; a dispatcher must not be shared between mounts.
+    '''
+    def __init__(self, protocol, logger, bufsize=DEFAULT_BUFFER_SIZE, reply_cache_size=128):
+        if bufsize < MINIMUM_BUFFER_SIZE:
+            raise ValueError(
+                f"Buffer size must be at least {MINIMUM_BUFFER_SIZE}"
+                )
+        self._protocol = protocol
+        self._logger = logger
+        self._codec = Operations(logger, protocol, {}, reply_cache_size=reply_cache_size)
+        self._recvbuf = bytearray(bufsize)
+        self._mounts = {}
+        self._loop = None
+        self._stop = None
+        self._started = Event()
+        self._tasks = set() # The event loop keeps only weak references
+        return None
+    def add(self, name, fd, handlers, metrics=None, **kwargs):
+        '''
+        Serve fd with the handler set under name. Call this before serve()
+        or from the event loop running it. Without metrics, the mount gets a
+        fresh Metrics instance; pass False for none.
+        '''
+        if name in self._mounts:
+            raise ValueError('Mount name already in use', name)
+        if metrics is None:
+            metrics = Metrics()
+        elif metrics is False:
+            metrics = None
+        operations = Operations(
+            self._logger.getChild(str(name))
+            , self._protocol
+            , handlers
+            , metrics=metrics
+            , codec=self._codec
+            , **kwargs
+            )
+        mount = _Mount(self, name, fd, operations, metrics)
+        if metrics is not None:
+            metrics.gauge('backlog', mount.backlog.__len__)
+        self._mounts[name] = mount
+        if self._loop is not None:
+            self._register(mount)
+        return operations
+    def _register(self, mount):
+        set_blocking(mount.fd, False)
+        self._loop.add_reader(mount.fd, self._readable, mount)
+        return None
+    def remove(self, name):
+        '''
+        Stop serving the mount, returning its fd to blocking mode. Replies
+        to requests still being handled are dropped.
+        '''
+        mount = self._mounts.pop(name)
+        mount.closed = True
+        mount.operations.active = False
+        if self._loop is not None:
+            self._loop.remove_reader(mount.fd)
+            self._loop.remove_writer(mount.fd)
+            set_blocking(mount.fd, mount.blocking)
+        return None
+    def _gone(self, mount, error):
+        if mount.closed:
+            return None
+        self._logger.info('Mount %s gone: %s', mount.name, error)
+        self.remove(mount.name)
+        return None
+    def _readable(self, mount):
+        buffer = self._recvbuf
+        metrics = mount.metrics
+        for _ in range(READ_BATCH):
+            try:
+                numread = readv(mount.fd, (buffer,))
+            except BlockingIOError:
+                return None
+            except OSError as e:
+                if e.errno == EAGAIN:
+                    return None
+                if e.errno != ENODEV:
+                    self._logger.exception('Reading from mount %s failed', mount.name)
+                return self._gone(mount, e)
+            if numread == 0: # The other end is gone, as when unmounted
+                return self._gone(mount, 'End of file on FUSE fd')
+            if numread < HEADER_SIZE_RECV or frombytes(buffer[:4]) != numread:
+                self._logger.error('Malformed request of %s bytes on mount %s', numread, mount.name)
+                return self._gone(mount, 'Malformed request')
+            header = parse_header_req(buffer)
+            if metrics is not None:
+                header.received = perf_counter_ns()
+            mount.requests = mount.requests + 1
+            task = create_task(mount.operations._complete_one(mount, header, bytes(buffer[HEADER_SIZE_RECV:numread])))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        return None
+    async def serve(self):
+        '''
+        Serve all mounts until stop() is called.
+        '''
+        self._loop = get_running_loop()
+        self._stop = AsyncEvent()
+        for mount in self._mounts.values():
+            self._register(mount)
+        self._started.set()
+        try:
+            await self._stop.wait()
+        finally:
+            for name in list(self._mounts):
+                self.remove(name)
+            self._loop = None
+            self._started.clear()
+        return None
+    def stop(self):
+        '''
+        Make serve() return. Safe to call from any thread.
+        '''
+        if not self._started.wait(START_TIMEOUT):
+            raise RuntimeError('Multiplexer is not serving')
+        self._loop.call_soon_threadsafe(self._stop.set)
+        return None
+    def mounts(self):
+        return list(self._mounts)
+    def snapshot(self):
+        '''
+        Metrics snapshots and request counts keyed by mount name.
+        '''
+        return {
+            name: {
+                'requests': mount.requests
+                , 'metrics': None if mount.metrics is None else mount.metrics.snapshot()
+                }
+            for name, mount in self._mounts.items()
+            }
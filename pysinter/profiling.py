@@ -0,0 +1,260 @@
+'''
+Profiling of selected opcodes, armed at runtime through
+Operations.arm_profiler or a signal.
+
+Each profiled request is split into the phases parse, handler and format.
+Requests are decoded lazily, so parse covers building the request view and
+reading its fields, which the handler usually does; handler covers the rest
+of the handler. Handler coroutines are only profiled while one of their own
+steps runs, so other requests interleaved on the event loop do not leak into
+the results.
+Two modes exist:
+- cprofile: one cProfile.Profile per opcode and phase, written as
+  <opcode>.<phase>.pstats
+- sample: a thread samples the event loop thread's stack while a profiled
+  phase runs, written as <opcode>.collapsed in the collapsed-stack format
+  understood by flamegraph.pl and speedscope, prefixed with opcode and phase.
+  The interpreter's switch interval is lowered to the sampling interval
+  meanwhile, otherwise the sampler rarely gets the GIL during short phases.
+'''
+
+from collections.abc import Mapping
+from os import makedirs
+from os.path import join as pjoin
+from sys import _current_frames, getswitchinterval, setswitchinterval
+from threading import Thread, Event, get_ident
+from time import monotonic
+
+PROFILE_PHASES = ('parse', 'handler', 'format')
+PROFILE_MODES = ('cprofile', 'sample')
+DEFAULT_SAMPLE_INTERVAL = 0.001
+
+class _ProfiledAwaitable():
+    '''
+    Wraps an awaitable, calling enter and leave around each of its steps.
+    '''
+    __slots__ = ('_awaitable', '_enter', '_leave')
+    def __init__(self, awaitable, enter, leave):
+        self._awaitable = awaitable
+        self._enter = enter
+        self._leave = leave
+        return None
+    def __await__(self):
+        steps = self._awaitable.__await__()
+        send_value = None
+        thrown = None
+        while True:
+            self._enter()
+            try:
+                if thrown is None:
+                    yielded = steps.send(send_value)
+                else:
+                    yielded = steps.throw(thrown)
+            except StopIteration as e:
+                return e.value
+            finally:
+                self._leave()
+            thrown = None
+            try:
+                send_value = yield yielded
+            except BaseException as e:
+                send_value = None
+                thrown = e
+
+class ProfiledRequest(Mapping):
+    '''
+    Wraps a request view, reading its fields under the parse phase.
+    '''
+    __slots__ = ('_view', '_profiler', '_opcode')
+    def __init__(self, view, profiler, opcode):
+        self._view = view
+        self._profiler = profiler
+        self._opcode = opcode
+        return None
+    def __getitem__(self, key):
+        return self._profiler.call_nested(self._opcode, 'parse', self._view.__getitem__, key)
+    def __getattr__(self, name):
+        return self._profiler.call_nested(self._opcode, 'parse', getattr, self._view, name)
+    def __iter__(self):
+        return iter(self._view)
+    def __len__(self):
+        return len(self._view)
+    def __repr__(self):
+        return repr(self._view)
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{code.co_name} ({code.co_filename}:{code.co_firstlineno})')
+        frame = frame.f_back
+    names.reverse()
+    return ';'.join(names)
+
+class OpcodeProfiler():
+    '''
+    Profiles the given opcodes for at most the given number of requests and
+    the given number of seconds, whichever ends first, then writes the
+    results to output_dir.
+    '''
+    def __init__(self, opcodes, output_dir, names, requests=None, duration=None, mode='cprofile', interval=DEFAULT_SAMPLE_INTERVAL):
+        if mode not in PROFILE_MODES:
+            raise ValueError('Unknown profiling mode', mode, PROFILE_MODES)
+        self._opcodes = frozenset(opcodes)
+        self._output_dir = output_dir
+        self._names = names
+        self._remaining = requests
+        self._deadline = None if duration is None else monotonic() + duration
+        self._mode = mode
+        self._interval = interval
+        self._profiles = {}
+        self._samples = {}
+        self._active = None
+        self._loop_thread = get_ident()
+        self._stopped = Event()
+        self._sampler = None
+        self._switchinterval = None
+        self.done = False
+        if mode == 'sample':
+            self._switchinterval = getswitchinterval()
+            setswitchinterval(min(self._switchinterval, interval))
+            self._sampler = Thread(target=self._sample_loop, daemon=True)
+            self._sampler.start()
+        return None
+    def wants(self, opcode):
+        '''
+        Whether a request of this opcode is to be profiled. Ends profiling
+        once the time budget is spent.
+        '''
+        if self.done:
+            return False
+        if self._deadline is not None and monotonic() > self._deadline:
+            self.finish()
+            return False
+        return opcode in self._opcodes
+    def _profile(self, opcode, phase):
+        key = (opcode, phase)
+        profile = self._profiles.get(key)
+        if profile is None:
+            from cProfile import Profile
+            profile = self._profiles[key] = Profile()
+        return profile
+    def _hooks(self, opcode, phase):
+        enable = disable = None
+        if self._mode == 'cprofile':
+            profile = self._profile(opcode, phase)
+            enable = profile.enable
+            disable = profile.disable
+        def enter():
+            self._loop_thread = get_ident()
+            self._active = (opcode, phase)
+            if enable is not None:
+                enable()
+        def leave():
+            if disable is not None:
+                disable()
+            self._active = None
+        return enter, leave
+    def call(self, opcode, phase, function, *args):
+        '''
+        Run a synchronous phase under the profiler.
+        '''
+        enter, leave = self._hooks(opcode, phase)
+        enter()
+        try:
+            return function(*args)
+        finally:
+            leave()
+    def call_nested(self, opcode, phase, function, *args):
+        '''
+        Run function under the phase, pausing the phase active meanwhile.
+        '''
+        active = self._active
+        if active == (opcode, phase):
+            return function(*args)
+        if active is not None:
+            self._hooks(*active)[1]()
+        try:
+            return self.call(opcode, phase, function, *args)
+        finally:
+            if active is not None:
+                self._hooks(*active)[0]()
+    def request(self, opcode, view):
+        '''
+        The view to hand to the handler, decoding fields under parse.
+        '''
+        return ProfiledRequest(view, self, opcode)
+    def wrap(self, opcode, phase, awaitable):
+        '''
+        Profile an asynchronous phase step by step.
+        '''
+        enter, leave = self._hooks(opcode, phase)
+        return _ProfiledAwaitable(awaitable, enter, leave)
+    def request_done(self, opcode):
+        '''
+        Count a profiled request against the request budget.
+        '''
+        if self._remaining is not None:
+            self._remaining = self._remaining - 1
+            if self._remaining <= 0:
+                self.finish()
+        return None
+    def _sample_loop(self):
+        stopped = self._stopped
+        samples = self._samples
+        while not stopped.wait(self._interval):
+            active = self._active
+            if active is None:
+                continue
+            frame = _current_frames().get(self._loop_thread)
+            if frame is None:
+                continue
+            stack = _collapse(frame)
+            opcode, phase = active
+            key = (opcode, f'{phase};{stack}')
+            samples[key] = samples.get(key, 0) + 1
+        return None
+    def finish(self):
+        '''
+        Stop profiling and write the results. Returns the written paths.
+        '''
+        if self.done:
+            return []
+        self.done = True
+        self._stopped.set()
+        if self._sampler is not None and self._sampler.ident != get_ident():
+            self._sampler.join()
+        if self._switchinterval is not None:
+            setswitchinterval(self._switchinterval)
+        makedirs(self._output_dir, exist_ok=True)
+        written = []
+        for (opcode, phase), profile in self._profiles.items():
+            path = pjoin(self._output_dir, f'{self._names.get(opcode, opcode)}.{phase}.pstats')
+            profile.dump_stats(path)
+            written.append(path)
+        lines_by_opcode = {}
+        for (opcode, stack), num in self._samples.items():
+            name = self._names.get(opcode, opcode)
+            lines_by_opcode.setdefault(name, []).append(f'{name};{stack} {num}')
+        for name, lines in lines_by_opcode.items():
+            path = pjoin(self._output_dir, f'{name}.collapsed')
+            with open(path, 'w') as handle:
+                handle.write('\n'.join(lines) + '\n')
+            written.append(path)
+        return written
+
+def install_profile_signal(operations, signum, opcodes, output_dir, **kwargs):
+    '''
+    Toggle profiling with a signal: the first delivery arms a profiler with
+    the given settings, the next one ends it early and writes the results.
+    Must be called from within the running event loop.
+    '''
+    from asyncio import get_running_loop
+    def toggle():
+        if operations.profiling:
+            operations.disarm_profiler()
+        else:
+            operations.arm_profiler(opcodes, output_dir, **kwargs)
+        return None
+    get_running_loop().add_signal_handler(signum, toggle)
+    return None
@@ -0,0 +1,81 @@
+'''
+Populated example messages for every opcode of a protocol description, for
+codec benchmarks and round-trip tests.
+
+Values are drawn from a seeded random generator, so the same protocol and
+seed always give the same messages. Reserved fields (padding and the like)
+stay zero and name lengths match the names, as they would on the wire.
+'''
+
+from random import Random
+
+from pysinter.dynamic import StructPlans, _replace_struct
+
+DIRECTIONS = ('request', 'response')
+RESERVED_FIELDS = frozenset(('padding', 'unused', 'unused4', 'unused5', 'dummy', 'spare'))
+SAMPLE_ENTRIES = 16
+SAMPLE_DATASIZE = 4096
+
+def _sample_name(rng):
+    return b'sample-%06d.dat' % rng.randrange(1000000)
+
+def _sample_fields(schema, rng, entries, datasize):
+    res = {}
+    for fname, fshape in schema.items():
+        if fname is None:
+            continue
+        struct = fshape.get('struct')
+        if struct:
+            zero_or_more = fshape.get('zero_or_more')
+            if zero_or_more:
+                count = entries if zero_or_more is True else min(entries, zero_or_more)
+                res[fname] = [
+                    _sample_fields(struct, rng, entries, datasize)
+                    for _ in range(count)
+                    ]
+            else:
+                res[fname] = _sample_fields(struct, rng, entries, datasize)
+            continue
+        size = fshape['size']
+        if size is None:
+            if fshape.get('cstringposition') is None and 'namelen' not in schema:
+                res[fname] = rng.randbytes(datasize)
+            else:
+                res[fname] = _sample_name(rng)
+        elif fname in RESERVED_FIELDS:
+            res[fname] = 0 if size <= 64 else bytes(size // 8)
+        elif size <= 64:
+            if fshape.get('signed'):
+                res[fname] = rng.getrandbits(size) - (1 << (size - 1))
+            else:
+                res[fname] = rng.getrandbits(size)
+        else:
+            res[fname] = rng.randbytes(size // 8)
+    if 'namelen' in res and 'name' in res:
+        res['namelen'] = len(res['name'])
+    if 'count' in res:
+        counted = [val for val in res.values() if isinstance(val, list)]
+        if counted:
+            res['count'] = len(counted[0])
+    return res
+
+def mk_samples(protocol, seed=0, entries=SAMPLE_ENTRIES, datasize=SAMPLE_DATASIZE):
+    '''
+    Yield (opcode name, direction, message dict) for every direction the
+    protocol describes. Repeated structs get up to the given number of
+    entries, variable-size data fields the given number of bytes.
+    '''
+    plans = StructPlans(protocol['structs'])
+    operations = protocol['operations']
+    for opname in protocol['opcodes']:
+        for direction in DIRECTIONS:
+            schema = operations.get(opname, {}).get(direction)
+            if not isinstance(schema, dict):
+                continue
+            rng = Random(f'{seed}:{opname}:{direction}')
+            yield opname, direction, _sample_fields(
+                _replace_struct(plans, schema)
+                , rng
+                , entries
+                , datasize
+                )
@@ -0,0 +1,270 @@
+from errno import EINVAL, ENOSYS, EOPNOTSUPP, EBADF
+from fcntl import fcntl
+from os import O_CLOEXEC, pipe2, read, write, close
+from threading import Lock
+
+from pysinter import (
+    FUSEUnmountError, HEADER_SIZE_RECV, HEADER_SIZE_SEND, HEADER_STRUCT_SEND
+    , frombytes, parse_header_req
+    )
+from pysinter.constants import FUSE_WRITE
+
+'''
+Zero-copy data path for Sinter using splice(2), on Linux with Python 3.10
+or later.
+
+Requests are spliced from the FUSE fd into a pipe. Header and arguments are
+read from there, while the data of WRITE requests is moved on into a pipe of
+its own and handed to the handler as a SplicedPayload, which it can splice
+into a file. Operations reads the data into the request for handlers not
+marked with pysinter.helper.accepts_spliced. With all payload pipes in use,
+WRITE data is read into the request right away. FileSlice replies are
+spliced from the file into a pipe, prefixed with the reply header and
+spliced into the FUSE fd.
+The kernel has no opinion about any of this, the FUSE_SPLICE_* flags only
+describe what the device supports. Whether the fd at hand supports it is
+found out on first use: an EINVAL or similar turns the direction off and the
+caller falls back to readv and writev.
+'''
+
+try:
+    from os import splice, SPLICE_F_MOVE
+except ImportError: # Before Python 3.10 or not on Linux
+    splice = None
+    SPLICE_F_MOVE = 0
+
+try:
+    from fcntl import F_GETPIPE_SZ, F_SETPIPE_SZ
+except ImportError:
+    F_GETPIPE_SZ = F_SETPIPE_SZ = None
+
+WRITE_IN_SIZE = 40
+UNSUPPORTED_ERRNOS = frozenset((EINVAL, ENOSYS, EOPNOTSUPP, EBADF))
+PAYLOAD_POOL_SIZE = 16
+
+def splice_available():
+    return splice is not None
+
+def _read_exact(fd, size):
+    res = read(fd, size)
+    while len(res) < size:
+        more = read(fd, size - len(res))
+        if not more:
+            raise RuntimeError(f'Pipe ran dry after {len(res)} of {size} bytes')
+        res = res + more
+    return res
+
+def _move(fd_in, fd_out, size, offset_in=None, offset_out=None):
+    '''
+    Splice exactly size bytes unless the input ends, returning the count.
+    '''
+    done = 0
+    while done < size:
+        count = splice(
+            fd_in
+            , fd_out
+            , size - done
+            , None if offset_in is None else offset_in + done
+            , None if offset_out is None else offset_out + done
+            , SPLICE_F_MOVE
+            )
+        if not count:
+            break
+        done = done + count
+    return done
+
+class Pipe():
+    '''
+    A pipe, enlarged to the given capacity where the system allows.
+    '''
+    __slots__ = ('rfd', 'wfd', 'capacity')
+    def __init__(self, capacity=None):
+        self.rfd, self.wfd = pipe2(O_CLOEXEC)
+        self.capacity = 1 << 16
+        if F_GETPIPE_SZ is not None:
+            if capacity is not None:
+                try:
+                    fcntl(self.wfd, F_SETPIPE_SZ, capacity)
+                except OSError: # Over /proc/sys/fs/pipe-max-size
+                    pass
+            self.capacity = fcntl(self.wfd, F_GETPIPE_SZ)
+        return None
+    def drain(self, size):
+        return _read_exact(self.rfd, size) if size else b''
+    def close(self):
+        close(self.rfd)
+        close(self.wfd)
+        return None
+
+class SplicedPayload():
+    '''
+    The data of a WRITE request, still in a pipe. Consume it once with
+    to_fd or read. Operations closes it after the handler is done, which
+    returns the pipe to the pool.
+    '''
+    __slots__ = ('_pipe', '_pool', 'size')
+    def __init__(self, pipe, pool, size):
+        self._pipe = pipe
+        self._pool = pool
+        self.size = size
+        return None
+    def to_fd(self, fd, offset=None):
+        '''
+        Splice the data into fd, at offset if given. Returns the count.
+        '''
+        count = _move(self._pipe.rfd, fd, self.size, offset_out=offset)
+        self.size = self.size - count
+        return count
+    def read(self):
+        '''
+        Fall back to reading the data into memory.
+        '''
+        res = self._pipe.drain(self.size)
+        self.size = 0
+        return res
+    def close(self):
+        pipe = self._pipe
+        if pipe is None:
+            return None
+        self._pipe = None
+        if self.size:
+            self._pool.discard(pipe) # Unconsumed data, not worth draining
+        else:
+            self._pool.put(pipe)
+        return None
+
+class PipePool():
+    '''
+    Empty pipes for payloads, so that a WRITE does not cost a pipe2 call.
+    At most maxsize pipes exist at a time, get returns None when all are in
+    use. Pipes are taken by the receiving thread and returned from the event
+    loop.
+    '''
+    def __init__(self, capacity, maxsize=PAYLOAD_POOL_SIZE):
+        self._capacity = capacity
+        self._maxsize = maxsize
+        self._pipes = []
+        self._count = 0
+        self._lock = Lock()
+        return None
+    def get(self):
+        with self._lock:
+            if self._pipes:
+                return self._pipes.pop()
+            if self._count >= self._maxsize:
+                return None
+            self._count = self._count + 1
+        try:
+            return Pipe(self._capacity)
+        except OSError:
+            with self._lock:
+                self._count = self._count - 1
+            raise
+    def put(self, pipe):
+        with self._lock:
+            self._pipes.append(pipe)
+        return None
+    def discard(self, pipe):
+        pipe.close()
+        with self._lock:
+            self._count = self._count - 1
+        return None
+    def close(self):
+        with self._lock:
+            pipes = self._pipes
+            self._pipes = []
+            self._count = self._count - len(pipes)
+        for pipe in pipes:
+            pipe.close()
+        return None
+
+class SpliceTransport():
+    '''
+    The pipes and state for splicing on one FUSE fd. recv and send_slice
+    return None when splicing is not possible, leaving the fd untouched.
+    '''
+    def __init__(self, fd, bufsize):
+        capacity = 1 << (2 * bufsize - 1).bit_length()
+        self._fd = fd
+        self._bufsize = bufsize
+        self._recv_pipe = Pipe(capacity)
+        self._data_pipe = Pipe(capacity)
+        self._reply_pipe = Pipe(capacity)
+        self._payloads = PipePool(capacity)
+        self.recv_enabled = splice_available()
+        self.send_enabled = splice_available()
+        self.spliced_requests = 0
+        self.spliced_replies = 0
+        return None
+    def recv(self):
+        '''
+        Receive one request as (header, message), with WRITE data left in
+        header.splice if a payload pipe is free.
+        '''
+        pipe = self._recv_pipe
+        try:
+            numread = splice(self._fd, pipe.wfd, self._bufsize)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                self.recv_enabled = False
+                return None
+            raise
+        if numread == 0:
+            raise FUSEUnmountError("End of file on FUSE fd")
+        if numread < HEADER_SIZE_RECV:
+            pipe.drain(numread)
+            raise RuntimeError(f"Read only {numread} bytes from FUSE fd")
+        head = pipe.drain(HEADER_SIZE_RECV)
+        header = parse_header_req(head)
+        remainder = numread - HEADER_SIZE_RECV
+        if frombytes(head[:4]) != numread:
+            pipe.drain(remainder)
+            raise RuntimeError(f"Spliced {numread} bytes of a {frombytes(head[:4])} byte request")
+        payload = None
+        if header.opcode == FUSE_WRITE and remainder > WRITE_IN_SIZE:
+            payload = self._payloads.get()
+        if payload is not None:
+            msg = pipe.drain(WRITE_IN_SIZE)
+            size = remainder - WRITE_IN_SIZE
+            _move(pipe.rfd, payload.wfd, size)
+            header.splice = SplicedPayload(payload, self._payloads, size)
+            self.spliced_requests = self.spliced_requests + 1
+        else:
+            msg = pipe.drain(remainder)
+        return header, msg
+    def send_slice(self, unique, errno, fslice):
+        '''
+        Send a FileSlice reply, returning the number of bytes sent.
+        '''
+        if fslice.size + HEADER_SIZE_SEND + 4096 > self._reply_pipe.capacity:
+            return None
+        data = self._data_pipe
+        try:
+            moved = _move(fslice.fd, data.wfd, fslice.size, offset_in=fslice.offset)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRNOS:
+                self.send_enabled = False
+            data.close() # Whatever made it into the pipe is of no use
+            self._data_pipe = Pipe(data.capacity)
+            return None
+        total = HEADER_SIZE_SEND + moved
+        reply = self._reply_pipe
+        write(reply.wfd, HEADER_STRUCT_SEND.pack(total, -errno, unique))
+        _move(data.rfd, reply.wfd, moved)
+        try:
+            sent = splice(reply.rfd, self._fd, total, None, None, SPLICE_F_MOVE)
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRNOS:
+                reply.drain(total)
+                raise
+            self.send_enabled = False
+            sent = write(self._fd, reply.drain(total))
+        if sent != total:
+            raise RuntimeError(f"Spliced {sent} of {total} reply bytes")
+        self.spliced_replies = self.spliced_replies + 1
+        return sent
+    def close(self):
+        for pipe in (self._recv_pipe, self._data_pipe, self._reply_pipe):
+            pipe.close()
+        self._payloads.close()
+        return None
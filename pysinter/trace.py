@@ -0,0 +1,190 @@
+'''
+Append-only binary traces of FUSE traffic.
+
+A trace file starts with a file header, followed by records. Each record is a
+fixed-size record header (kind, monotonic timestamp in nanoseconds, length)
+and the raw frame: requests including their 40 byte header, replies including
+their 16 byte header. Every time a trace is opened for writing, a session
+record carrying the wall clock time is appended first, so traces of several
+runs can share one file.
+'''
+
+from os import fstat
+from struct import Struct
+from threading import Lock
+from time import monotonic_ns, time_ns
+
+from pysinter import (
+    HEADER_SIZE_RECV, HEADER_SIZE_SEND, BYTEORDER, FUSEError
+    , parse_header_req
+    )
+
+TRACE_MAGIC = b'PSTR'
+TRACE_VERSION = 1
+TRACE_FILE_HEADER = Struct('<4sHH')
+TRACE_RECORD_HEADER = Struct('<BQI')
+TRACE_SESSION_PAYLOAD = Struct('<Q')
+
+TRACE_SESSION = 0
+TRACE_REQUEST = 1
+TRACE_REPLY = 2
+
+class TraceWriter():
+    '''
+    Appends records to a trace file. Safe to share between the receiving and
+    the sending thread of a Sinter.
+    '''
+    def __init__(self, path):
+        self._handle = open(path, 'ab')
+        self._lock = Lock()
+        if fstat(self._handle.fileno()).st_size == 0:
+            self._handle.write(TRACE_FILE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, 0))
+        self._write(TRACE_SESSION, (TRACE_SESSION_PAYLOAD.pack(time_ns()),))
+        return None
+    def _write(self, kind, parts):
+        length = sum(len(part) for part in parts)
+        with self._lock:
+            handle = self._handle
+            handle.write(TRACE_RECORD_HEADER.pack(kind, monotonic_ns(), length))
+            for part in parts:
+                handle.write(part)
+        return None
+    def request(self, *parts):
+        '''
+        Record a request frame, given as one or more bytes-like parts.
+        '''
+        return self._write(TRACE_REQUEST, parts)
+    def reply(self, *parts):
+        '''
+        Record a reply frame, given as one or more bytes-like parts.
+        '''
+        return self._write(TRACE_REPLY, parts)
+    def flush(self):
+        with self._lock:
+            self._handle.flush()
+        return None
+    def close(self):
+        with self._lock:
+            self._handle.close()
+        return None
+
+def read_trace(path):
+    '''
+    Yield (kind, timestamp, frame) for every record in a trace file. Session
+    records carry the wall clock time in nanoseconds as their frame.
+    '''
+    with open(path, 'rb') as handle:
+        head = handle.read(TRACE_FILE_HEADER.size)
+        magic, version, _ = TRACE_FILE_HEADER.unpack(head)
+        if magic != TRACE_MAGIC or version != TRACE_VERSION:
+            raise ValueError('Not a pysinter trace, or unsupported version', path, magic, version)
+        recsize = TRACE_RECORD_HEADER.size
+        while True:
+            rechead = handle.read(recsize)
+            if len(rechead) < recsize:
+                break # A truncated tail is expected if the writer was killed
+            kind, timestamp, length = TRACE_RECORD_HEADER.unpack(rechead)
+            frame = handle.read(length)
+            if len(frame) < length:
+                break
+            if kind == TRACE_SESSION:
+                frame, = TRACE_SESSION_PAYLOAD.unpack(frame)
+            yield kind, timestamp, frame
+    return None
+
+def split_reply(frame):
+    '''
+    Unique value, errno and body of a recorded reply frame.
+    '''
+    errno = -int.from_bytes(frame[4:8], BYTEORDER, signed=True)
+    unique = int.from_bytes(frame[8:HEADER_SIZE_SEND], BYTEORDER)
+    return unique, errno, frame[HEADER_SIZE_SEND:]
+
+class _ReplaySink():
+    '''
+    Stands in for the TX queue, timing and collecting the replies. Both are
+    keyed by the request's header, since uniques repeat across sessions.
+    '''
+    def __init__(self, started):
+        self._started = started
+        self.latencies = {}
+        self.replies = {}
+        return None
+    async def put(self, item):
+        from time import perf_counter_ns
+        header, errno, msg = item
+        opcode = header.opcode
+        t_start = self._started.pop(header)
+        self.latencies.setdefault(opcode, []).append(perf_counter_ns() - t_start)
+        self.replies[header] = (errno, msg)
+        return None
+
+async def replay(path, operations, realtime=False, speed=1.0, verify=False, depth=64):
+    '''
+    Feed the requests of a trace through an Operations instance, as fast as
+    possible with up to depth requests in flight or, with realtime, at the
+    recorded pace scaled by speed.
+    Returns the elapsed time, per-opcode latencies in nanoseconds (from the
+    start of processing to the reply) and, with verify, the number of replies
+    differing from the recorded ones.
+    '''
+    from asyncio import create_task, gather, sleep, Semaphore
+    from time import perf_counter, perf_counter_ns
+    started = {}
+    inflight = None if realtime else Semaphore(depth)
+    sink = _ReplaySink(started)
+    recorded = {} # (session, unique) -> errno, body
+    headers = {} # (session, unique) -> replayed header
+    session = 0
+    tasks = []
+    base_trace = None
+    base_clock = None
+    t_start = perf_counter()
+    for kind, timestamp, frame in read_trace(path):
+        if kind == TRACE_SESSION:
+            session = session + 1
+            base_trace = None
+            continue
+        if kind == TRACE_REPLY:
+            if verify:
+                unique, errno, body = split_reply(frame)
+                recorded[(session, unique)] = (errno, bytes(body))
+            continue
+        if realtime:
+            if base_trace is None:
+                base_trace = timestamp
+                base_clock = perf_counter_ns()
+            delay = (timestamp - base_trace) / speed - (perf_counter_ns() - base_clock)
+            if delay > 0:
+                await sleep(delay / 1e9)
+        header = parse_header_req(frame)
+        msg = bytes(frame[HEADER_SIZE_RECV:])
+        if verify:
+            headers[(session, header.unique)] = header
+        if inflight is not None:
+            await inflight.acquire()
+        tasks.append(create_task(_replay_one(operations, sink, started, inflight, header, msg)))
+    await gather(*tasks)
+    elapsed = perf_counter() - t_start
+    mismatches = None
+    if verify:
+        mismatches = 0
+        for key, (errno, body) in recorded.items():
+            replayed = sink.replies.get(headers.get(key))
+            if replayed is None:
+                continue
+            replayed_errno, replayed_body = replayed
+            if errno != replayed_errno or body != (replayed_body or b''):
+                mismatches = mismatches + 1
+    return elapsed, sink.latencies, mismatches
+
+async def _replay_one(operations, sink, started, inflight, header, msg):
+    from time import perf_counter_ns
+    started[header] = perf_counter_ns()
+    try:
+        return await operations._complete_one(sink, header, msg)
+    except FUSEError as e:
+        return await sink.put((header, e.errno, b''))
+    finally:
+        if inflight is not None:
+            inflight.release()
@@ -0,0 +1,100 @@
+from asyncio import run
+from errno import EROFS
+from io import BytesIO
+from os import O_RDWR
+from stat import S_ISDIR, S_ISLNK
+from tarfile import TarInfo, open as taropen, DIRTYPE, SYMTYPE, LNKTYPE
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from pytest import mark
+
+from pysinter import Header, ROOT_INODE
+from pysinter.examples.archive import ArchiveFS
+from pysinter.loopback import FakeKernel, LoopbackServer
+from tests.test_loopback import load_protocol
+from tests.test_splice import _call
+
+FILES = {
+    'data/a.bin': bytes(range(256)) * 40
+    , 'data/sub/b.txt': b'hello archive'
+    , 'top.txt': b'top'
+    }
+
+def _mk_tar(path):
+    with taropen(path, 'w') as tar:
+        for name, content in FILES.items():
+            info = TarInfo(name)
+            info.size = len(content)
+            tar.addfile(info, BytesIO(content))
+        for name, kind, target in (('data/link', SYMTYPE, 'a.bin'), ('hard.bin', LNKTYPE, 'data/a.bin'), ('data/', DIRTYPE, '')):
+            info = TarInfo(name)
+            info.type = kind
+            info.linkname = target
+            tar.addfile(info)
+    return None
+
+def _mk_zip(path):
+    with ZipFile(path, 'w') as archive:
+        for num, (name, content) in enumerate(FILES.items()):
+            archive.writestr(name, content, compress_type=ZIP_DEFLATED if num % 2 else ZIP_STORED)
+    return None
+
+def _read(kernel, ino, size):
+    fh = _call(kernel, 'FUSE_OPEN', {'flags': 0}, nodeid=ino)['fh']
+    res = _call(kernel, 'FUSE_READ', {'fh': fh, 'offset': 0, 'size': size + 10}, nodeid=ino)['data']
+    _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+    return res
+
+def _lookup(kernel, path):
+    ino = 1
+    for name in path.split('/'):
+        entry, = _call(kernel, 'FUSE_LOOKUP', {'name': name.encode()}, nodeid=ino)['entry']
+        ino = entry['nodeId']
+    return entry
+
+@mark.parametrize('kind', ('tar', 'zip'))
+def test_archive_fs(tmp_path, kind):
+    path = str(tmp_path / f'dataset.{kind}')
+    (_mk_tar if kind == 'tar' else _mk_zip)(path)
+    protocol = load_protocol()
+    fs = ArchiveFS(path)
+    assert fs._index.built
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, fs.make()):
+            for name, content in FILES.items():
+                entry = _lookup(kernel, name)
+                assert entry['attr']['size'] == len(content)
+                assert _read(kernel, entry['nodeId'], len(content)) == content
+            directory = _lookup(kernel, 'data')
+            assert S_ISDIR(directory['attr']['timeandmode']['mode'])
+            assert _call(kernel, 'FUSE_LOOKUP', {'name': b'missing'})['entry'][0]['nodeId'] == 0
+            names = []
+            cookie = 0
+            while True:
+                # One entry per reply, the parser takes names to the end
+                data = _call(kernel, 'FUSE_READDIR', {'fh': 0, 'cookie': cookie, 'size': 40}, nodeid=directory['nodeId'])['data']
+                if not data:
+                    break
+                names.append(data[0]['name'][:data[0]['namelen']])
+                cookie = data[0]['cookie']
+            expected = [b'a.bin', b'sub'] + ([b'link'] if kind == 'tar' else [])
+            assert names == [b'.', b'..'] + sorted(expected)
+            ino = _lookup(kernel, 'top.txt')['nodeId']
+            kernel.request('FUSE_OPEN', {'flags': O_RDWR}, nodeid=ino)
+            assert kernel.recv()[1] == EROFS
+            if kind == 'tar':
+                link = _lookup(kernel, 'data/link')
+                assert S_ISLNK(link['attr']['timeandmode']['mode'])
+                assert _call(kernel, 'FUSE_READLINK', {}, nodeid=link['nodeId'])['data'] == b'a.bin'
+                hard = _lookup(kernel, 'hard.bin')
+                assert _read(kernel, hard['nodeId'], 10240) == FILES['data/a.bin']
+    finally:
+        kernel.close_server()
+        fs.close()
+    again = ArchiveFS(path)
+    assert not again._index.built and again._index.count == fs._index.count
+    _, entry = run(again.lookup(Header(1, 1, ROOT_INODE, 0, 0, 0), {'name': b'top.txt'}))
+    _, reply = run(again.read(Header(15, 2, entry['entry'][0]['nodeId'], 0, 0, 0), {'fh': 0, 'offset': 0, 'size': 3}))
+    again.close() # With the reply still holding a view of the mapping
+    assert bytes(reply['data']) == b'top'
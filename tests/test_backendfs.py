@@ -0,0 +1,73 @@
+from asyncio import get_running_loop
+from errno import ENOENT
+from os import O_RDWR
+
+from pysinter.examples.backend import LocalBackend
+from pysinter.examples.backendfs import BackendFS
+from pysinter.examples.remote import BackendServer, RemoteBackend
+from pysinter.loopback import FakeKernel, LoopbackServer
+from tests.test_loopback import load_protocol
+from tests.test_splice import _call
+
+def test_remote_backend(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'dir').mkdir(parents=True)
+    for num in range(20):
+        (root / 'dir' / f'f{num:02d}').write_bytes(bytes([num]) * num)
+    protocol = load_protocol()
+    backend = RemoteBackend(str(tmp_path / 'socket'), max_connections=2, pipeline=4)
+    kernel = FakeKernel(protocol)
+    try:
+        with BackendServer(LocalBackend(str(root)), str(tmp_path / 'socket'), latency=0.01) as server:
+            with LoopbackServer(kernel, protocol, BackendFS(backend).make()):
+                directory, = _call(kernel, 'FUSE_LOOKUP', {'name': b'dir'})['entry']
+                directory = directory['nodeId']
+                # Concurrent LOOKUPs share stat_many requests. The flush is
+                # held until all are queued, they may trickle in one by one
+                flush = backend._flush_stats
+                def held_flush():
+                    if len(backend._stat_queue) < 20:
+                        get_running_loop().call_later(0.001, held_flush)
+                    else:
+                        flush()
+                backend._flush_stats = held_flush
+                batches = backend.stat_batches
+                uniques = [
+                    kernel.request('FUSE_LOOKUP', {'name': b'f%02d' % num}, nodeid=directory)
+                    for num in range(20)
+                    ]
+                replies = {}
+                for _ in uniques:
+                    unique, errno, body = kernel.recv()
+                    replies[unique] = kernel.parse_reply('FUSE_LOOKUP', body)
+                sizes = [replies[unique]['entry'][0]['attr']['size'] for unique in uniques]
+                assert sizes == list(range(20))
+                assert backend.stat_batches == batches + 1 and backend.stats_batched == 21
+                del backend._flush_stats
+                created = _call(kernel, 'FUSE_CREATE', {
+                    'name': b'new', 'flags': O_RDWR, 'mode': 0o644, 'umask': 0o022
+                    }, nodeid=directory)
+                ino = created['entry']['nodeId']
+                assert _call(kernel, 'FUSE_WRITE', {'fh': 0, 'offset': 3, 'size': 4, 'data': b'data'}, nodeid=ino)['size'] == 4
+                _call(kernel, 'FUSE_RENAME', {'newdir': 1, 'oldname': b'dir', 'newname': b'moved'})
+                assert _call(kernel, 'FUSE_READ', {'fh': 0, 'offset': 0, 'size': 100}, nodeid=ino)['data'] == bytes(3) + b'data'
+                fh = _call(kernel, 'FUSE_OPENDIR', {'flags': 0}, nodeid=directory)['fh']
+                names = []
+                cookie = 0
+                while True:
+                    # One entry per reply, the parser takes names to the end
+                    data = _call(kernel, 'FUSE_READDIRPLUS', {'fh': fh, 'cookie': cookie, 'size': 200}, nodeid=directory)['data']
+                    if not data:
+                        break
+                    dirent = data[0]['dirent']
+                    names.append(dirent['name'][:dirent['namelen']])
+                    cookie = dirent['cookie']
+                assert sorted(names) == sorted([b'f%02d' % num for num in range(20)] + [b'new'])
+                _call(kernel, 'FUSE_UNLINK', {'name': b'new'}, nodeid=directory)
+                kernel.request('FUSE_LOOKUP', {'name': b'new'}, nodeid=directory)
+                assert kernel.recv()[1] == ENOENT
+            assert server.requests > backend.stat_batches
+    finally:
+        kernel.close_server()
+    assert (root / 'moved' / 'f05').read_bytes() == b'\x05' * 5
+    assert not (root / 'moved' / 'new').exists()
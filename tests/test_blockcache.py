@@ -0,0 +1,89 @@
+from asyncio import run, sleep
+from os import O_RDONLY, O_RDWR, open as osopen, close as osclose, pread, pwrite, urandom
+from threading import Event
+
+from pysinter import Header, ROOT_INODE
+from pysinter.examples.blockcache import BlockCache
+from pysinter.examples.passthrough import Passthrough
+
+def _header(ino):
+    return Header(15, 1, ino, 0, 0, 0)
+
+def test_blockcache_reads(tmp_path):
+    content = urandom(10000)
+    path = tmp_path / 'data'
+    path.write_bytes(content)
+    calls = []
+    def counting_pread(fd, size, offset):
+        calls.append(offset)
+        return pread(fd, size, offset)
+    fd = osopen(path, O_RDWR)
+    cache = BlockCache(blocksize=1024, budget=4096, prefetch=2, pread=counting_pread)
+    async def scenario():
+        for offset in range(0, 10000, 500): # Sequential, triggers prefetch
+            assert bytes(await cache.read(7, 3, fd, offset, 500)) == content[offset:offset + 500]
+        await sleep(0.05)
+        assert cache.prefetch_hits > 0 and cache.evictions > 0
+        assert cache.stats()['bytes'] <= 4096
+        assert bytes(await cache.read(7, 4, fd, 900, 300)) == content[900:1200]
+        pwrite(fd, b'x' * 10, 9990)
+        cache.invalidate(7)
+        assert bytes(await cache.read(7, 4, fd, 9980, 100)) == content[9980:9990] + b'x' * 10
+        return None
+    try:
+        run(scenario())
+        assert len(calls) < 20 # One pread per block instead of per request
+    finally:
+        cache.close()
+        osclose(fd)
+
+def test_blockcache_prefetch_after_close(tmp_path):
+    (tmp_path / 'a').write_bytes(b'a' * 4096)
+    (tmp_path / 'b').write_bytes(b'b' * 4096)
+    gate = Event()
+    def gated_pread(fd, size, offset):
+        if offset: # Prefetches wait until the fd number has been reused
+            gate.wait(10)
+        return pread(fd, size, offset)
+    cache = BlockCache(blocksize=1024, budget=8192, prefetch=2, pread=gated_pread)
+    async def scenario():
+        fd = osopen(tmp_path / 'a', O_RDONLY)
+        for offset in (0, 100, 200):
+            await cache.read(7, 3, fd, offset, 100)
+        cache.release(3)
+        osclose(fd)
+        other = osopen(tmp_path / 'b', O_RDONLY)
+        try:
+            gate.set()
+            await sleep(0.05)
+            return bytes(await cache.read(7, 4, other, 1024, 100))
+        finally:
+            osclose(other)
+    try:
+        assert run(scenario()) == b'a' * 100
+        assert cache.prefetch_hits == 1
+    finally:
+        cache.close()
+
+def test_passthrough_cache_invalidation(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(b'a' * 4096)
+    cache = BlockCache(blocksize=1024, budget=8192)
+    pt = Passthrough(str(tmp_path), cache=cache)
+    ino = path.stat().st_ino
+    async def scenario():
+        await pt.lookup(_header(ROOT_INODE), {'name': b'data'})
+        _, opened = await pt.open(_header(ino), {'flags': O_RDWR})
+        fh = opened['fh']
+        _, res = await pt.read(_header(ino), {'fh': fh, 'offset': 0, 'size': 10})
+        assert bytes(res['data']) == b'a' * 10
+        await pt.write(_header(ino), {'fh': fh, 'offset': 0, 'size': 3, 'data': b'bbb'})
+        _, res = await pt.read(_header(ino), {'fh': fh, 'offset': 0, 'size': 10})
+        assert bytes(res['data']) == b'bbb' + b'a' * 7
+        await pt.release(_header(ino), {'fh': fh})
+        return None
+    try:
+        run(scenario())
+    finally:
+        pt.close()
+    assert cache._executor is None # Its threads shut down with the filesystem
@@ -0,0 +1,84 @@
+from asyncio import Event, run, sleep
+
+from pysinter.fairqueue import FairQueue
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers
+from tests.test_loopback import load_protocol
+
+def test_fair_queue():
+    protocol = load_protocol()
+    handlers = mk_bench_handlers(direntries=10)
+    started = []
+    snapshots = []
+    async def slow_getattr(header, parsed):
+        started.append(header.uid)
+        snapshots.append(fair.stats())
+        await sleep(0.01)
+        return 0, {'attr': {'ino': header.nodeid}}
+    handlers['FUSE_GETATTR'] = slow_getattr
+    fair = FairQueue(key='uid', max_inflight=2, client_inflight=1)
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, handlers, dispatcher=fair):
+            for _ in range(12):
+                kernel.request('FUSE_GETATTR', {}, uid=1000)
+            for _ in range(3):
+                kernel.request('FUSE_GETATTR', {}, uid=2000)
+            for _ in range(15):
+                assert kernel.recv()[1] == 0
+    finally:
+        kernel.close_server()
+    # One at a time each, so the late client gets every other slot
+    assert started.index(2000) <= 2
+    assert started[:8].count(2000) == 3
+    stats = snapshots[started.index(2000, started.index(2000) + 1)] # At the second one of 2000
+    assert stats[2000]['requests'] == 2 and stats[2000]['queued'] == 1
+    assert stats[1000]['queued'] > 0
+    assert snapshots[-1][1000]['requests'] == 12 and snapshots[-1][2000]['inflight'] == 0
+    assert snapshots[-1][1000]['wait']['max'] > stats[2000]['wait']['max']
+    assert fair.inflight == fair.queued == 0
+    stats = fair.stats() # Idle clients keep their statistics
+    assert (stats[1000]['requests'], stats[2000]['requests']) == (12, 3)
+    assert stats[1000]['inflight'] == stats[2000]['inflight'] == 0
+    assert stats[1000]['wait'] == snapshots[-1][1000]['wait']
+    assert not fair._clients
+
+def test_fair_queue_history():
+    async def handle(header, msg):
+        return None
+    async def scenario():
+        for pid in range(10):
+            fair.submit(handle, pid, None)
+            fair.submit(handle, pid, None)
+        while fair.queued or fair.inflight:
+            await sleep(0)
+        fair.submit(handle, 8, None) # Back from the history
+        await sleep(0)
+        return None
+    fair = FairQueue(key=lambda header: header, history=3)
+    run(scenario())
+    stats = fair.stats()
+    assert sorted(stats) == [7, 8, 9]
+    assert stats[8]['requests'] == 3 and stats[9]['requests'] == 2
+
+def test_deficit_round_robin():
+    order = []
+    async def handle(header, msg):
+        order.append(header[0])
+        if header[0] == 'gate':
+            await gate.wait()
+        return None
+    async def scenario():
+        fair.submit(handle, ('gate', 0), 1) # Holds the only slot while the rest queues up
+        for num in range(4):
+            fair.submit(handle, ('big', num), 4)
+            fair.submit(handle, ('small', num), 1)
+        await sleep(0)
+        gate.set()
+        while fair.queued or fair.inflight:
+            await sleep(0)
+        return None
+    gate = Event()
+    fair = FairQueue(key=lambda header: header[0], max_inflight=1, quantum=2, cost=lambda header, msg: msg)
+    run(scenario())
+    # Two small ones per round, a big one every other round
+    assert order == ['gate', 'small', 'small', 'big', 'small', 'small', 'big', 'big', 'big']
@@ -0,0 +1,85 @@
+from asyncio import run, run_coroutine_threadsafe
+from logging import getLogger
+from os import close, fstat, path as ospath, pipe
+from socket import socketpair, AF_UNIX, SOCK_STREAM
+from threading import Thread
+from time import sleep
+
+from pysinter.examples.passthrough import Passthrough
+from pysinter.handoff import HandoffListener, MAX_FDS_PER_MESSAGE, receive_handoff, recv_handoff, send_handoff
+from pysinter.loopback import FakeKernel, LoopbackServer
+from pysinter.multiplex import Multiplexer
+from tests.test_loopback import load_protocol
+from tests.test_splice import _call
+
+def test_send_recv_handoff():
+    pipes = [pipe() for _ in range(MAX_FDS_PER_MESSAGE // 2 + 10)] # More fds than fit one message
+    fds = [fd for pair in pipes for fd in pair]
+    state = {'nodes': [(2, 1, b'name\xff')], 'root': 1}
+    left, right = socketpair(AF_UNIX, SOCK_STREAM)
+    received = []
+    try:
+        sender = Thread(target=send_handoff, args=(left, fds, state))
+        sender.start()
+        received, got = recv_handoff(right)
+        sender.join()
+        assert got == state
+        assert [fstat(fd).st_ino for fd in received] == [fstat(fd).st_ino for fd in fds]
+    finally:
+        left.close()
+        right.close()
+        for fd in fds + received:
+            close(fd)
+
+def test_handoff(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'sub').mkdir()
+    (root / 'sub' / 'f').write_bytes(b'handed over')
+    socket_path = str(tmp_path / 'handoff.sock')
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    old_fs = Passthrough(str(root))
+    new_fs = Passthrough(str(root))
+    old = LoopbackServer(kernel, protocol, old_fs.make(), interruptible=True).start()
+    thread = None
+    fuse_fd = None
+    try:
+        sub = _call(kernel, 'FUSE_LOOKUP', {'name': b'sub'})['entry'][0]['nodeId']
+        ino = _call(kernel, 'FUSE_LOOKUP', {'name': b'f'}, nodeid=sub)['entry'][0]['nodeId']
+        fh = _call(kernel, 'FUSE_OPEN', {'flags': 0}, nodeid=ino)['fh']
+        listener = HandoffListener(socket_path, old.sinter, old.operations, export=old_fs.export_state)
+        future = run_coroutine_threadsafe(listener.serve(), old._loop)
+        for _ in range(1000):
+            if ospath.exists(socket_path):
+                break
+            sleep(0.01)
+        fuse_fd, state, fds = receive_handoff(socket_path, timeout=10)
+        future.result(10)
+        assert listener.handed_off
+        assert old.sinter.recv_stopped.is_set()
+        kernel.request('FUSE_GETATTR', {}, nodeid=ino) # Waits for the new server
+        new_fs.import_state(state, fds)
+        mux = Multiplexer(protocol, getLogger(__name__))
+        mux.add('new', fuse_fd, new_fs.make())
+        thread = Thread(target=run, args=(mux.serve(),), daemon=True)
+        thread.start()
+        _, errno, body = kernel.recv()
+        assert errno == 0
+        assert kernel.parse_reply('FUSE_GETATTR', body)['attr']['size'] == 11
+        data = _call(kernel, 'FUSE_READ', {'fh': fh, 'offset': 0, 'size': 64}, nodeid=ino)['data']
+        assert bytes(data) == b'handed over'
+        fh2 = _call(kernel, 'FUSE_OPEN', {'flags': 0}, nodeid=ino)['fh']
+        assert fh2 != fh
+        _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+        _call(kernel, 'FUSE_RELEASE', {'fh': fh2}, nodeid=ino)
+    finally:
+        if thread is not None:
+            mux.stop()
+            thread.join(10)
+        old.stop()
+        kernel.close_server()
+        if fuse_fd is not None:
+            close(fuse_fd)
+        old_fs.close()
+        new_fs.close()
@@ -0,0 +1,26 @@
+from random import Random
+
+from pysinter.examples.inodeindex import InodeIndex
+
+def test_inode_index(tmp_path):
+    path = str(tmp_path / 'index')
+    index = InodeIndex(path, capacity=16)
+    expected = {}
+    rand = Random(0)
+    for _ in range(5000):
+        ino = rand.randrange(1, 1000)
+        choice = rand.random()
+        if choice < 0.6:
+            value = (rand.choice((None, rand.randrange(1, 100))), b'name%d' % rand.randrange(10 ** rand.randrange(1, 8)))
+            index[ino] = value
+            expected[ino] = value
+        elif choice < 0.8:
+            assert index.pop(ino, None) == expected.pop(ino, None)
+        else:
+            assert index.get(ino) == expected.get(ino)
+    assert len(index) == len(expected)
+    assert index.stats()['capacity'] > 16 # Grown by rebuilding
+    index.close()
+    index = InodeIndex(path)
+    assert dict(index.items()) == expected
+    index.close()
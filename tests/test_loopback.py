@@ -0,0 +1,44 @@
+from json import load
+from logging import getLogger
+from os.path import dirname, join as pjoin
+
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers, run_workload, WORKLOADS
+
+PROTOSOURCE = pjoin(dirname(__file__), 'protocol.json')
+VERSION = 'v7.31'
+LOGGER = getLogger(__name__)
+
+def load_protocol():
+    with open(PROTOSOURCE) as handle:
+        protocol = load(handle)
+    return protocol[VERSION]
+
+def test_loopback_roundtrip():
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    with LoopbackServer(kernel, protocol, mk_bench_handlers(direntries=10)):
+        unique = kernel.request('FUSE_LOOKUP', {'name': b'file00000001'})
+        res_unique, errno, body = kernel.recv()
+        assert (res_unique, errno) == (unique, 0)
+        entry, = kernel.parse_reply('FUSE_LOOKUP', body)['entry']
+        assert entry['nodeId'] == entry['attr']['ino']
+        kernel.request('FUSE_LOOKUP', {'name': b'x'}, nodeid=5)
+        _, errno, body = kernel.recv()
+        assert errno != 0 and body == b''
+    kernel.close_server()
+
+def test_workloads():
+    protocol = load_protocol()
+    for workload in WORKLOADS:
+        res = run_workload(protocol, workload, count=200, depth=4)
+        LOGGER.debug('Workload %s: %s', workload, res)
+        assert res['count'] == 200
+        assert not res['errors']
+
+def test_workload_small_directory():
+    from benchmarks.memfs import mk_memfs
+    protocol = load_protocol()
+    fs = mk_memfs(filesize=4096, direntries=10)
+    res = run_workload(protocol, 'metadata', handlers=fs.make(), count=200, depth=4, direntries=10)
+    assert res['count'] == 200
+    assert not res['errors']
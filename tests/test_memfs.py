@@ -0,0 +1,92 @@
+from asyncio import run
+from errno import EEXIST, EINVAL, ENOENT, ENOTEMPTY
+from os import O_RDWR
+from stat import S_IFDIR, S_IFREG
+
+from pytest import mark, raises
+
+from pysinter import FUSEError, Header, ROOT_INODE
+from pysinter.examples.memfs import FileData, MemFS, RENAME_EXCHANGE
+from pysinter.loopback import FakeKernel, LoopbackServer
+from tests.test_loopback import load_protocol
+from tests.test_splice import _call
+
+def _header(ino):
+    return Header(0, 1, ino, 0, 0, 0)
+
+@mark.parametrize('use_mmap', (False, True))
+def test_filedata(use_mmap):
+    data = FileData(chunk_size=1024, use_mmap=use_mmap)
+    data.write(1000, b'a' * 100)
+    data.write(3000, memoryview(b'b' * 10))
+    assert data.size == 3010
+    assert data.read(990, 20) == bytes(10) + b'a' * 10
+    assert bytes(data.read(1024, 76)) == b'a' * 76
+    assert data.read(2000, 2000) == bytes(1000) + b'b' * 10
+    data.truncate(1050)
+    assert sorted(data.extents) == [0, 1]
+    data.truncate(4000)
+    assert data.read(1040, 20) == b'a' * 10 + bytes(10)
+    assert data.read(4000, 10) == b''
+
+def test_namespace():
+    fs = MemFS()
+    def call(handler, ino, **parsed):
+        return run(handler(_header(ino), parsed))[1]
+    sub = call(fs.mkdir, ROOT_INODE, name=b'sub', mode=0o755, umask=0o022)['entry']['nodeId']
+    created = call(fs.create, sub, name=b'f', flags=O_RDWR, mode=0o644, umask=0)
+    ino = created['entry']['nodeId']
+    call(fs.write, ino, fh=created['fh'], offset=0, size=5, data=b'hello')
+    call(fs.release, ino, fh=created['fh'])
+    call(fs.link, ROOT_INODE, oldnodeid=ino, newname=b'g')
+    assert call(fs.getattr, ino)['attr']['nlink'] == 2
+    with raises(FUSEError) as info:
+        call(fs.rmdir, ROOT_INODE, name=b'sub')
+    assert info.value.errno == ENOTEMPTY
+    with raises(FUSEError) as info:
+        call(fs.rename, ROOT_INODE, oldname=b'sub', newdir=sub, newname=b'loop')
+    assert info.value.errno == EINVAL
+    with raises(FUSEError) as info:
+        call(fs.rename2, ROOT_INODE, oldname=b'g', newdir=sub, newname=b'f', flags=1)
+    assert info.value.errno == EEXIST
+    call(fs.rename2, ROOT_INODE, oldname=b'sub', newdir=ROOT_INODE, newname=b'g', flags=RENAME_EXCHANGE)
+    names = [entry['name'] for entry in call(fs.readdir, ROOT_INODE, cookie=0, size=4096)['data']]
+    assert names == [b'.', b'..', b'sub', b'g']
+    assert call(fs.lookup, ROOT_INODE, name=b'g')['entry'][0]['attr']['timeandmode']['mode'] & S_IFDIR
+    call(fs.unlink, ROOT_INODE, name=b'sub')
+    call(fs.unlink, sub, name=b'f')
+    assert fs.stats()['inodes'] == 3 # Still known to the kernel
+    call(fs.forget, ino, nlookup=2) # CREATE and LINK
+    assert fs.stats()['inodes'] == 2
+    with raises(FUSEError) as info:
+        call(fs.getattr, ino)
+    assert info.value.errno == ENOENT
+    reused = call(fs.mknod, sub, name=b'n', mode=S_IFREG | 0o600, rdev=0, umask=0)['entry']
+    assert reused['nodeId'] == ino and reused['generation'] == 1
+
+def test_memfs_loopback():
+    protocol = load_protocol()
+    fs = MemFS()
+    for num in range(50):
+        fs.add(ROOT_INODE, b'file%02d' % num, 0o644, data=bytes([num]) * 100)
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, fs.make()):
+            seen = []
+            cookie = 0
+            while True:
+                # One entry per reply, the parser takes names to the end
+                data = _call(kernel, 'FUSE_READDIRPLUS', {'fh': 1, 'cookie': cookie, 'size': 200})['data']
+                if not data:
+                    break
+                dirent = data[0]['dirent']
+                seen.append(dirent['name'][:dirent['namelen']])
+                cookie = dirent['cookie']
+            assert seen == [b'.', b'..'] + [b'file%02d' % num for num in range(50)]
+            entry, = _call(kernel, 'FUSE_LOOKUP', {'name': b'file07'})['entry']
+            assert entry['attr']['size'] == 100
+            read = _call(kernel, 'FUSE_READ', {'fh': 0, 'offset': 0, 'size': 4096}, nodeid=entry['nodeId'])
+            assert read['data'] == b'\x07' * 100
+    finally:
+        kernel.close_server()
+    assert fs._inodes.get(entry['nodeId']).lookups == 2 # READDIRPLUS and LOOKUP
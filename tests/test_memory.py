@@ -0,0 +1,78 @@
+from json import load
+from os import getpid, kill
+from signal import SIGUSR1
+
+from pysinter.examples.passthrough import Passthrough
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers
+from pysinter.memory import AllocationTracker, MemoryAccounting, deep_size, install_memory_signal, write_memory_report
+from tests.test_loopback import load_protocol
+from tests.test_profiling import serve_main, wait_for
+from tests.test_splice import _call
+
+def test_memory_accounting(tmp_path):
+    root = tmp_path / 'root'
+    root.mkdir()
+    for num in range(10):
+        (root / f'f{num}').write_bytes(b'x' * num)
+    protocol = load_protocol()
+    fs = Passthrough(str(root))
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, fs.make()) as server:
+            for num in range(10):
+                _call(kernel, 'FUSE_LOOKUP', {'name': b'f%d' % num})
+            accounting = MemoryAccounting(operations=server.operations, sinter=server.sinter, fs=fs)
+            snapshot = accounting.snapshot()
+            write_memory_report(accounting, str(tmp_path / 'memory.json'))
+    finally:
+        kernel.close_server()
+        fs.close()
+    assert snapshot['process']['rss_bytes'] > 0
+    assert snapshot['fs']['inodes']['count'] == 11
+    assert snapshot['fs']['inodes']['bytes'] > 0
+    assert snapshot['operations']['formatters']['count'] >= 2
+    assert snapshot['operations']['inflight'] == {'count': 0, 'bytes': 0}
+    assert snapshot['sinter']['rx_queue']['count'] == 0
+    with open(tmp_path / 'memory.json') as handle:
+        assert load(handle)['fs']['inodes']['count'] == 11
+    assert deep_size([bytes(1000) for _ in range(1000)]) > 1000000 # Extrapolated from a sample
+    assert deep_size([bytes(1000)] * 1000) < 100000 # One object, not a thousand
+
+def test_allocation_tracker():
+    protocol = load_protocol()
+    handlers = mk_bench_handlers(direntries=10)
+    kept = []
+    async def leaky_getattr(header, parsed):
+        kept.append(bytearray(10000))
+        return 0, {'attr': {'ino': header.nodeid}}
+    handlers['FUSE_GETATTR'] = leaky_getattr
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, handlers) as server:
+            tracker = AllocationTracker(server.operations)
+            tracker.start()
+            try:
+                for _ in range(50):
+                    _call(kernel, 'FUSE_GETATTR', {})
+                    _call(kernel, 'FUSE_LOOKUP', {'name': b'file'})
+                growth = tracker.diff()
+            finally:
+                tracker.stop()
+    finally:
+        kernel.close_server()
+    assert growth['FUSE_GETATTR']['bytes'] >= 50 * 10000
+    assert growth['FUSE_GETATTR']['count'] >= 50
+    assert growth.get('FUSE_LOOKUP', {'bytes': 0})['bytes'] < 10000
+
+def test_memory_signal(tmp_path):
+    path = tmp_path / 'memory.json'
+    def install(ops, s):
+        install_memory_signal(MemoryAccounting(operations=ops, sinter=s), SIGUSR1, str(path))
+    def client(kernel, ops):
+        _call(kernel, 'FUSE_GETATTR', {})
+        kill(getpid(), SIGUSR1)
+        return wait_for(path.exists)
+    assert serve_main(load_protocol(), mk_bench_handlers(direntries=10), install, client)
+    with open(path) as handle:
+        report = load(handle)
+    assert set(report) == {'process', 'operations', 'sinter'}
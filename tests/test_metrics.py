@@ -0,0 +1,25 @@
+from pysinter.loopback import run_workload
+from pysinter.metrics import Metrics, Histogram, format_prometheus
+from tests.test_loopback import load_protocol
+
+def test_histogram():
+    hist = Histogram()
+    for value in range(1, 10001):
+        hist.record(value)
+    assert hist.count == 10000 and hist.max == 10000
+    assert abs(hist.quantile(0.5) - 5000) < 5000 / 16
+    assert abs(hist.quantile(0.99) - 9900) < 9900 / 16
+
+def test_metrics_loopback():
+    protocol = load_protocol()
+    metrics = Metrics()
+    run_workload(protocol, 'metadata', count=100, depth=4, metrics=metrics)
+    snapshot = metrics.snapshot()
+    lookup = snapshot['opcodes']['FUSE_LOOKUP']
+    getattr_ = snapshot['opcodes']['FUSE_GETATTR']
+    assert lookup['requests'] + getattr_['requests'] == 100
+    assert set(lookup['phases']) == {'queue', 'handler', 'format', 'write'}
+    assert snapshot['inflight'] == 0
+    text = format_prometheus(snapshot)
+    assert 'pysinter_requests_total{opcode="FUSE_LOOKUP"}' in text
+    assert 'pysinter_gauge' not in text and 'pysinter_rx_depth' in text
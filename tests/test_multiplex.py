@@ -0,0 +1,88 @@
+from asyncio import run
+from errno import ENOENT
+from logging import getLogger
+from threading import Thread
+from time import sleep
+
+from pysinter.loopback import FakeKernel, mk_bench_handlers
+from pysinter import multiplex
+from pysinter.multiplex import Multiplexer
+from tests.test_loopback import load_protocol
+
+def test_multiplexer():
+    protocol = load_protocol()
+    kernels = [FakeKernel(protocol) for _ in range(3)]
+    mux = Multiplexer(protocol, getLogger(__name__))
+    for num, kernel in enumerate(kernels):
+        handlers = mk_bench_handlers(direntries=10)
+        async def getattr_mount(header, parsed, num=num):
+            return 0, {'attr': {'ino': header.nodeid, 'size': num}}
+        handlers['FUSE_GETATTR'] = getattr_mount
+        mux.add(f'mount{num}', kernel.fd, handlers)
+    thread = Thread(target=run, args=(mux.serve(),), daemon=True)
+    thread.start()
+    try:
+        for _ in range(5):
+            for kernel in kernels:
+                kernel.request('FUSE_GETATTR', {}, nodeid=7)
+        for num, kernel in enumerate(kernels):
+            for _ in range(5):
+                _, errno, body = kernel.recv()
+                assert errno == 0
+                assert kernel.parse_reply('FUSE_GETATTR', body)['attr']['size'] == num
+        kernels[1].request('FUSE_READ', {'fh': 1, 'offset': 0, 'size': 16}, nodeid=2)
+        assert kernels[1].recv()[1:] == (0, bytes(16))
+        kernels[2].close() # Unmounted, the others keep going
+        kernels[0].request('FUSE_GETATTR', {}, nodeid=7)
+        assert kernels[0].recv()[1] == 0
+        for _ in range(100):
+            if mux.mounts() == ['mount0', 'mount1']:
+                break
+            sleep(0.01)
+        snapshot = mux.snapshot()
+        assert 'mount2' not in snapshot
+        assert snapshot['mount0']['requests'] == 6
+        assert snapshot['mount1']['metrics']['opcodes']['FUSE_GETATTR']['requests'] == 5
+        assert snapshot['mount1']['metrics']['opcodes']['FUSE_READ']['requests'] == 1
+        ops = [mount.operations for mount in mux._mounts.values()]
+        assert ops[0]._formatter_response is ops[1]._formatter_response
+        assert ops[0]._plans is ops[1]._plans
+    finally:
+        mux.stop()
+        thread.join(10)
+        for kernel in kernels:
+            kernel.close_server()
+    assert not thread.is_alive()
+    assert mux.mounts() == []
+
+def test_multiplexer_reply_dropped(monkeypatch):
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    mux = Multiplexer(protocol, getLogger(__name__))
+    mux.add('mount', kernel.fd, mk_bench_handlers(direntries=10))
+    writev = multiplex.writev
+    dropped = []
+    def interrupted_writev(fd, buffers):
+        if not dropped:
+            dropped.append(fd)
+            raise OSError(ENOENT, 'Request interrupted')
+        return writev(fd, buffers)
+    monkeypatch.setattr(multiplex, 'writev', interrupted_writev)
+    thread = Thread(target=run, args=(mux.serve(),), daemon=True)
+    thread.start()
+    try:
+        kernel.request('FUSE_GETATTR', {}, nodeid=7) # Its reply is dropped
+        unique = kernel.request('FUSE_GETATTR', {}, nodeid=7)
+        assert kernel.recv()[:2] == (unique, 0)
+        assert dropped and mux.mounts() == ['mount']
+        assert mux.snapshot()['mount']['requests'] == 2
+        for _ in range(100): # Forgotten once done
+            if not mux._tasks:
+                break
+            sleep(0.01)
+        assert not mux._tasks
+    finally:
+        mux.stop()
+        thread.join(10)
+        kernel.close_server()
+    assert not thread.is_alive()
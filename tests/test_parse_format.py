@@ -1,18 +1,22 @@
 
 from json import dumps, load
 from logging import getLogger
+from os.path import dirname, join as pjoin
 
 from pysinter.dynamic import Operations
 # from pysinter.examples.hello import FS_HELLO
 
-PROTOSOURCE = '../sinter/protocol/protocol.json'
+PROTOSOURCE = pjoin(dirname(__file__), 'protocol.json')
 VERSION = 'v7.31'
 LOGGER = getLogger(__name__)
 
-def mk_operations():
+def mk_protocol():
     with open(PROTOSOURCE) as handle:
         protocol = load(handle)
-    return Operations(LOGGER, protocol[VERSION], {})
+    return protocol[VERSION]
+
+def mk_operations():
+    return Operations(LOGGER, mk_protocol(), {})
 
 def test_mk_operations():
     mk_operations()
@@ -22,7 +26,7 @@ def test_generate_fields():
     for k, v in ops._opcode_name_to_value.items():
         try:
             res = ops.format(v, {})
-        except (ConnectionError, NotImplementedError):
+        except (ValueError, NotImplementedError):
             continue
         LOGGER.debug('Opcode %s result %s', k, res.hex())
 
@@ -31,8 +35,78 @@ def test_generate_parse():
     for k, v in ops._opcode_name_to_value.items():
         try:
             res = ops.format(v, {})
-        except (ConnectionError, NotImplementedError):
+        except (ValueError, NotImplementedError):
             continue
         fields = ops.parse_output(v, res)
         LOGGER.debug('Opcode %s result %s', k, fields)
 
+def test_sample_roundtrip():
+    from pysinter.samples import mk_samples
+    ops = mk_operations()
+    protocol = mk_protocol()
+    formatters = {
+        'request': ops._formatter_request
+        , 'response': ops._formatter_response
+        }
+    for opname, direction, sample in mk_samples(protocol):
+        fmt = formatters[direction][ops._opcode_name_to_value[opname]]
+        msg = b''.join(field for _, field in fmt.generate_fields(sample))
+        parsed = fmt.parse(msg)
+        assert b''.join(field for _, field in fmt.generate_fields(parsed)) == msg, opname
+        if opname not in ('FUSE_READDIR', 'FUSE_READDIRPLUS'): # Dirent names are not delimited
+            assert parsed == sample, (opname, direction)
+
+def test_codec_benchmark_compare():
+    from benchmarks.codec import compare
+    baseline = {'dynamic': {'A': {'parse': 100, 'format': 100, 'calibration': 10}}}
+    results = {'dynamic': {'A': {'parse': 100, 'format': 50, 'calibration': 20}}}
+    (_, parse, parse_ratio, _), (_, format_, format_ratio, _) = compare(results, baseline, 0.3)
+    assert (parse, parse_ratio) == ('parse', 0.5)
+    assert (format_, format_ratio) == ('format', 0.25)
+
+def test_request_view():
+    ops = mk_operations()
+    for k, v in ops._opcode_name_to_value.items():
+        try:
+            msg = b''.join(
+                field for _, field
+                in ops._formatter_request[v].generate_fields({})
+                )
+        except (ConnectionError, NotImplementedError, ValueError):
+            continue
+        view = ops.view(v, msg)
+        assert dict(view) == ops.parse(v, msg), k
+
+def _parse_or_error(parse, msg):
+    try:
+        return parse(msg)
+    except ValueError:
+        return ValueError
+
+def test_request_view_samples():
+    from pysinter.samples import mk_samples
+    ops = mk_operations()
+    for opname, direction, sample in mk_samples(mk_protocol()):
+        if direction != 'request':
+            continue
+        opcode = ops._opcode_name_to_value[opname]
+        fmt = ops._formatter_request[opcode]
+        msg = b''.join(field for _, field in fmt.generate_fields(sample))
+        assert dict(ops.view(opcode, msg)) == ops.parse(opcode, msg), opname
+        for bad in (msg[:-1], msg[:len(msg) // 2], msg + bytes(8)):
+            expected = _parse_or_error(fmt.parse, bad)
+            assert _parse_or_error(lambda inpt: dict(fmt.view(inpt)), bad) == expected, (opname, len(bad))
+
+def test_reply_cache():
+    from pysinter.dynamic import FrozenReply
+    ops = mk_operations()
+    opcode = ops._opcode_name_to_value['FUSE_GETATTR']
+    reply = FrozenReply({'attr': {'ino': 2, 'size': 13}})
+    first = ops.format(opcode, reply)
+    assert ops.format(opcode, FrozenReply(reply)) is first
+    assert first == ops.format(opcode, dict(reply))
+    stats = ops.reply_cache_stats()['FUSE_GETATTR']
+    assert (stats['hits'], stats['misses']) == (1, 1)
+    ops.invalidate_reply(reply, 'FUSE_GETATTR')
+    ops.format(opcode, reply)
+    assert ops.reply_cache_stats()['FUSE_GETATTR']['misses'] == 2
@@ -0,0 +1,289 @@
+from asyncio import run, sleep
+from errno import ENODATA, ERANGE
+from os import O_DIRECTORY, O_RDONLY, O_RDWR, O_TRUNC, SEEK_DATA, SEEK_HOLE, getuid, getxattr, setxattr
+from stat import S_IFDIR, S_IFLNK, S_IFREG, S_IMODE
+
+from pytest import raises
+
+from pysinter import FUSEError, Header, ROOT_INODE
+from pysinter.constants import FATTR_SIZE, FATTR_UID, FUSE_HANDLE_KILLPRIV, FUSE_HANDLE_KILLPRIV_V2
+from pysinter.examples.fdpool import FdPool
+from pysinter.examples.passthrough import Passthrough
+from pysinter.examples.prefetch import StatPrefetch
+from pysinter.examples.xattrcache import CAPABILITY
+
+FALLOC_FL_KEEP_SIZE = 0x01
+FALLOC_FL_PUNCH_HOLE = 0x02
+CAP_NET_BIND_SERVICE = b'\x01\x00\x00\x02\x00\x04\x00\x00' + bytes(12) # VFS_CAP_REVISION_2, effective
+
+def _header(ino, opcode=0):
+    return Header(opcode, 1, ino, 0, 0, 0)
+
+def _open(pt, name, flags):
+    _, res = run(pt.lookup(_header(ROOT_INODE), {'name': name}))
+    ino = res['entry'][0]['nodeId']
+    _, res = run(pt.open(_header(ino), {'flags': flags}))
+    return ino, res['fh']
+
+def test_copy_file_range(tmp_path):
+    src = tmp_path / 'src'
+    dst = tmp_path / 'dst'
+    src.write_bytes(bytes(range(256)) * 1024)
+    dst.write_bytes(b'')
+    pt = Passthrough(str(tmp_path))
+    ino_in, fh_in = _open(pt, b'src', O_RDONLY)
+    ino_out, fh_out = _open(pt, b'dst', O_RDWR)
+    try:
+        _, res = run(pt.copy_file_range(_header(ino_in), {
+            'fhIn': fh_in, 'offIn': 1024, 'nodeidOut': ino_out
+            , 'fhOut': fh_out, 'offOut': 0, 'len': 4096, 'flags': 0
+            }))
+    finally:
+        pt.close()
+    assert res['size'] == 4096
+    assert dst.read_bytes() == src.read_bytes()[1024:5120]
+
+def test_fallocate_lseek(tmp_path):
+    path = tmp_path / 'sparse'
+    path.write_bytes(b'x' * (1 << 20))
+    pt = Passthrough(str(tmp_path))
+    ino, fd = _open(pt, b'sparse', O_RDWR)
+    try:
+        run(pt.fallocate(_header(ino), {'fh': fd, 'offset': 0, 'length': 2 << 20, 'mode': 0}))
+        assert path.stat().st_size == 2 << 20
+        try:
+            run(pt.fallocate(_header(ino), {
+                'fh': fd, 'offset': 0, 'length': 1 << 19
+                , 'mode': FALLOC_FL_PUNCH_HOLE | FALLOC_FL_KEEP_SIZE
+                }))
+        except FUSEError: # Not every filesystem can punch holes
+            return None
+        assert path.stat().st_size == 2 << 20
+        _, res = run(pt.lseek(_header(ino), {'fh': fd, 'offset': 0, 'whence': SEEK_HOLE}))
+        assert res['offset'] == 0
+        _, res = run(pt.lseek(_header(ino), {'fh': fd, 'offset': 0, 'whence': SEEK_DATA}))
+        assert res['offset'] == 1 << 19
+        with raises(FUSEError):
+            run(pt.lseek(_header(ino), {'fh': fd, 'offset': 3 << 20, 'whence': SEEK_DATA}))
+    finally:
+        pt.close()
+
+def test_rename_keeps_handles(tmp_path):
+    (tmp_path / 'a' / 'b').mkdir(parents=True)
+    (tmp_path / 'a' / 'b' / 'f').write_bytes(b'content')
+    (tmp_path / 'c').mkdir()
+    pt = Passthrough(str(tmp_path), dirfds=2)
+    async def lookup(parent, name):
+        _, res = await pt.lookup(_header(parent), {'name': name})
+        return res['entry'][0]['nodeId']
+    async def scenario():
+        a = await lookup(ROOT_INODE, b'a')
+        b = await lookup(a, b'b')
+        f = await lookup(b, b'f')
+        c = await lookup(ROOT_INODE, b'c')
+        await pt.rename(_header(ROOT_INODE), {'newdir': c, 'oldname': b'a', 'newname': b'moved'})
+        assert (tmp_path / 'c' / 'moved' / 'b' / 'f').exists()
+        _, res = await pt.getattr(_header(f), {})
+        assert res['attr']['size'] == 7
+        _, res = await pt.open(_header(f), {'flags': O_RDONLY})
+        fh = res['fh']
+        _, res = await pt.read(_header(f), {'fh': fh, 'offset': 0, 'size': 7})
+        assert res['data'] == b'content'
+        await pt.release(_header(f), {'fh': fh})
+        await pt.unlink(_header(b), {'name': b'f'})
+        with raises(FUSEError):
+            await pt.getattr(_header(f), {})
+        return None
+    try:
+        run(scenario())
+        assert pt._dirfds.stats()['evictions'] > 0
+    finally:
+        pt.close()
+
+def test_fd_sharing(tmp_path):
+    (tmp_path / 'data').write_bytes(b'abc')
+    pool = FdPool(max_idle=1, idle_timeout=60)
+    pt = Passthrough(str(tmp_path), fdpool=pool)
+    try:
+        ino, first = _open(pt, b'data', O_RDONLY)
+        _, second = _open(pt, b'data', O_RDONLY)
+        _, third = _open(pt, b'data', O_RDWR)
+        assert (first, second, third) == (0, 1, 2)
+        assert pt._fd(first) == pt._fd(second) != pt._fd(third)
+        for fh in (first, second, third):
+            run(pt.release(_header(ino), {'fh': fh}))
+        assert pool.stats() == {'open': 1, 'idle': 1, 'hits': 1, 'opens': 2, 'evictions': 1}
+        _, fh = _open(pt, b'data', O_RDWR) # Still open from before
+        assert fh == 0 and pool.hits == 2
+        _, res = run(pt.read(_header(ino), {'fh': fh, 'offset': 1, 'size': 2}))
+        assert res['data'] == b'bc'
+        run(pt.unlink(_header(ROOT_INODE), {'name': b'data'}))
+        run(pt.release(_header(ino), {'fh': fh}))
+        with raises(FUSEError):
+            run(pt.release(_header(ino), {'fh': fh}))
+        assert pool.stats()['open'] == 1
+        pool.discard(ino)
+        assert pool.stats()['open'] == 0
+    finally:
+        pt.close()
+
+def test_readdir_prefetch(tmp_path):
+    for name in ('a', 'b', 'c'):
+        (tmp_path / name).write_bytes(name.encode() * 3)
+    (tmp_path / 'sub').mkdir()
+    (tmp_path / 'link').symlink_to('a')
+    prefetch = StatPrefetch(ttl=60)
+    pt = Passthrough(str(tmp_path), prefetch=prefetch)
+    async def lookup(name):
+        _, res = await pt.lookup(_header(ROOT_INODE), {'name': name})
+        return res['entry'][0]
+    async def scenario():
+        _, res = await pt.opendir(_header(ROOT_INODE), {'flags': O_RDONLY | O_DIRECTORY})
+        fh = res['fh']
+        _, res = await pt.readdir(_header(ROOT_INODE), {'fh': fh, 'cookie': 0, 'size': 4096})
+        await pt.releasedir(_header(ROOT_INODE), {'fh': fh})
+        types = {entry['name']: entry['type'] << 12 for entry in res['data']}
+        assert types == {b'a': S_IFREG, b'b': S_IFREG, b'c': S_IFREG, b'sub': S_IFDIR, b'link': S_IFLNK}
+        while prefetch.stats()['size'] < 5:
+            await sleep(0.01)
+        entry = await lookup(b'a')
+        assert entry['attr']['size'] == 3
+        assert entry['nodeId'] == {e['name']: e['ino'] for e in res['data']}[b'a']
+        _, res = await pt.open(_header(entry['nodeId']), {'flags': O_RDWR})
+        await pt.write(_header(entry['nodeId']), {'fh': res['fh'], 'offset': 0, 'size': 5, 'data': b'xxxxx'})
+        await pt.release(_header(entry['nodeId']), {'fh': res['fh']})
+        assert (await lookup(b'link'))['attr']['timeandmode']['mode'] & S_IFLNK
+        await pt.unlink(_header(ROOT_INODE), {'name': b'b'})
+        with raises(FUSEError):
+            await lookup(b'b')
+        assert (await lookup(b'a'))['attr']['size'] == 5 # Taken already, stat'ed again
+        return None
+    try:
+        run(scenario())
+    finally:
+        pt.close()
+    assert prefetch.stats() == {'prefetched': 5, 'hits': 2, 'misses': 2, 'wasted': 0, 'size': 2}
+
+def test_xattrs_killpriv(tmp_path):
+    path = tmp_path / 'f'
+    path.write_bytes(b'')
+    try:
+        setxattr(path, 'user.a', b'value')
+    except OSError: # No user xattrs here
+        return None
+    probe = tmp_path / 'probe'
+    probe.write_bytes(b'')
+    try:
+        setxattr(probe, CAPABILITY, CAP_NET_BIND_SERVICE)
+        capable = True
+    except OSError: # Needs CAP_SETFCAP
+        capable = False
+    path.chmod(0o6755)
+    pt = Passthrough(str(tmp_path))
+    def has_capability():
+        try:
+            getxattr(path, CAPABILITY)
+        except OSError as e:
+            assert e.errno == ENODATA
+            return False
+        return True
+    async def privileged(ino):
+        path.chmod(0o6755)
+        if capable:
+            await pt.setxattr(_header(ino), {'name': CAPABILITY, 'value': CAP_NET_BIND_SERVICE, 'size': len(CAP_NET_BIND_SERVICE), 'flags': 0})
+        return None
+    async def setattr(ino, valid, **fields):
+        timeandmode = {'mode': 0, 'atime': 0, 'atimensec': 0, 'mtime': 0, 'mtimensec': 0, 'ctime': 0, 'ctimensec': 0}
+        return await pt.setattr(_header(ino), dict({'valid': valid, 'fh': 0, 'size': 0, 'uid': 0, 'gid': 0, 'timeandmode': timeandmode}, **fields))
+    async def scenario():
+        _, res = await pt.init(_header(ROOT_INODE), {
+            'major': 7, 'minor': 31, 'flags': FUSE_HANDLE_KILLPRIV | FUSE_HANDLE_KILLPRIV_V2
+            })
+        assert res['flags'] == FUSE_HANDLE_KILLPRIV
+        _, res = await pt.lookup(_header(ROOT_INODE), {'name': b'f'})
+        ino = res['entry'][0]['nodeId']
+        assert await pt.getxattr(_header(ino), {'name': b'user.a', 'size': 0}) == (0, {'size': 5})
+        assert await pt.getxattr(_header(ino), {'name': b'user.a', 'size': 64}) == (0, b'value')
+        with raises(FUSEError) as info:
+            await pt.getxattr(_header(ino), {'name': b'user.a', 'size': 2})
+        assert info.value.errno == ERANGE
+        for _ in range(3):
+            with raises(FUSEError) as info:
+                await pt.getxattr(_header(ino), {'name': CAPABILITY, 'size': 0})
+            assert info.value.errno == ENODATA
+        assert pt._xattrs.stats()['negative_hits'] == 2
+        await pt.setxattr(_header(ino), {'name': b'user.b', 'value': b'xy', 'size': 2, 'flags': 0})
+        _, names = await pt.listxattr(_header(ino), {'size': 64})
+        assert sorted(names.split(b'\x00')[:-1]) == [b'user.a', b'user.b']
+        await pt.removexattr(_header(ino), {'name': b'user.a'})
+        with raises(FUSEError):
+            await pt.getxattr(_header(ino), {'name': b'user.a', 'size': 0})
+        await privileged(ino)
+        assert has_capability() == capable
+        _, res = await pt.open(_header(ino), {'flags': O_RDWR})
+        await pt.write(_header(ino), {'fh': res['fh'], 'offset': 0, 'size': 1, 'data': b'x', 'writeFlags': 0})
+        await pt.release(_header(ino), {'fh': res['fh']})
+        # Gone from the file, not just from the cache
+        assert S_IMODE(path.stat().st_mode) == 0o755 and not has_capability()
+        with raises(FUSEError) as info:
+            await pt.getxattr(_header(ino), {'name': CAPABILITY, 'size': 0})
+        assert info.value.errno == ENODATA
+        await privileged(ino)
+        _, res = await pt.open(_header(ino), {'flags': O_RDWR | O_TRUNC})
+        await pt.release(_header(ino), {'fh': res['fh']})
+        assert S_IMODE(path.stat().st_mode) == 0o755 and not has_capability()
+        await privileged(ino)
+        _, res = await setattr(ino, FATTR_SIZE, size=3)
+        assert res['attr']['size'] == 3 and path.stat().st_size == 3
+        assert S_IMODE(path.stat().st_mode) == 0o755 and not has_capability()
+        await privileged(ino)
+        await setattr(ino, FATTR_UID, uid=getuid())
+        assert S_IMODE(path.stat().st_mode) == 0o755 and not has_capability()
+        # Known to be absent, no removexattr needed
+        negative_hits = pt._xattrs.stats()['negative_hits']
+        _, res = await pt.open(_header(ino), {'flags': O_RDWR})
+        await pt.write(_header(ino), {'fh': res['fh'], 'offset': 0, 'size': 1, 'data': b'x', 'writeFlags': 0})
+        await pt.release(_header(ino), {'fh': res['fh']})
+        assert pt._xattrs.stats()['negative_hits'] == negative_hits + 1
+        return None
+    try:
+        run(scenario())
+    finally:
+        pt.close()
+
+def test_inode_index_restart(tmp_path):
+    root = tmp_path / 'root'
+    (root / 'a' / 'b').mkdir(parents=True)
+    (root / 'a' / 'b' / 'f').write_bytes(b'content')
+    (root / 'g').write_bytes(b'old')
+    index = str(tmp_path / 'index')
+    pt = Passthrough(str(root), index=index)
+    async def lookup(parent, name):
+        _, res = await pt.lookup(_header(parent), {'name': name})
+        return res['entry'][0]['nodeId']
+    async def first_run():
+        a = await lookup(ROOT_INODE, b'a')
+        b = await lookup(a, b'b')
+        return await lookup(b, b'f'), await lookup(ROOT_INODE, b'g')
+    try:
+        f, g = run(first_run())
+    finally:
+        pt.close()
+    (root / 'h').write_bytes(b'')
+    (root / 'h').rename(root / 'g') # Same name, different inode
+    pt = Passthrough(str(root), index=index)
+    async def second_run():
+        _, res = await pt.getattr(_header(f), {})
+        assert res['attr']['size'] == 7
+        _, res = await pt.open(_header(f), {'flags': O_RDONLY})
+        _, data = await pt.read(_header(f), {'fh': res['fh'], 'offset': 0, 'size': 100})
+        assert data['data'] == b'content'
+        await pt.release(_header(f), {'fh': res['fh']})
+        with raises(FUSEError):
+            await pt.getattr(_header(g), {})
+        return None
+    try:
+        run(second_run())
+        assert len(pt._nodes) == 5 # The root, a, b, f and the stale g
+    finally:
+        pt.close()
@@ -0,0 +1,115 @@
+from asyncio import run
+from logging import getLogger
+from os import getpid, kill, listdir
+from pstats import Stats
+from signal import SIGUSR2
+from sys import getswitchinterval
+from threading import Thread
+from time import sleep
+
+from pysinter import FUSEUnmountError, Sinter
+from pysinter.__main__ import serve
+from pysinter.dynamic import Operations
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers, drive, generate_requests, parse_mix
+from pysinter.profiling import install_profile_signal
+from tests.test_loopback import load_protocol
+from tests.test_splice import _call
+
+LOGGER = getLogger(__name__)
+
+def _profile_run(tmp_path, mode, **kwargs):
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, mk_bench_handlers(direntries=500)) as server:
+            server.operations.arm_profiler(['FUSE_READDIR'], str(tmp_path), mode=mode, **kwargs)
+            drive(kernel, generate_requests(parse_mix('readdir=1,getattr=1'), 40), 4)
+            server.operations.disarm_profiler()
+    finally:
+        kernel.close_server()
+    return sorted(listdir(tmp_path))
+
+def test_profile_cprofile(tmp_path):
+    written = _profile_run(tmp_path, 'cprofile', requests=5)
+    assert written == [
+        'FUSE_READDIR.format.pstats'
+        , 'FUSE_READDIR.handler.pstats'
+        , 'FUSE_READDIR.parse.pstats'
+        ]
+    stats = Stats(str(tmp_path / 'FUSE_READDIR.format.pstats'))
+    assert any(func[2] == 'format' for func in stats.stats)
+    # Fields are decoded when the handler reads them, counted under parse
+    decoded = lambda name: any(
+        func[0].endswith('dynamic.py') and func[2] == '__get__'
+        for func in Stats(str(tmp_path / name)).stats
+        )
+    assert decoded('FUSE_READDIR.parse.pstats')
+    assert not decoded('FUSE_READDIR.handler.pstats')
+
+def test_profile_sample(tmp_path):
+    written = _profile_run(tmp_path, 'sample', duration=30, interval=0.0001)
+    assert written == ['FUSE_READDIR.collapsed']
+    for line in (tmp_path / 'FUSE_READDIR.collapsed').read_text().splitlines():
+        stack, num = line.rsplit(' ', 1)
+        assert stack.split(';')[1] in ('parse', 'handler', 'format') and int(num) > 0
+
+def test_profile_rearm(tmp_path):
+    switchinterval = getswitchinterval()
+    ops = Operations(LOGGER, load_protocol(), mk_bench_handlers(direntries=10))
+    ops.arm_profiler(['FUSE_GETATTR'], str(tmp_path / 'first'), mode='sample')
+    first = ops._profiler
+    ops.arm_profiler(['FUSE_GETATTR'], str(tmp_path / 'second'), mode='sample')
+    assert first.done and not first._sampler.is_alive()
+    ops.disarm_profiler()
+    assert getswitchinterval() == switchinterval
+
+def wait_for(condition, timeout=10):
+    for _ in range(int(timeout * 100)):
+        if condition():
+            return True
+        sleep(0.01)
+    return False
+
+def serve_main(protocol, handlers, install, client):
+    '''
+    Serve handlers the way python -m pysinter does, in this thread so that
+    signals reach the event loop. install(ops, sinter) runs in the loop
+    first, client(kernel, ops) in a thread; the kernel end is closed after.
+    '''
+    kernel = FakeKernel(protocol)
+    s = Sinter(fd=kernel.fd)
+    ops = Operations(LOGGER, protocol, handlers)
+    results = []
+    def run_client():
+        try:
+            results.append(client(kernel, ops))
+        finally:
+            kernel.close()
+    async def main():
+        install(ops, s)
+        thread = Thread(target=run_client)
+        thread.start()
+        try:
+            await serve(s, ops)
+        except FUSEUnmountError:
+            pass
+        thread.join()
+        return None
+    try:
+        run(main())
+    finally:
+        kernel.close_server()
+    return results[0]
+
+def test_profile_signal(tmp_path):
+    def install(ops, s):
+        install_profile_signal(ops, SIGUSR2, ['FUSE_GETATTR'], str(tmp_path))
+    def client(kernel, ops):
+        kill(getpid(), SIGUSR2)
+        armed = wait_for(lambda: ops.profiling)
+        for _ in range(5):
+            _call(kernel, 'FUSE_GETATTR', {})
+        kill(getpid(), SIGUSR2)
+        return armed, wait_for(lambda: not ops.profiling)
+    assert serve_main(load_protocol(), mk_bench_handlers(direntries=10), install, client) == (True, True)
+    assert 'FUSE_GETATTR.handler.pstats' in listdir(tmp_path)
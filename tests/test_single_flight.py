@@ -0,0 +1,59 @@
+from asyncio import create_task, gather, run, sleep
+from errno import ENOENT
+
+from pysinter import FUSEError
+from pysinter.dynamic import SingleFlight
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers
+from tests.test_loopback import load_protocol
+
+def test_single_flight():
+    protocol = load_protocol()
+    handlers = mk_bench_handlers(direntries=10)
+    calls = []
+    async def slow_lookup(header, parsed):
+        calls.append(bytes(parsed['name']))
+        await sleep(0.05)
+        if parsed['name'] == b'missing':
+            raise FUSEError(ENOENT)
+        return 0, {'entry': [{'nodeId': 2, 'attr': {'ino': 2}}]}
+    handlers['FUSE_LOOKUP'] = slow_lookup
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, handlers, single_flight={'FUSE_LOOKUP': None}) as server:
+            names = [b'a'] * 8 + [b'b'] * 2 + [b'missing'] * 3
+            uniques = [kernel.request('FUSE_LOOKUP', {'name': name}) for name in names]
+            replies = {}
+            for _ in names:
+                unique, errno, body = kernel.recv()
+                replies[unique] = errno
+            assert sorted(replies) == sorted(uniques)
+            assert [replies[unique] for unique in uniques] == [0] * 10 + [ENOENT] * 3
+            assert sorted(calls) == [b'a', b'b', b'missing']
+            stats = server.operations.single_flight_stats()['FUSE_LOOKUP']
+            assert (stats['calls'], stats['shared']) == (3, 10)
+            kernel.request('FUSE_LOOKUP', {'name': b'a'}) # Nothing in flight anymore
+            kernel.recv()
+            assert calls.count(b'a') == 2
+    finally:
+        kernel.close_server()
+
+def test_single_flight_cancelled():
+    calls = []
+    async def operation(header, parsed):
+        calls.append(header)
+        await sleep(0.01)
+        return 0, header
+    async def scenario():
+        leader = create_task(flights.run(1, 'key', operation, 'first', None))
+        await sleep(0)
+        waiters = [create_task(flights.run(1, 'key', operation, name, None)) for name in ('second', 'third')]
+        await sleep(0)
+        leader.cancel()
+        results = await gather(*waiters) # Retried rather than cancelled along
+        assert leader.cancelled()
+        return results
+    flights = SingleFlight({1: None})
+    assert run(scenario()) == [(0, 'second'), (0, 'second')]
+    assert calls == ['first', 'second']
+    stats = flights.stats()[1]
+    assert (stats['calls'], stats['shared']) == (2, 1)
@@ -0,0 +1,76 @@
+from os import O_RDWR, urandom
+
+from pytest import mark
+
+from pysinter.examples.passthrough import Passthrough
+from pysinter.loopback import BENCH_INODE_FILE, FakeKernel, LoopbackServer, mk_bench_handlers
+from pysinter.splice import PipePool, splice_available
+from tests.test_loopback import load_protocol
+
+def _call(kernel, opname, fields, nodeid=1):
+    unique = kernel.request(opname, fields, nodeid=nodeid)
+    res_unique, errno, body = kernel.recv()
+    assert (res_unique, errno) == (unique, 0), opname
+    return kernel.parse_reply(opname, body)
+
+@mark.parametrize('splice', (False, True))
+def test_splice_roundtrip(tmp_path, splice):
+    if splice and not splice_available():
+        return None
+    content = urandom(200000)
+    (tmp_path / 'data').write_bytes(content)
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, Passthrough(str(tmp_path), splice=splice).make(), splice=splice) as server:
+            entry, = _call(kernel, 'FUSE_LOOKUP', {'name': b'data'})['entry']
+            ino = entry['nodeId']
+            fh = _call(kernel, 'FUSE_OPEN', {'flags': O_RDWR}, nodeid=ino)['fh']
+            read = _call(kernel, 'FUSE_READ', {'fh': fh, 'offset': 1000, 'size': 65536}, nodeid=ino)
+            assert read['data'] == content[1000:66536]
+            read = _call(kernel, 'FUSE_READ', {'fh': fh, 'offset': 190000, 'size': 65536}, nodeid=ino)
+            assert read['data'] == content[190000:] # Short at end of file
+            written = _call(kernel, 'FUSE_WRITE', {
+                'fh': fh, 'offset': 10, 'size': 50000, 'data': b'w' * 50000
+                }, nodeid=ino)
+            assert written['size'] == 50000
+            _call(kernel, 'FUSE_RELEASE', {'fh': fh}, nodeid=ino)
+            transport = server.sinter._splice
+            if splice:
+                assert transport.spliced_replies == 2 and transport.spliced_requests == 1
+            else:
+                assert transport is None
+    finally:
+        kernel.close_server()
+    assert (tmp_path / 'data').read_bytes() == content[:10] + b'w' * 50000 + content[50010:]
+
+def test_splice_unmarked_write():
+    if not splice_available():
+        return None
+    protocol = load_protocol()
+    kernel = FakeKernel(protocol)
+    try:
+        with LoopbackServer(kernel, protocol, mk_bench_handlers(direntries=10), splice=True) as server:
+            for size in (5000, 7000):
+                written = _call(kernel, 'FUSE_WRITE', {
+                    'fh': 1, 'offset': 0, 'size': size, 'data': b'w' * size
+                    }, nodeid=BENCH_INODE_FILE)
+                assert written['size'] == size # The data arrived in parsed['data']
+            assert server.sinter._splice.spliced_requests == 2
+    finally:
+        kernel.close_server()
+
+def test_pipe_pool_limit():
+    if not splice_available():
+        return None
+    pool = PipePool(1 << 16, maxsize=2)
+    first, second = pool.get(), pool.get()
+    assert pool.get() is None
+    pool.discard(first)
+    third = pool.get()
+    assert third is not None
+    pool.put(second)
+    assert pool.get() is second
+    for pipe in (second, third):
+        pool.discard(pipe)
+    pool.close()
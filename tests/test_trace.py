@@ -0,0 +1,45 @@
+from asyncio import run, sleep
+from logging import getLogger
+
+from pysinter.dynamic import Operations
+from pysinter.loopback import FakeKernel, LoopbackServer, mk_bench_handlers, drive, generate_requests, parse_mix
+from pysinter.trace import read_trace, replay, TRACE_SESSION, TRACE_REQUEST, TRACE_REPLY
+from tests.test_loopback import load_protocol
+
+LOGGER = getLogger(__name__)
+
+def test_capture_replay(tmp_path):
+    protocol = load_protocol()
+    path = str(tmp_path / 'trace.bin')
+    kernel = FakeKernel(protocol)
+    with LoopbackServer(kernel, protocol, mk_bench_handlers(direntries=100), trace=path):
+        requests = generate_requests(parse_mix('lookup=1,getattr=1,write=1'), 50)
+        drive(kernel, requests, depth=4)
+    kernel.close_server()
+    kinds = [kind for kind, _, _ in read_trace(path)]
+    assert kinds[0] == TRACE_SESSION
+    assert kinds.count(TRACE_REQUEST) == kinds.count(TRACE_REPLY) == 50
+    ops = Operations(LOGGER, protocol, mk_bench_handlers(direntries=100))
+    elapsed, latencies, mismatches = run(replay(path, ops, verify=True))
+    assert sum(len(values) for values in latencies.values()) == 50
+    assert mismatches == 0
+
+def test_replay_sessions(tmp_path):
+    protocol = load_protocol()
+    path = str(tmp_path / 'trace.bin')
+    for mix in ('lookup=1', 'getattr=1'): # Uniques start over in each session
+        kernel = FakeKernel(protocol)
+        with LoopbackServer(kernel, protocol, mk_bench_handlers(direntries=100), trace=path):
+            drive(kernel, generate_requests(parse_mix(mix), 20), depth=4)
+        kernel.close_server()
+    assert [kind for kind, _, _ in read_trace(path)].count(TRACE_SESSION) == 2
+    handlers = mk_bench_handlers(direntries=100)
+    for name in ('FUSE_LOOKUP', 'FUSE_GETATTR'): # Keep requests of both sessions in flight together
+        async def yielding(header, parsed, handler=handlers[name]):
+            await sleep(0)
+            return await handler(header, parsed)
+        handlers[name] = yielding
+    ops = Operations(LOGGER, protocol, handlers)
+    elapsed, latencies, mismatches = run(replay(path, ops, verify=True, depth=64))
+    assert sum(len(values) for values in latencies.values()) == 40
+    assert mismatches == 0
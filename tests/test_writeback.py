@@ -0,0 +1,85 @@
+from asyncio import run, sleep
+from errno import ENOSPC
+from os import O_RDWR, open as osopen, pwrite
+
+from pytest import raises
+
+from pysinter import FUSEError, Header, ROOT_INODE
+from pysinter.examples.blockcache import BlockCache
+from pysinter.examples.passthrough import Passthrough
+from pysinter.examples.writeback import WriteBehind
+
+def _header(ino):
+    return Header(16, 1, ino, 0, 0, 0)
+
+def test_writeback_coalesces(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(b'')
+    writeback = WriteBehind(max_bytes=1 << 16, max_delay=0.01)
+    pt = Passthrough(str(tmp_path), writeback=writeback)
+    ino = path.stat().st_ino
+    async def scenario():
+        await pt.lookup(_header(ROOT_INODE), {'name': b'data'})
+        _, opened = await pt.open(_header(ino), {'flags': O_RDWR})
+        fh = opened['fh']
+        for offset in range(0, 40960, 4096):
+            block = bytes([offset // 4096]) * 4096
+            await pt.write(_header(ino), {'fh': fh, 'offset': offset, 'size': 4096, 'data': block})
+        assert writeback.pwrites == 0 and path.stat().st_size == 0
+        _, res = await pt.read(_header(ino), {'fh': fh, 'offset': 8192, 'size': 10})
+        assert res['data'] == b'\x02' * 10 # Overlapping read flushed
+        assert writeback.pwrites == 1
+        await pt.write(_header(ino), {'fh': fh, 'offset': 0, 'size': 1, 'data': b'x'})
+        await sleep(0.05) # Time threshold
+        assert writeback.pwrites == 2 and path.read_bytes()[:1] == b'x'
+        await pt.write(_header(ino), {'fh': fh, 'offset': 100, 'size': 1, 'data': b'y'})
+        await pt.fsync(_header(ino), {'fh': fh, 'fsyncFlags': 1})
+        assert path.read_bytes()[100:101] == b'y'
+        await pt.flush(_header(ino), {'fh': fh})
+        await pt.release(_header(ino), {'fh': fh})
+        return None
+    run(scenario())
+
+def test_writeback_deferred_error():
+    def failing_pwrite(fd, data, offset):
+        raise OSError(ENOSPC, 'No space left on device')
+    writeback = WriteBehind(max_bytes=8, pwrite=failing_pwrite)
+    async def scenario():
+        writeback.write(1, 5, 0, b'0123456789') # Over the threshold, written at once
+        with raises(FUSEError) as e:
+            writeback.write(1, 5, 10, b'a')
+        assert e.value.errno == ENOSPC
+        with raises(FUSEError):
+            writeback.flush(5)
+        writeback.flush(5) # Reported once
+        return None
+    run(scenario())
+
+def test_writeback_with_cache(tmp_path):
+    path = tmp_path / 'data'
+    path.write_bytes(b'a' * 4096)
+    cache = BlockCache(blocksize=1024, budget=8192)
+    writeback = WriteBehind(max_bytes=1 << 16, max_delay=10)
+    pt = Passthrough(str(tmp_path), cache=cache, writeback=writeback)
+    ino = path.stat().st_ino
+    async def scenario():
+        await pt.lookup(_header(ROOT_INODE), {'name': b'data'})
+        _, opened = await pt.open(_header(ino), {'flags': O_RDWR})
+        fh = opened['fh']
+        await pt.write(_header(ino), {'fh': fh, 'offset': 0, 'size': 3, 'data': b'XYZ'})
+        _, res = await pt.read(_header(ino), {'fh': fh, 'offset': 100, 'size': 10})
+        assert bytes(res['data']) == b'a' * 10 # Cached from before the write out
+        _, res = await pt.read(_header(ino), {'fh': fh, 'offset': 0, 'size': 10})
+        assert bytes(res['data']) == b'XYZ' + b'a' * 7
+        # Two handles on one range: the later write lands last
+        _, other = await pt.open(_header(ino), {'flags': O_RDWR})
+        await pt.write(_header(ino), {'fh': fh, 'offset': 0, 'size': 3, 'data': b'one'})
+        await pt.write(_header(ino), {'fh': other['fh'], 'offset': 0, 'size': 3, 'data': b'two'})
+        await pt.release(_header(ino), {'fh': other['fh']})
+        await pt.release(_header(ino), {'fh': fh})
+        return None
+    try:
+        run(scenario())
+    finally:
+        cache.close()
+    assert path.read_bytes()[:4] == b'twoa'